@@ -14,7 +14,7 @@ from osgeo import gdal, osr
 sys.path.insert(0, '/Users/giacomo/code/Playground/Plot_data2/src')
 import argparse
 from datetime import datetime
-from plotdata.utils.argument_parsers import add_date_arguments, add_location_arguments, add_plot_parameters_arguments, add_map_parameters_arguments, add_save_arguments,add_gps_arguments
+from plotdata.utils.argument_parsers import add_date_arguments, add_location_arguments, add_plot_parameters_arguments, add_map_parameters_arguments, add_save_arguments,add_gps_arguments, add_processing_arguments
 
 ############################################################
 EXAMPLE = """example:
@@ -28,6 +28,9 @@ EXAMPLE = """example:
         plot_data.py MaunaLoaSenDT87 --plot-type shaded_relief --seismicity --gps
         plot_data.py MaunaLoaSenDT87 --plot-type velocity --seismicity --gps
         plot_data.py MaunaLoaSenAT124 MaunaLoaSenDT87 --ref-lalo 19.55,-155.45
+        plot_data.py MaunaLoaSenDT87 --subset-lalo 19.3:19.6,-155.8:-155.4 --sliding-window 6M 1M
+        plot_data.py MaunaLoaSenAT124 MaunaLoaSenDT87 --plot-type horzvert --period 20200101:20231231 --dry-run
+        plot_data.py MaunaLoaSenDT87 --plot-type velocity --period 20200101:20231231 --profile profile.json
         plot_data.py MaunaLoaSenDT87/mintpy_5_20  --plot-type velocity
         plot_data.py MaunaLoaSenDT87/mintpy_5_20 MaunaLoaSenAT124/mintpy_5_20 --plot-type velocity --ref-lalo 19.495,-155.555  --period 20181001-20221122 --subset-lalo 19.43:19.5,-155.62:-155.55 --vlim -5 5
         plot_data.py MaunaLoaSenDT87/mintpy_5_20 MaunaLoaSenAT124/mintpy_5_20 --plot-type horzvert --ref-lalo 19.495,-155.555  --period 20181001-20221122 --subset-lalo 19.43:19.5,-155.62:-155.55 --vlim -5 5
@@ -41,6 +44,9 @@ EXAMPLE = """example:
         plot_data.py GalapagosSenDT128/mintpy --plot-type=velocity --period=20200131-20220430
         plot_data.py GalapagosSenDT128/mintpy --plot-type=velocity --subset-lalo=-0.52:-0.28,-91.7:-91.4
         plot_data.py GalapagosSenDT128/mintpy --subset-lalo=-0.86:-0.77:-91.19:-91.07 --ref-lalo=-0.771,-91.19
+        plot_data.py MaunaLoaSenDT87/mintpy_5_20 MaunaLoaSenAT124/mintpy_5_20 --plot-type horzvert --period 20181001-20221122 --jobs 2
+        plot_data.py MaunaLoaSenDT87/mintpy_5_20 MaunaLoaSenAT124/mintpy_5_20 --plot-type horzvert --period 20181001-20221122 --save --outdir figures --save-format png pdf
+        plot_data.py MaunaLoaSenDT87/mintpy_5_20 MaunaLoaSenAT124/mintpy_5_20 --plot-type vectors --period 20181001-20221122 --section -155.62 -155.55 19.47 19.47 --section-sweep 24 0.002
 """
 
 def create_parser():
@@ -57,6 +63,7 @@ def create_parser():
     parser.add_argument("--noreference", dest="show_reference_point",  action='store_false', default=True, help="hide reference point (default: False)" )
     parser.add_argument("--section", dest="line", nargs=4, metavar="LON1 LON2 LAT1 LAT2", type=float, default=None, help="Section coordinates for deformation vectors")
     parser.add_argument("--resample-vector", dest="resample_vector", type=int, default=1, help="resample factor for deformation vectors (default: %(default)s).")
+    parser.add_argument("--section-sweep", dest="section_sweep", nargs=2, metavar=("COUNT", "STEP"), type=float, default=None, help="Also plot the vectors along COUNT sections parallel to --section, STEP degrees apart, in a separate figure (default: %(default)s).")
     # parser.add_argument('--window_size', dest='window_size', type=int, default=3, help='window size (square side in number of pixels) for reference point look up (default: %(default)s).')
     # parser.add_argument('--lat-step', dest='lat_step', type=float, default=None, help='latitude step for geocoding (default: %(default)s).')
     # parser.add_argument('--subset-lalo',  nargs='?', dest='plot_box', type=str, default=None, help='geographic area plotted')
@@ -79,14 +86,38 @@ def create_parser():
     parser = add_map_parameters_arguments(parser)
     parser = add_save_arguments(parser)
     parser = add_gps_arguments(parser)
+    parser = add_processing_arguments(parser)
 
     inps = parser.parse_args()
 
-    if len(inps.data_dir) < 1 or len(inps.data_dir) > 2:
-        parser.error('USER ERROR: You must provide 1 or 2 directory paths.')
+    if len(inps.data_dir) < 1:
+        parser.error('USER ERROR: You must provide at least 1 directory path.')
+
+    if inps.section_sweep and not inps.line:
+        parser.error('USER ERROR: --section-sweep requires --section.')
+
+    if inps.section_sweep:
+        count, step = inps.section_sweep
+
+        if not count.is_integer() or count < 1:
+            parser.error('USER ERROR: --section-sweep COUNT must be an integer of at least 1.')
+
+        if step <= 0:
+            parser.error('USER ERROR: --section-sweep STEP must be positive.')
+
+        inps.section_sweep = [int(count), step]
+
+    if inps.jobs < 1:
+        parser.error('USER ERROR: --jobs must be at least 1.')
+
+    if inps.dry_run and (inps.in_memory or inps.sliding_window):
+        parser.error('USER ERROR: --dry-run plans the MintPy prepare pipeline, it cannot be used with --in-memory or --sliding-window.')
+
+    inps.region = None
 
     if inps.plot_box:
         inps.plot_box = [float(val) for val in inps.plot_box.replace(':', ',').split(',')]  # converts to plot_box=[19.3, 19.6, -155.8, -155.4]
+        inps.region = [inps.plot_box[2], inps.plot_box[3], inps.plot_box[0], inps.plot_box[1]]  # [min_lon, max_lon, min_lat, max_lat]
 
     if inps.polygon:
         inps.region = parse_polygon(inps.polygon)
@@ -197,15 +228,30 @@ def main(iargs=None):
 
     inps = create_parser()
 
+    # Saved figures are rendered headless, without importing an interactive backend
+    if inps.save:
+        import matplotlib
+        matplotlib.use('Agg')
+
     # import
     from Plot_data2.src.plotdata.process_data import run_prepare
     from Plot_data2.src.plotdata.plot import run_plot
+    from plotdata.utils.tracing import enable_tracing, span, write_trace
+
+    if inps.profile:
+        enable_tracing()
+
+    try:
+        # extract_volcanoes_info('', 'Kilauea', inps.start_date, inps.end_date)
+        with span('run_prepare', 'prepare'):
+            plot_info = run_prepare(inps)
 
-    # extract_volcanoes_info('', 'Kilauea', inps.start_date, inps.end_date)
-    plot_info = run_prepare(inps)
+        if (inps.show_flag or inps.save) and not inps.dry_run:
+            run_plot(plot_info, inps)
 
-    if inps.show_flag:
-        run_plot(plot_info, inps)
+    finally:
+        if inps.profile:
+            write_trace(inps.profile)
 
 ############################################################
 
@@ -3,17 +3,55 @@ import os
 import math
 import subprocess
 import glob
+import warnings
+import h5py
 from mintpy.utils import readfile
-from mintpy.objects import HDFEOS
 from scipy.interpolate import interp1d
+from scipy.ndimage import distance_transform_edt
 import numpy as np
 from pathlib import Path
+from plotdata.objects.geogrid import GeoGrid
 
 EXAMPLE = """example:
   plot_data.py  MaunaLoaSenDT87 MaunaLoaSenAT124
   plot_data.py  MaunaLoaSenDT87
 """
 
+HDFEOS_DATE = 'HDFEOS/GRIDS/timeseries/observation/date'
+
+# Attributes and date lists read so far in this process, keyed on (kind, path) and stored with the
+# (size, mtime) of the file so that a rewritten file is read again
+_FILE_CACHE = {}
+
+
+def _read_cached(kind, fname, reader):
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    signature = (stat.st_size, stat.st_mtime_ns)
+
+    cached = _FILE_CACHE.get((kind, fname))
+    if cached is None or cached[0] != signature:
+        cached = (signature, reader(fname))
+        _FILE_CACHE[(kind, fname)] = cached
+
+    return cached[1]
+
+
+def read_metadata(fname):
+    """ Returns a copy of the attributes of fname, read without loading any dataset and memoized until the file changes """
+    return dict(_read_cached('metadata', fname, readfile.read_attribute))
+
+
+def _read_date_list(fname):
+    with h5py.File(fname, 'r') as f:
+        dates = f[HDFEOS_DATE] if HDFEOS_DATE in f else f['date']
+        return [date.decode() if isinstance(date, bytes) else str(date) for date in dates[:]]
+
+
+def read_date_list(fname):
+    """ Returns the YYYYMMDD dates of an HDF-EOS5 or MintPy time-series file, memoized until the file changes """
+    return list(_read_cached('date_list', fname, _read_date_list))
+
 
 def get_file_names(path):
     """gets the youngest eos5 file. Path can be:
@@ -22,11 +60,15 @@ def get_file_names(path):
     ~/onedrive/scratch/MaunaLoaSenAT124/mintpy/S1_qq.he5'
     """
     scratch = os.getenv('SCRATCHDIR')
-    if os.path.isfile(glob.glob(path)[0]):
-        eos_file = glob.glob(path)[0]
+    path = os.path.expanduser(path)
+
+    # Relative paths are relative to $SCRATCHDIR, never to the current working directory
+    if not os.path.isabs(path):
+        path = os.path.join(scratch, path)
 
-    elif os.path.isfile(os.path.join(scratch, path)):
-        eos_file = scratch + '/' + path
+    matches = glob.glob(path)
+    if matches and os.path.isfile(matches[0]):
+        eos_file = matches[0]
 
     else:
         if 'mintpy' in path or 'network' in path :
@@ -40,9 +82,10 @@ def get_file_names(path):
 
         eos_file = max(files, key=os.path.getctime)
 
+    eos_file = os.path.abspath(eos_file)
     print('HDF5EOS file used:', eos_file)
 
-    metadata = readfile.read(eos_file)[1]
+    metadata = read_metadata(eos_file)
     velocity_file = 'geo/geo_velocity.h5'
     geometryRadar_file = 'geo/geo_geometryRadar.h5'
 
@@ -72,6 +115,30 @@ def get_file_names(path):
     return eos_file, vel_file, geometry_file, project_base_dir, out_vel_file, inputs_folder
 
 
+def get_project_name(path):
+    """ Project of a data directory, e.g. MaunaLoa for MaunaLoaSenDT87/mintpy """
+    keywords = ['SenD','SenA','SenDT', 'SenAT', 'CskAT', 'CskDT']
+
+    for element in path.split(os.sep):
+        for keyword in keywords:
+            if keyword in element:
+                return element.split(keyword)[0]
+
+    return os.path.basename(os.path.normpath(path))
+
+
+def get_lookup_file(mintpy_dir):
+    """ Returns the absolute path of the lookup table for a MintPy directory, or None if not found """
+    for folder in ['inputs', '', os.path.join('..', 'inputs')]:
+        for name in ['geometryRadar.h5', 'geometryGeo.h5']:
+            lookup_file = os.path.abspath(os.path.join(mintpy_dir, folder, name))
+
+            if os.path.isfile(lookup_file):
+                return lookup_file
+
+    return None
+
+
 def prepend_scratchdir_if_needed(path):
     """ Prepends $SCRATCHDIR if not in path """
 
@@ -92,7 +159,7 @@ def save_gbis_plotdata(eos_file, geo_vel_file, start_date_mod, end_date_mod):
 
     cmd = f'save_gbis.py {vel_file} -g {os.path.dirname(eos_file)}/inputs/geometryRadar.h5'
     print('save_gbis command:',cmd.split())
-    output = subprocess.check_output(cmd.split())
+    output = subprocess.check_output(cmd.split(), cwd=os.getenv('SCRATCHDIR'))
 
 
 def remove_directory_containing_mintpy_from_path(path):
@@ -112,13 +179,14 @@ def remove_directory_containing_mintpy_from_path(path):
 def find_nearest_start_end_date(fname, start_date, end_date):
     ''' Find nearest dates to start and end dates given as YYYYMMDD '''
 
-    dateList = HDFEOS(fname).get_date_list()
+    dateList = read_date_list(fname)
     if start_date and end_date:
 
         if int(start_date) < int(dateList[0]):
             raise Exception("USER ERROR: No date found earlier than ", start_date )
         if int(end_date) > int(dateList[-1]):
-            raise Exception("USER ERROR:  No date found later than ", end_date )
+            # Open-ended period: use the latest acquisition, so new acquisitions are picked up as they arrive
+            print(f'!WARNING: no date later than {end_date}, using the latest acquisition {dateList[-1]}')
 
         for date in reversed(dateList):
             if int(date) <= int(start_date):
@@ -178,47 +246,79 @@ def get_data_type(file):
 def get_dem_extent(atr_dem):
     # get the extent which is required for plotting
     # [-156.0, -154.99, 18.99, 20.00]
-    dem_extent = [float(atr_dem['X_FIRST']), float(atr_dem['X_FIRST']) + int(atr_dem['WIDTH'])*float(atr_dem['X_STEP']),
-        float(atr_dem['Y_FIRST']) + int(atr_dem['FILE_LENGTH'])*float(atr_dem['Y_STEP']), float(atr_dem['Y_FIRST'])]
-    return(dem_extent)
+    return GeoGrid.from_metadata(atr_dem).region
 
 
-def extract_window(vel_file, lat, lon, window_size=3):
-    data, metadata = readfile.read(vel_file)
+def lalo2yx(metadata, lat, lon):
+    """ Returns the row and column of the pixel containing lat, lon """
+    return GeoGrid.from_metadata(metadata).lalo2yx(lat, lon)
 
-    length = int(metadata['LENGTH'])
-    width = int(metadata['WIDTH'])
 
-    latitude, longitude = get_bounding_box(metadata)
+def get_window_box(metadata, lat, lon, window_size=3):
+    """
+    Pixel box of the (2*window_size+1)^2 window centred on lat, lon.
 
-    # Define the latitude and longitude edges
-    lat_edges = np.linspace(min(latitude), max(latitude), length)
-    lon_edges = np.linspace(min(longitude), max(longitude), width)
+    Args:
+        metadata (dict): MintPy metadata with X_FIRST, Y_FIRST, X_STEP, Y_STEP, WIDTH and LENGTH.
+        lat (float): Latitude of the centre.
+        lon (float): Longitude of the centre.
+        window_size (int): Number of pixels on each side of the centre.
 
-    # Check if the reference point is within the data coverage
-    if lat < min(lat_edges) or lat > max(lat_edges) or lon < min(lon_edges) or lon > max(lon_edges):
-        raise ValueError('input reference point is OUT of data coverage on file: ' + vel_file)
+    Returns:
+        tuple: (x0, y0, x1, y1) box, clipped to the grid.
+    """
+    return GeoGrid.from_metadata(metadata).window_box(lat, lon, window_size)
+
+
+def read_window(fname, lat, lon, window_size=3):
+    """
+    Read only the window of pixels around lat, lon.
+
+    Returns:
+        tuple: data of the window, latitude of its rows and longitude of its columns (pixel centres).
+    """
+    grid = GeoGrid.from_metadata(read_metadata(fname))
+    box = grid.window_box(lat, lon, window_size)
+    window = grid.subset(box)
+
+    return readfile.read(fname, box=box)[0], window.lats, window.lons
 
-    # Find the indices of the specified point
-    lat_idx = np.searchsorted(lat_edges, lat)
-    lon_idx = np.searchsorted(lon_edges, lon)
 
-    # Extract the subarray
-    lat_start = max(lat_idx - window_size, 0)
-    lat_end = min(lat_idx + window_size + 1, len(lat_edges))
-    lon_start = max(lon_idx - window_size, 0)
-    lon_end = min(lon_idx + window_size + 1, len(lon_edges))
+def read_raster(fname, box=None, dataset=None):
+    """
+    float32 view of the (x0, y0, x1, y1) box of the 2D raster of fname (default: whole raster).
+
+    dataset selects the dataset of multi-dataset files (e.g. 'height' of geometryRadar.h5), default
+    velocity or the first 2D dataset.
+
+    Contiguous, uncompressed HDF5 datasets are memory-mapped, so only the pages of the box that are used
+    are read. Other files are read with readfile.read, limited to the box.
+    """
+    metadata = read_metadata(fname)
+    x0, y0, x1, y1 = box if box else (0, 0, int(metadata['WIDTH']), int(metadata['LENGTH']))
+
+    if fname.endswith('.h5'):
+        with h5py.File(fname, 'r') as f:
+            names = [name for name in f if isinstance(f[name], h5py.Dataset) and f[name].ndim == 2]
+            if dataset:
+                dset = f[dataset] if dataset in names else None
+            else:
+                dset = f['velocity'] if 'velocity' in names else f[names[0]] if names else None
 
-    # Check if the window outfit the data coverage
-    if lat_start<0 or lat_end>length:
-        raise ValueError('Latitude range is too large for the data coverage on file: ' + vel_file)
+            if dset is not None and dset.chunks is None and dset.compression is None and dset.id.get_offset() is not None:
+                data = np.memmap(fname, dtype=dset.dtype, mode='r', offset=dset.id.get_offset(), shape=dset.shape)[y0:y1, x0:x1]
 
-    if lon_start<0 or lon_end>width:
-        raise ValueError('Longitude range is too large for the data coverage on file: ' + vel_file)
+                return data if data.dtype == np.float32 else data.astype(np.float32)
 
-    subarray = data[lat_start:lat_end, lon_start:lon_end]
-    sublat = lat_edges[lat_start:lat_end]
-    sublon = lon_edges[lon_start:lon_end]
+    return readfile.read(fname, datasetName=dataset, box=(x0, y0, x1, y1))[0].astype(np.float32, copy=False)
+
+
+def extract_window(vel_file, lat, lon, window_size=3):
+    try:
+        subarray, sublat, sublon = read_window(vel_file, lat, lon, window_size)
+
+    except ValueError:
+        raise ValueError('input reference point is OUT of data coverage on file: ' + vel_file)
 
     return ~np.isnan(subarray) ,sublat, sublon
 
@@ -228,38 +328,88 @@ def find_longitude_degree(ref_lat, lat_step):
     return float(lat_step) / math.cos(math.radians(int(ref_lat)))
 
 
-def select_reference_point(out_mskd_file, window_size, ref_lalo):
-    if len(out_mskd_file) != 2:
-        raise ValueError('horzvert plot requires two data directories')
+def read_valid_at(fname, lats, lons):
+    """ Returns True where fname has a valid (not NaN) pixel at the lats, lons grid, reading only the box they cover """
+    grid = GeoGrid.from_metadata(read_metadata(fname))
+    rows, cols = grid.lalo2yx(*np.meshgrid(lats, lons, indexing='ij'))
+    inside = grid.contains(rows, cols)
+
+    valid = np.zeros(rows.shape, dtype=bool)
+    if not inside.any():
+        return valid
+
+    y0, y1 = rows[inside].min(), rows[inside].max() + 1
+    x0, x1 = cols[inside].min(), cols[inside].max() + 1
+    data = readfile.read(fname, box=(x0, y0, x1, y1))[0]
+    valid[inside] = ~np.isnan(data[rows[inside] - y0, cols[inside] - x0])
+
+    return valid
+
+
+def valid_at(data, grid, lats, lons):
+    """ Returns True where the in-memory raster data on grid has a valid (not NaN) pixel at the lats, lons grid """
+    rows, cols = grid.lalo2yx(*np.meshgrid(lats, lons, indexing='ij'))
+    inside = grid.contains(rows, cols)
+
+    valid = np.zeros(rows.shape, dtype=bool)
+    valid[inside] = ~np.isnan(data[rows[inside], cols[inside]])
+
+    return valid
+
 
-    # Extract the subarray for each dataset with Boolean values for NaNs
-    (subdata1, sublat1, sublon1), (subdata2, _, _) = [extract_window(velocity, ref_lalo[0], ref_lalo[1], window_size) for velocity in out_mskd_file]
+def select_reference_point(out_mskd_file, window_size, ref_lalo, velocities=None):
+    """
+    Select the pixel valid in all tracks closest to ref_lalo.
+
+    The window of (2*window_size+1)^2 pixels around ref_lalo is read from the first file, the other
+    co-registered files are sampled at the same pixel centres, and the nearest commonly-valid pixel is
+    found with one distance transform of the joint mask.
+
+    Args:
+        out_mskd_file (list): Masked velocity files of any number of tracks.
+        window_size (int): Number of pixels searched on each side of ref_lalo.
+        ref_lalo (list): Requested reference point [lat, lon].
+        velocities (list): (velocity, metadata) of each track already in memory, sampled instead of the files.
+
+    Returns:
+        list: [lat, lon] of the selected reference point.
+    """
+    if velocities is None:
+        valid, sublat, sublon = extract_window(out_mskd_file[0], ref_lalo[0], ref_lalo[1], window_size)
 
-    paired = list(zip(subdata1, subdata2))
-    valid_indices = []
+        for velocity in out_mskd_file[1:]:
+            valid &= read_valid_at(velocity, sublat, sublon)
 
-    # Find the overlapping indices of True (valid data points) values
-    for ind, (i,j) in enumerate(paired):
-        if np.logical_and(i, j).any():
-            valid_indices.append((ind, np.where(np.logical_and(i, j))))
+        grid = GeoGrid.from_metadata(read_metadata(out_mskd_file[0]))
 
-    # This will be used as a measure of distance from the center of the window (the input reference point)
-    shorter = window_size*2 +1
+    else:
+        grid = GeoGrid.from_metadata(velocities[0][1])
+        window = grid.subset(grid.window_box(ref_lalo[0], ref_lalo[1], window_size))
+        sublat, sublon = window.lats, window.lons
+        valid = np.ones(window.shape, dtype=bool)
+
+        for velocity, metadata in velocities:
+            valid &= valid_at(velocity, GeoGrid.from_metadata(metadata), sublat, sublon)
+
+    if not valid.any():
+        raise ValueError(f'No pixel valid in all tracks within {window_size} pixels of the reference point {ref_lalo[0]}, {ref_lalo[1]}')
+
+    # Pixel of the first file containing the requested point, in window coordinates
+    y, x = grid.lalo2yx(ref_lalo[0], ref_lalo[1])
+    y0, x0 = grid.lalo2yx(sublat[0], sublon[0])
 
-    # Find the closest valid data point to the center of the window
-    for ind, indices in valid_indices:
-        distances = np.sqrt((ind - window_size) ** 2 + (indices[0] - window_size) ** 2)
-        min_distance_index = np.argmin(distances)
-        min_distance = distances[min_distance_index]
+    # Index of the nearest valid pixel for every pixel of the window
+    indices = distance_transform_edt(~valid, return_distances=False, return_indices=True)
+    row, col = indices[:, y - y0, x - x0]
 
-        if min_distance < shorter:
-            shorter = min_distance
-            ref_lalo = [sublat1[ind], sublon1[indices[0][min_distance_index]]]
+    ref_lalo = [float(sublat[row]), float(sublon[col])]
 
     print('-'*50)
     print(f"Reference point selected: {ref_lalo[0]}, {ref_lalo[1]}")
     print('-'*50)
 
+    return ref_lalo
+
 
 def draw_box(central_lat, central_lon, distance_km = 20, distance_deg = None):
     if not distance_deg:
@@ -331,6 +481,36 @@ def parse_polygon(polygon):
     return region
 
 
+def bin_raster(data, factor_y, factor_x, method='mean'):
+    """
+    Aggregate blocks of factor_y x factor_x pixels, ignoring NaNs.
+
+    The array is padded with NaNs to a multiple of the block size. Blocks without valid pixels are NaN.
+
+    Args:
+        data (numpy.ndarray): 2D array.
+        factor_y (int): Number of rows per block.
+        factor_x (int): Number of columns per block.
+        method (str): 'mean' or 'median'.
+
+    Returns:
+        numpy.ndarray: float32 array of shape (ceil(length / factor_y), ceil(width / factor_x)).
+    """
+    length, width = data.shape
+    ny, nx = -(-length // factor_y), -(-width // factor_x)
+
+    blocks = np.full((ny * factor_y, nx * factor_x), np.nan, dtype=np.float32)
+    blocks[:length, :width] = data
+    blocks = blocks.reshape(ny, factor_y, nx, factor_x).swapaxes(1, 2).reshape(ny, nx, factor_y * factor_x)
+
+    reduce = np.nanmedian if method == 'median' else np.nanmean
+
+    # All-NaN blocks are expected (masked areas) and stay NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return reduce(blocks, axis=2).astype(np.float32)
+
+
 def get_bounding_box(metadata):
     """
     Calculate the bounding box coordinates based on the given metadata.
@@ -341,55 +521,118 @@ def get_bounding_box(metadata):
     Returns:
         tuple: A tuple containing two lists, the first list represents the latitude range and the second list represents the longitude range.
     """
-    lat_out = []
-    lon_out = []
+    min_lon, max_lon, min_lat, max_lat = GeoGrid.from_metadata(metadata).region
 
-    length = int(metadata['LENGTH'])
-    width = int(metadata['WIDTH'])
+    return [min_lat, max_lat], [min_lon, max_lon]
 
-    for y_i, x_i in zip([0, length], [0, width]):
-        lat_i = None if y_i is None else (y_i + 0.5) * float(metadata['Y_STEP']) + float(metadata['Y_FIRST'])
-        lon_i = None if x_i is None else (x_i + 0.5) * float(metadata['X_STEP']) + float(metadata['X_FIRST'])
-        lat_out.append(lat_i)
-        lon_out.append(lon_i)
 
-    return [min(lat_out), max(lat_out)], [min(lon_out), max(lon_out)]
+def get_subset_box(metadata, region):
+    """
+    Pixel box of a geocoded grid covering a region.
 
+    Args:
+        metadata (dict): MintPy metadata with X_FIRST, Y_FIRST, X_STEP, Y_STEP, WIDTH and LENGTH.
+        region (list): [min_lon, max_lon, min_lat, max_lat].
 
-def draw_vectors(elevation, vertical, horizontal, line):
-    v = interpolate(elevation, vertical)
-    h = interpolate(elevation, horizontal)
+    Returns:
+        tuple: (x0, y0, x1, y1) box, clipped to the grid.
+    """
+    return GeoGrid.from_metadata(metadata).region_box(region)
 
-    length = np.sqrt(v**2 + h**2)
 
-    #Normalization
-    nv = [1 if val > 0 else -1 if val < 0 else 0 for val in v]
-    nh = [1 if val > 0 else -1 if val < 0 else 0 for val in h]
+def subset_metadata(metadata, box):
+    """ Returns a copy of metadata describing the (x0, y0, x1, y1) box of the grid """
+    x0, y0, x1, y1 = box
+    metadata = dict(metadata)
+    metadata['X_FIRST'] = str(float(metadata['X_FIRST']) + x0 * float(metadata['X_STEP']))
+    metadata['Y_FIRST'] = str(float(metadata['Y_FIRST']) + y0 * float(metadata['Y_STEP']))
+    metadata['WIDTH'] = str(x1 - x0)
+    metadata['LENGTH'] = str(y1 - y0)
+    metadata['SUBSET_XMIN'], metadata['SUBSET_YMIN'] = str(x0), str(y0)
+    metadata['SUBSET_XMAX'], metadata['SUBSET_YMAX'] = str(x1), str(y1)
 
-    v1 = abs(v)
-    h1 = abs(h)
+    return metadata
 
-    m = max(v1) if max(v1) > max(h1) else max(h1)
 
-    tv = (v1 - 0) / (m - 0)
-    th = (h1 - 0) / (m - 0)
+def draw_vectors(elevation, vertical, horizontal, line):
+    """
+    Distance along a section and its vertical and horizontal vectors, scaled by the largest component.
 
-    # Matrix times normalized data
-    v = nv * tv
-    h = nh * th
+    vertical and horizontal are resampled to the length of elevation. Also works on a batch of sections
+    sampled with the same number of points ((sections, points) arrays, see sample_sections), each scaled
+    by its own largest component; line is then any of them, as they have the same length.
 
-    mean_vec = np.mean(length)
-    extent_el = abs(max(elevation) - min(elevation))
+    Returns:
+        tuple: (x_coords, v, h), x_coords in meters.
+    """
+    v = np.asarray(interpolate(elevation, vertical), dtype=float)
+    h = np.asarray(interpolate(elevation, horizontal), dtype=float)
+
+    # Normalization, sections without motion (e.g. masked sea) keep zero vectors
+    m = np.maximum(np.abs(v).max(axis=-1, keepdims=True), np.abs(h).max(axis=-1, keepdims=True))
+    m = np.where(m > 0, m, 1)
+    v = v / m
+    h = h / m
 
-    exp = (math.floor(math.log10(abs(extent_el / mean_vec))))
-    x_coords = np.linspace(0, calculate_distance(line[0][0], line[1][0], line[0][1], line[1][1])*1000, len(elevation))
+    x_coords = np.linspace(0, calculate_distance(line[0][0], line[1][0], line[0][1], line[1][1])*1000, np.shape(elevation)[-1])
 
     return x_coords, v, h
 
 
+def select_section_vectors(x, h, v, rescale_h, resample=1):
+    """
+    Zero the vectors of a section that are skipped by resampling or whose tip would fall outside the section.
+
+    Works on any number of sections and resample factors in one call: x, h and v are (..., points) arrays,
+    rescale_h and resample broadcast against their leading dimensions (e.g. resample of shape (k, 1) with
+    (sections, points) arrays gives (k, sections, points) results).
+
+    Args:
+        x (numpy.ndarray): Distance of the points along the section.
+        h (numpy.ndarray): Horizontal component of the vectors.
+        v (numpy.ndarray): Vertical component of the vectors.
+        rescale_h (float or numpy.ndarray): Scale from h to distance along the section.
+        resample (int or numpy.ndarray): Keep one vector every resample points.
+
+    Returns:
+        tuple: (h, v) with the dropped vectors set to 0.
+    """
+    x = np.asarray(x)
+    rescale_h = np.asarray(rescale_h)[..., None]
+    resample = np.asarray(resample)[..., None]
+
+    tip = x + h * rescale_h
+    keep = (np.arange(x.shape[-1]) % resample == 0) & (tip >= x[..., :1]) & (tip <= x[..., -1:])
+
+    return np.where(keep, h, 0), np.where(keep, v, 0)
+
+
+def sweep_sections(line, count, step):
+    """
+    count sections parallel to line, centred on it and step degrees apart.
+
+    Args:
+        line (list): [(lon1, lon2), (lat1, lat2)], as --section.
+        count (int): Number of sections.
+        step (float): Distance between neighbouring sections in degrees.
+
+    Returns:
+        list: Sections in the format of line.
+    """
+    (lon1, lon2), (lat1, lat2) = line
+    length = math.hypot(lon2 - lon1, lat2 - lat1)
+
+    # Unit vector perpendicular to the section
+    normal_lon, normal_lat = -(lat2 - lat1) / length, (lon2 - lon1) / length
+    offsets = (np.arange(count) - (count - 1) / 2) * step
+
+    return [[(lon1 + offset * normal_lon, lon2 + offset * normal_lon), (lat1 + offset * normal_lat, lat2 + offset * normal_lat)] for offset in offsets]
+
+
 def interpolate(x, y):
-    len_x = len(x)
-    len_y = len(y)
+    # Along the last axis, so that batches of sections are resampled at once
+    len_x = np.shape(x)[-1]
+    len_y = np.shape(y)[-1]
 
     # Interpolate to match lengths
     if len_x > len_y:
@@ -0,0 +1,118 @@
+import os
+import hashlib
+import contourpy
+import numpy as np
+from collections import OrderedDict
+from matplotlib import ticker
+from plotdata.objects.dem_provider import DEM_PROVIDER
+from plotdata.utils.tracing import span
+
+
+class ContourCache():
+    """
+    Isoline geometry of elevation grids.
+
+    Contours are traced once per (elevation, number of levels, region) and kept as lists of paths, which
+    are replayed on any axes as a LineCollection (Mapper.draw_layer). The paths are kept in memory and, if the DEM store is
+    set, on disk next to its tiles (evicted with them).
+    """
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._contours = OrderedDict()
+
+
+    @staticmethod
+    def key(values, levels, region):
+        digest = hashlib.sha1(repr([values.shape, levels, [float(value) for value in region]]).encode())
+        digest.update(np.ascontiguousarray(values).tobytes())
+
+        return digest.hexdigest()
+
+
+    @property
+    def directory(self):
+        return os.path.join(DEM_PROVIDER.store.directory, 'contours') if DEM_PROVIDER.store else None
+
+
+    @staticmethod
+    def trace(values, levels, region):
+        """
+        Contour paths of values, positioned as ax.contour(values, levels=levels, extent=region) does.
+
+        Returns:
+            list: (n, 2) arrays of lon, lat vertices.
+        """
+        length, width = values.shape
+        x, y = np.meshgrid(np.linspace(region[0], region[1], width), np.linspace(region[2], region[3], length))
+        finite = values[np.isfinite(values)]
+
+        # Same automatic levels as matplotlib for an integer number of levels
+        contour_levels = ticker.MaxNLocator(levels + 1, min_n_ticks=1).tick_values(finite.min(), finite.max())
+        generator = contourpy.contour_generator(x, y, values, name='mpl2014', line_type='SeparateCode')
+
+        return [path for level in contour_levels for path in generator.lines(level)[0]]
+
+
+    def load(self, key):
+        file = os.path.join(self.directory, f'{key}.npz')
+
+        if not os.path.exists(file):
+            return None
+
+        # The modification time marks the last use, for the eviction of the DEM store
+        os.utime(file)
+
+        with np.load(file) as contours:
+            return np.split(contours['vertices'], np.cumsum(contours['lengths'])[:-1]) if len(contours['lengths']) else []
+
+
+    def save(self, key, paths):
+        file = os.path.join(self.directory, f'{key}.npz')
+        os.makedirs(self.directory, exist_ok=True)
+
+        vertices = np.concatenate(paths) if paths else np.empty((0, 2))
+
+        # Written under a temporary name so that concurrent runs never read partial contours
+        temp_file = f'{file[:-4]}.{os.getpid()}.tmp.npz'
+        np.savez(temp_file, vertices=vertices, lengths=np.array([len(path) for path in paths], dtype=np.int64))
+        os.replace(temp_file, file)
+
+
+    def get(self, elevation, levels, region):
+        """
+        Contour paths of elevation, with negative and missing elevations set to 0 as in the relief.
+
+        Args:
+            elevation (xarray.DataArray or numpy.ndarray): Elevation grid, rows from south to north.
+            levels (int): Number of levels.
+            region (list): [min_lon, max_lon, min_lat, max_lat] covered by elevation.
+
+        Returns:
+            list: (n, 2) arrays of lon, lat vertices.
+        """
+        values = np.fmax(np.asarray(elevation, dtype=np.float64), 0)
+        key = self.key(values, levels, region)
+
+        if key in self._contours:
+            self._contours.move_to_end(key)
+            return self._contours[key]
+
+        paths = self.load(key) if self.directory else None
+
+        if paths is None:
+            with span('contour', 'dem', shape=list(values.shape), levels=levels):
+                paths = self.trace(values, levels, region)
+
+            if self.directory:
+                self.save(key, paths)
+
+        self._contours[key] = paths
+
+        while len(self._contours) > self.max_entries:
+            self._contours.popitem(last=False)
+
+        return paths
+
+
+# Shared by the Isolines of the process
+CONTOUR_CACHE = ContourCache()
@@ -5,17 +5,32 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, parent_dir)
 
 import re
+import math
 import pygmt
 import numpy as np
-from mintpy.utils import readfile
 from datetime import datetime
 from matplotlib import pyplot as plt
-from matplotlib.colors import LightSource
-from plotdata.helper_functions import parse_polygon, get_bounding_box
+from matplotlib import colormaps
+from matplotlib.colors import Normalize
+from matplotlib.collections import LineCollection
+from plotdata.helper_functions import parse_polygon, get_subset_box, subset_metadata, read_metadata, read_raster, bin_raster
+from plotdata.objects.geogrid import GeoGrid
+from plotdata.objects.dem_provider import DEM_PROVIDER, load_elevation
+from plotdata.objects.hillshade import HILLSHADE_CACHE
+from plotdata.objects.contours import CONTOUR_CACHE
+from plotdata.velocity_functions import read_sliding_window
+from plotdata.utils.tracing import span
 
 
 class Mapper():
-    def __init__(self, region=None, polygon=None, location_types: dict = {}, ax=None, file=None):
+    # Rasters are read on first use and derived fields computed on demand
+    _velocity = None
+    _displacement = None
+
+    def __init__(self, region=None, polygon=None, location_types: dict = {}, ax=None, file=None, window=None, display_shape=None):
+        # Size in pixels of the axes the map is drawn on, for maps prepared without axes
+        self.display_shape = display_shape
+
         if not ax:
             # self.fig = plt.figure(figsize=(8, 8))
             # self.ax = self.fig.add_subplot(111)
@@ -25,11 +40,23 @@ class Mapper():
             self.fig = ax.get_figure()
 
         if file:
-            self.velocity, self.metadata = readfile.read(file)
+            self.file = file
+            self.box = None
+            self.metadata = read_metadata(file)
+
+            # Only the part of the file covering the plotted region is read
+            if region:
+                self.box = get_subset_box(self.metadata, region)
+                self.metadata = subset_metadata(self.metadata, self.box)
+
+            # Sliding-window velocity file, paged with set_window
+            if window is not None:
+                self.set_window(window)
+
             self.start_date = datetime.strptime(self.metadata['START_DATE'], '%Y%m%d')
             self.end_date = datetime.strptime(self.metadata['END_DATE'], '%Y%m%d')
-            latitude, longitude = get_bounding_box(self.metadata)
-            self.region = [longitude[0], longitude[1], latitude[0], latitude[1]]
+            self.grid = GeoGrid.from_metadata(self.metadata)
+            self.region = self.grid.region
 
         elif region:
                 self.region = region
@@ -42,6 +69,47 @@ class Mapper():
         self.location_types = location_types
 
 
+    @property
+    def velocity(self):
+        """ float32 velocity of the plotted region, memory-mapped from the file on first use """
+        if self._velocity is None:
+            self._velocity = read_raster(self.file, self.box)
+
+        return self._velocity
+
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self._velocity = velocity
+        self._displacement = None
+
+
+    @property
+    def displacement(self):
+        """ float32 displacement in meters over the period of the velocity """
+        if self._displacement is None:
+            self.calculate_displacement()
+
+        return self._displacement
+
+
+    @property
+    def wrapped_phase(self):
+        """ Displacement as phase wrapped to [0, 2*pi) """
+        data_phase = np.float32(2 * np.pi / float(self.metadata['WAVELENGTH'])) * self.displacement #(self.displacement + float(self.metadata['HEIGHT']))
+        return np.mod(data_phase, np.float32(2 * np.pi))
+
+
+    def set_window(self, index):
+        """ Loads window index of a sliding-window velocity file, replacing velocity and dates """
+        self.velocity, start_date, end_date = read_sliding_window(self.file, index, self.box)
+        self.window = index
+        self.metadata['START_DATE'] = start_date
+        self.metadata['END_DATE'] = end_date
+        self.start_date = datetime.strptime(start_date, '%Y%m%d')
+        self.end_date = datetime.strptime(end_date, '%Y%m%d')
+
+
     def get_next_zorder(self):
         z = self.zorder
         self.zorder += 1
@@ -52,7 +120,7 @@ class Mapper():
         self.start_date = datetime.strptime(self.metadata['START_DATE'], '%Y%m%d')
         self.end_date = datetime.strptime(self.metadata['END_DATE'], '%Y%m%d')
         days = (self.end_date - self.start_date).days
-        self.displacement = (self.velocity * days / 365.25) # In meters
+        self._displacement = self.velocity * np.float32(days / 365.25) # In meters
 
 
     def plot(self):
@@ -99,45 +167,114 @@ class Mapper():
         # self.ax.text(longitude[1], latitude[1], 'B', fontsize=10, ha='left', color=color)
 
 
-    def add_file(self, style='scatter', vmin=None, vmax=None, zorder=None, cmap='jet', movement='velocity'):
+    def get_lod_factors(self):
+        """ Number of raster rows and columns per screen pixel of the axes (at least 1) """
+        height, width = self.get_display_shape()
+        length, width_data = self.grid.shape
+
+        return max(1, math.ceil(length / max(height, 1))), max(1, math.ceil(width_data / max(width, 1)))
+
+
+    def get_display_shape(self):
+        """ (height, width) in pixels of the axes, or of the data grid if the map is not drawn """
+        if self.display_shape:
+            return self.display_shape
+
+        if hasattr(self, 'ax'):
+            bbox = self.ax.get_window_extent()
+            return bbox.height, bbox.width
+
+        return self.grid.shape if hasattr(self, 'grid') else None
+
+
+    def add_file(self, style='scatter', vmin=None, vmax=None, zorder=None, cmap='jet', movement='velocity', lod='mean'):
         if not zorder:
             zorder = self.get_next_zorder()
 
-        if not hasattr(self, 'displacement'):
-            self.calculate_displacement()
+        self.imdata = self.draw_layer(self.get_layer(style=style, vmin=vmin, vmax=vmax, cmap=cmap, movement=movement, lod=lod), zorder=zorder)
+
+
+    def get_layer(self, style='scatter', vmin=None, vmax=None, cmap='jet', movement='velocity', lod='mean'):
+        """
+        What add_file draws, without drawing it, so that it can be prepared in a worker process.
 
+        Returns:
+            dict: Layer for draw_layer.
+        """
         data = self.displacement if movement == 'displacement' else self.velocity
-        label = 'Displacement (m)' if movement == 'displacement' else 'Velocity (m/yr)'
 
         if style == 'ifgram':
-            label = 'Displacement (m)'
-            data_phase = (2 * np.pi / float(self.metadata['WAVELENGTH'])) *  self.displacement #(self.displacement + float(self.metadata['HEIGHT']))
-            data_wrapped = np.mod(data_phase, 2 * np.pi)
-            self.imdata = self.ax.imshow(data_wrapped, cmap=cmap, extent=self.region, origin='upper', interpolation='none',zorder=self.zorder, vmin=0, vmax=2 * np.pi)
+            return {'style': 'image', 'data': self.wrapped_phase, 'cmap': cmap, 'vmin': 0, 'vmax': 2 * np.pi,
+                    'extent': self.region, 'origin': 'upper', 'interpolation': 'none'}
 
         if style == 'pixel':
-            self.imdata = self.ax.imshow(data, cmap=cmap, extent=self.region, origin='upper', interpolation='none',zorder=self.zorder, vmin=vmin, vmax=vmax)
+            return {'style': 'image', 'data': data, 'cmap': cmap, 'vmin': vmin, 'vmax': vmax,
+                    'extent': self.region, 'origin': 'upper', 'interpolation': 'none'}
 
-        elif style == 'scatter':
-            # Assuming self.velocity is a 2D numpy array
-            data = data
-            nrows, ncols = data.shape
-            x = np.linspace(self.region[0], self.region[1], ncols)
-            y = np.linspace(self.region[2], self.region[3], nrows)
-            X, Y = np.meshgrid(x, y)
-            X = X.flatten()
-            Y = np.flip(Y.flatten())
-            C = data.flatten()
+        grid = self.grid
 
-            self.imdata = self.ax.scatter(X, Y, c=C, cmap=cmap, marker='o', zorder=zorder, s=2, vmin=vmin, vmax=vmax)
-        print(self.imdata)
-        # plt.colorbar(self.imdata, ax=self.ax, orientation='vertical', label=label)
+        # Aggregate to the resolution of the axes, so the number of points is bounded by the screen size
+        if lod and lod != 'none':
+            factor_y, factor_x = self.get_lod_factors()
+
+            if factor_y > 1 or factor_x > 1:
+                data = bin_raster(data, factor_y, factor_x, method=lod)
+                grid = GeoGrid(grid.x_first, grid.y_first, grid.x_step * factor_x, grid.y_step * factor_y, data.shape[1], data.shape[0])
+
+        # Pixel centres of the grid, rows north to south as in the data
+        X, Y = np.meshgrid(grid.lons, grid.lats)
+        valid = ~np.isnan(data)
+
+        return {'style': 'points', 'x': X[valid], 'y': Y[valid], 'c': data[valid], 'cmap': cmap, 'vmin': vmin, 'vmax': vmax}
+
+
+    def draw_layer(self, layer, zorder=None):
+        """ Draw a layer of get_layer, Relief.get_layer or Isolines.get_layer, colormapped or not (see to_rgba) """
+        if layer['style'] == 'lines':
+            collection = LineCollection(layer['paths'], colors=layer['color'], linewidths=layer['linewidth'], zorder=zorder)
+            self.ax.add_collection(collection)
+            self.ax.autoscale_view()
+
+            return collection
+
+        colormap = {key: layer[key] for key in ['cmap', 'vmin', 'vmax'] if key in layer}
+
+        if layer['style'] == 'image':
+            return self.ax.imshow(layer['data'], extent=layer['extent'], origin=layer['origin'], interpolation=layer.get('interpolation'),
+                                  alpha=layer.get('alpha'), aspect=layer.get('aspect'), zorder=zorder, **colormap)
+
+        # RGBA colors of to_rgba are uint8
+        c = layer['c'] / 255 if layer['c'].dtype == np.uint8 else layer['c']
+
+        return self.ax.scatter(layer['x'], layer['y'], c=c, marker='o', zorder=zorder, s=2, **colormap)
+
+
+def to_rgba(layer):
+    """
+    Layer with its values colormapped to uint8 RGBA, so that drawing it is only compositing.
+
+    Missing values are transparent and vmin/vmax default to the range of the values, as in imshow and scatter.
+    """
+    if 'cmap' not in layer:
+        return layer
+
+    key = 'data' if layer['style'] == 'image' else 'c'
+    values = np.ma.masked_invalid(layer[key])
+    vmin = layer['vmin'] if layer.get('vmin') is not None else values.min() if values.count() else 0
+    vmax = layer['vmax'] if layer.get('vmax') is not None else values.max() if values.count() else 0
+
+    rgba = colormaps[layer['cmap']](Normalize(vmin=float(vmin), vmax=float(vmax))(values), bytes=True)
+    layer = {name: value for name, value in layer.items() if name not in ['cmap', 'vmin', 'vmax']}
+    layer[key] = rgba
+
+    return layer
 
 
 class Isolines:
-        def __init__(self, map: Mapper, resolution = '01m', color = 'black', linewidth = 0.5, levels = 10, inline = False, zorder = None):
+        def __init__(self, map: Mapper, resolution = '01m', color = 'black', linewidth = 0.5, levels = 10, inline = False, zorder = None, dem_file = None):
             self.map = map
             self.resolution = resolution
+            self.dem_file = dem_file
             self.color = color
             self.linewidth = linewidth
             self.levels = levels
@@ -151,28 +288,33 @@ class Isolines:
 
             # Plot isolines
             print("Adding isolines\n")
-            lines = pygmt.datasets.load_earth_relief(resolution=self.resolution, region=self.map.region)
+            resolution, _ = DEM_PROVIDER.select_resolution(self.resolution, self.map.region, self.map.get_display_shape())
+            self.lines = load_elevation(resolution, self.map.region, self.dem_file, getattr(self.map, 'grid', None))
 
-            grid_np = lines.values
+            if hasattr(map, 'ax'):
+                if inline:
+                    # Labels need a ContourSet. Remove negative values, without modifying the shared grid
+                    lines = self.lines.where(self.lines >= 0, 0)
+                    cont = self.map.ax.contour(lines, levels=self.levels, colors=self.color, extent=self.map.region, linewidths=self.linewidth, zorder=self.zorder)
+                    self.map.ax.clabel(cont, inline=inline, fontsize=8)
 
-            # Remove negative values
-            grid_np[grid_np < 0] = 0
+                else:
+                    self.im = self.map.draw_layer(self.get_layer(), zorder=self.zorder)
 
-            # Convert the numpy array back to a DataArray
-            lines[:] = grid_np
 
-            # Plot the data
-            cont = self.map.ax.contour(lines, levels=self.levels, colors=self.color, extent=self.map.region, linewidths=self.linewidth, zorder=self.zorder)
-
-            if inline:
-                self.map.ax.clabel(cont, inline=inline, fontsize=8)
+        def get_layer(self):
+            """ Contours traced once per grid, levels and region, then replayed on every panel """
+            return {'style': 'lines', 'paths': CONTOUR_CACHE.get(self.lines, self.levels, self.map.region), 'color': self.color, 'linewidth': self.linewidth}
 
 
 class Relief:
-    def __init__(self, map: Mapper, cmap = 'terrain', resolution = '01m', interpolate=False, no_shade=False, zorder=None):
+    _elevation = None
+
+    def __init__(self, map: Mapper, cmap = 'terrain', resolution = '01m', interpolate=False, no_shade=False, zorder=None, dem_file=None):
         self.map = map
         self.cmap = cmap
         self.resolution = resolution
+        self.dem_file = dem_file
         self.interpolate = interpolate
         self.no_shade = no_shade
 
@@ -185,38 +327,62 @@ class Relief:
         # Plot colormap
         # Load the relief data
         print("Adding elevation\n")
-        self.elevation = pygmt.datasets.load_earth_relief(resolution=self.resolution, region=self.map.region)
+        # With resolution 'auto' the resolution follows the size of the axes, resampled if beyond the pixel budget
+        resolution, spacing = DEM_PROVIDER.select_resolution(self.resolution, self.map.region, self.map.get_display_shape())
 
-        if interpolate:
-            self.interpolate_relief(self.resolution)
+        # The height of dem_file is resampled to the data grid, so it is pixel-aligned with the data
+        self.dem = load_elevation(resolution, self.map.region, self.dem_file, getattr(self.map, 'grid', None))
 
-        # Set all negative values to 0
-        self.elevation = np.where(self.elevation >= 0, self.elevation, 0)
+        if (interpolate or spacing) and not self.dem_file:
+            self.interpolate_relief(resolution, spacing)
 
         if hasattr(map, 'ax'):
             if not no_shade:
-                self.im = self.shade_elevation(zorder=self.zorder)
+                with span('shade_elevation', 'dem'):
+                    self.im = self.shade_elevation(zorder=self.zorder)
             else:
-                print('here')
-                self.im = self.map.ax.imshow(self.elevation.values, cmap=self.cmap, extent=self.map.region, origin='lower', zorder=self.zorder)
+                self.im = self.map.draw_layer(self.get_layer(), zorder=self.zorder)
+
+
+    @property
+    def elevation(self):
+        """ Elevation with negative and missing values set to 0, computed on first use """
+        if self._elevation is None:
+            self._elevation = np.fmax(np.asarray(self.dem, dtype=np.float32), 0)
+
+        return self._elevation
 
 
-    def interpolate_relief(self, resolution):
+    def interpolate_relief(self, resolution, spacing=None):
         print("!WARNING: Interpolating the data to a higher resolution grid")
         print("Accuracy may be lost\n")
-        # Interpolate the relief data to the new higher resolution grid
-        digits = re.findall(r'\d+', resolution)
-        letter = re.findall(r'[a-z]', resolution)
-        new_grid_spacing = f'{(int(digits[0]) / 10)}{letter[0]}'
+        # Interpolate the relief data to the new higher resolution grid, by default 10 times finer
+        if spacing:
+            new_grid_spacing = spacing
+        else:
+            digits = re.findall(r'\d+', resolution)
+            letter = re.findall(r'[a-z]', resolution)
+            new_grid_spacing = f'{(int(digits[0]) / 10)}{letter[0]}'
 
-        self.elevation = pygmt.grdsample(grid=self.elevation, spacing=new_grid_spacing, region=self.map.region)
+        self.dem = pygmt.grdsample(grid=self.dem, spacing=new_grid_spacing, region=self.map.region)
+        self._elevation = None
 
 
     def shade_elevation(self, vert_exag=1.5, zorder=None):
-        # Create hillshade
         print("Shading the elevation data...\n")
-        ls = LightSource(azdeg=315, altdeg=45)
-        hillshade = ls.hillshade(self.elevation, vert_exag=vert_exag, dx=1, dy=1)
 
         # Plot the elevation data with hillshading
-        self.im = self.map.ax.imshow(hillshade, cmap='gray', extent=self.map.region, origin='lower', alpha=0.5, zorder=zorder, aspect='auto')
\ No newline at end of file
+        self.im = self.map.draw_layer(self.get_layer(vert_exag), zorder=zorder)
+
+        return self.im
+
+
+    def get_layer(self, vert_exag=1.5):
+        """ Relief as drawn on the map: the elevation if no_shade, else the hillshade """
+        if self.no_shade:
+            return {'style': 'image', 'data': self.elevation, 'cmap': self.cmap, 'extent': self.map.region, 'origin': 'lower'}
+
+        # Hillshade from the cache, at the level of the pyramid matching the size of the axes
+        hillshade = HILLSHADE_CACHE.get(self.dem, azdeg=315, altdeg=45, vert_exag=vert_exag, shape=self.map.get_display_shape())
+
+        return {'style': 'image', 'data': hillshade, 'cmap': 'gray', 'extent': self.map.region, 'origin': 'lower', 'alpha': 0.5, 'aspect': 'auto'}
@@ -0,0 +1,343 @@
+import os
+import math
+import glob
+import pygmt
+import numpy as np
+import xarray as xr
+from collections import OrderedDict
+from plotdata.objects.geogrid import GeoGrid
+from plotdata.helper_functions import read_metadata, read_raster
+from plotdata.utils.tracing import span
+
+# GMT earth relief resolutions, coarsest first
+GMT_RESOLUTIONS = ['01d', '30m', '20m', '15m', '10m', '06m', '05m', '04m', '03m', '02m', '01m', '30s', '15s', '03s', '01s']
+
+# Size in degrees of the tiles of the DEM store, by resolution in arc seconds
+TILE_DEGREES = [(3, 1), (15, 2), (60, 5), (300, 15), (math.inf, 30)]
+
+
+def resolution_seconds(resolution):
+    """ Pixel size in arc seconds of a GMT earth relief resolution (e.g. '01m' -> 60) """
+    return int(resolution[:-1]) * {'s': 1, 'm': 60, 'd': 3600}[resolution[-1]]
+
+
+def default_cache_dir():
+    if os.getenv('SCRATCHDIR'):
+        return os.path.join(os.getenv('SCRATCHDIR'), 'dem_cache')
+
+    return os.path.join(os.path.expanduser('~'), '.cache', 'plotdata', 'dem')
+
+
+class DemTileStore():
+    """
+    Earth relief tiles kept on disk across runs.
+
+    Tiles are aligned to multiples of their size in degrees and stored as <directory>/<resolution>/<south>_<west>.npz,
+    so any region is served by mosaicking the tiles covering it and cropping the mosaic. Missing tiles are
+    downloaded through pygmt unless offline. The store is capped to max_size GB, evicting the least
+    recently used tiles.
+    """
+    def __init__(self, directory, offline=False, max_size=None):
+        self.directory = directory
+        self.offline = offline
+        self.max_size = max_size
+
+
+    @staticmethod
+    def tile_size(resolution):
+        seconds = resolution_seconds(resolution)
+        return next(size for limit, size in TILE_DEGREES if seconds <= limit)
+
+
+    def tiles(self, resolution, region):
+        """ Regions [west, east, south, north] of the tiles covering region """
+        size = self.tile_size(resolution)
+        south = max(math.floor(region[2] / size) * size, -90)
+        west = math.floor(region[0] / size) * size
+
+        return [[lon, lon + size, lat, min(lat + size, 90)]
+                for lat in range(south, max(math.ceil(region[3] / size) * size, south + size), size) if lat < 90
+                for lon in range(west, max(math.ceil(region[1] / size) * size, west + size), size)]
+
+
+    def tile_file(self, resolution, tile):
+        return os.path.join(self.directory, resolution, f'{tile[2]:+03d}_{tile[0]:+04d}.npz')
+
+
+    def load_tile(self, resolution, tile):
+        """
+        Elevation, latitudes and longitudes of one tile, downloaded if not in the store.
+
+        Returns:
+            tuple: (elevation, lat, lon) arrays, elevation rows along lat.
+        """
+        file = self.tile_file(resolution, tile)
+
+        if os.path.exists(file):
+            # The modification time marks the last use, for eviction
+            os.utime(file)
+
+            with np.load(file) as tile_data:
+                return tile_data['elevation'], tile_data['lat'], tile_data['lon']
+
+        if self.offline:
+            raise ValueError(f'USER ERROR: earth relief tile {os.path.basename(file)} at {resolution} is not in {self.directory}, run once without --offline')
+
+        with span(f'load_earth_relief {resolution}', 'dem', region=tile):
+            grid = pygmt.datasets.load_earth_relief(resolution=resolution, region=tile)
+
+        elevation, lat, lon = grid.values.astype(np.float32), grid.lat.values, grid.lon.values
+
+        # Written under a temporary name so that concurrent runs never read a partial tile
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        temp_file = f'{file[:-4]}.{os.getpid()}.tmp.npz'
+        np.savez(temp_file, elevation=elevation, lat=lat, lon=lon)
+        os.replace(temp_file, file)
+
+        return elevation, lat, lon
+
+
+    def get(self, resolution, region):
+        """
+        Earth relief of region at resolution, mosaicked from the tiles of the store.
+
+        Returns:
+            xarray.DataArray: Elevation in meters, with lat and lon coordinates.
+        """
+        tiles = [self.load_tile(resolution, tile) for tile in self.tiles(resolution, region)]
+
+        # Neighbouring tiles share their edge rows and columns
+        lat = np.unique(np.round(np.concatenate([tile[1] for tile in tiles]), 8))
+        lon = np.unique(np.round(np.concatenate([tile[2] for tile in tiles]), 8))
+        elevation = np.full((len(lat), len(lon)), np.nan, dtype=np.float32)
+
+        for values, tile_lat, tile_lon in tiles:
+            rows = np.searchsorted(lat, np.round(tile_lat, 8))
+            cols = np.searchsorted(lon, np.round(tile_lon, 8))
+            elevation[np.ix_(rows, cols)] = values
+
+        margin = resolution_seconds(resolution) / 3600 / 2
+        lat_mask = (lat >= region[2] - margin) & (lat <= region[3] + margin)
+        lon_mask = (lon >= region[0] - margin) & (lon <= region[1] + margin)
+
+        self.evict()
+
+        return xr.DataArray(elevation[np.ix_(lat_mask, lon_mask)], coords={'lat': lat[lat_mask], 'lon': lon[lon_mask]},
+                            dims=('lat', 'lon'), name='elevation')
+
+
+    def evict(self):
+        """ Remove the least recently used tiles above max_size GB """
+        if self.max_size is None:
+            return []
+
+        files = sorted(glob.glob(os.path.join(self.directory, '*', '*.npz')), key=os.path.getmtime)
+        total = sum(os.path.getsize(file) for file in files)
+        removed = []
+
+        for file in files:
+            if total <= self.max_size * 1024**3:
+                break
+
+            total -= os.path.getsize(file)
+            os.remove(file)
+            removed.append(file)
+
+        for file in removed:
+            print(f'Evicted from DEM cache: {file}')
+
+        return removed
+
+
+class DemProvider():
+    """
+    Earth relief grids of the current process, kept in a least recently used cache.
+
+    A request is served from any cached grid of the same resolution whose region contains the requested
+    one, cropped to the request, so each tile is fetched and decoded once per process. Grids are shared:
+    callers must not modify them in place. Grids missing from memory come from the DemTileStore if one
+    is set, else straight from pygmt. Heights of a geometry file (get_geometry) share the same cache.
+    """
+    def __init__(self, max_entries=8, store=None, max_pixels=4000000):
+        self.max_entries = max_entries
+        self.store = store
+        self.max_pixels = max_pixels
+        self._grids = OrderedDict()
+
+
+    @staticmethod
+    def contains(outer, inner):
+        """ True if region outer [min_lon, max_lon, min_lat, max_lat] contains region inner """
+        return outer[0] <= inner[0] and outer[1] >= inner[1] and outer[2] <= inner[2] and outer[3] >= inner[3]
+
+
+    @staticmethod
+    def crop(grid, region):
+        """ View of the part of grid covering region """
+        return grid.sel(lon=slice(region[0], region[1]), lat=slice(region[2], region[3]))
+
+
+    def select_resolution(self, resolution, region, shape=None):
+        """
+        Resolve resolution 'auto' for region displayed at shape.
+
+        The coarsest resolution with at least one DEM pixel per display pixel is fetched, if the grid fits in
+        max_pixels. Otherwise the finest resolution that fits is fetched and resampled to the display
+        resolution, which is cheaper than fetching beyond the budget.
+
+        Args:
+            resolution (str): GMT earth relief resolution, or 'auto'.
+            region (list): [min_lon, max_lon, min_lat, max_lat].
+            shape (tuple): (height, width) in pixels of the axes, None if not displayed.
+
+        Returns:
+            tuple: (resolution, spacing), spacing (str) the GMT increment to resample to, or None.
+        """
+        if resolution != 'auto':
+            return resolution, None
+
+        def pixels(candidate):
+            step = resolution_seconds(candidate) / 3600
+            return ((region[1] - region[0]) / step + 1) * ((region[3] - region[2]) / step + 1)
+
+        affordable = [candidate for candidate in GMT_RESOLUTIONS if pixels(candidate) <= self.max_pixels] or GMT_RESOLUTIONS[:1]
+
+        if not shape:
+            return affordable[-1], None
+
+        # Arc seconds per display pixel, along the finest axis
+        needed = min((region[1] - region[0]) / max(shape[1], 1), (region[3] - region[2]) / max(shape[0], 1)) * 3600
+        native = [candidate for candidate in affordable if resolution_seconds(candidate) <= needed]
+
+        if native:
+            return native[0], None
+
+        if shape[0] * shape[1] <= self.max_pixels:
+            return affordable[-1], f'{needed:.3f}s'
+
+        return affordable[-1], None
+
+
+    def get(self, resolution, region):
+        """
+        Earth relief of region at resolution.
+
+        Args:
+            resolution (str): GMT earth relief resolution (e.g. '01m', '15s').
+            region (list): [min_lon, max_lon, min_lat, max_lat].
+
+        Returns:
+            xarray.DataArray: Elevation in meters, with lat and lon coordinates.
+        """
+        region = [float(value) for value in region]
+
+        for key in reversed(self._grids):
+            cached_resolution, cached_region = key
+
+            if cached_resolution == resolution and self.contains(cached_region, region):
+                self._grids.move_to_end(key)
+                grid = self._grids[key]
+
+                return grid if list(cached_region) == region else self.crop(grid, region)
+
+        if self.store:
+            with span(f'dem_store {resolution}', 'dem', region=region):
+                grid = self.store.get(resolution, region)
+        else:
+            with span(f'load_earth_relief {resolution}', 'dem', region=region):
+                grid = pygmt.datasets.load_earth_relief(resolution=resolution, region=region)
+
+        self._grids[(resolution, tuple(region))] = grid
+
+        while len(self._grids) > self.max_entries:
+            self._grids.popitem(last=False)
+
+        return grid
+
+
+    def get_geometry(self, dem_file, region, grid=None):
+        """
+        Height of a MintPy geometry file (e.g. geo/geo_geometryRadar.h5), in the layout of load_earth_relief.
+
+        Args:
+            dem_file (str): Geocoded file with a 'height' dataset.
+            region (list): [min_lon, max_lon, min_lat, max_lat], used if grid is not given.
+            grid (GeoGrid): Data grid to which the height is resampled (nearest pixel), NaN outside the file.
+
+        Returns:
+            xarray.DataArray: Elevation in meters, with lat and lon coordinates in increasing order.
+        """
+        key = (dem_file, grid if grid else tuple(float(value) for value in region))
+
+        if key in self._grids:
+            self._grids.move_to_end(key)
+            return self._grids[key]
+
+        dem_grid = GeoGrid.from_metadata(read_metadata(dem_file))
+
+        with span(f'geometry_dem {os.path.basename(dem_file)}', 'dem', region=grid.region if grid else list(region)):
+            if grid is None:
+                box = dem_grid.region_box(region)
+                height = read_raster(dem_file, box, dataset='height')
+                lats, lons = dem_grid.subset(box).lats, dem_grid.subset(box).lons
+
+            else:
+                # Pixel centres of the data grid fall in exactly one pixel of the geometry file
+                rows, _ = dem_grid.lalo2yx(grid.lats, np.full(grid.length, dem_grid.x_first))
+                _, cols = dem_grid.lalo2yx(np.full(grid.width, dem_grid.y_first), grid.lons)
+                inside_rows = (rows >= 0) & (rows < dem_grid.length)
+                inside_cols = (cols >= 0) & (cols < dem_grid.width)
+
+                if not inside_rows.any() or not inside_cols.any():
+                    raise ValueError(f'USER ERROR: {dem_file} does not cover region {grid.region}')
+
+                # Read only the box covering the sampled pixels
+                y0, y1 = rows[inside_rows].min(), rows[inside_rows].max() + 1
+                x0, x1 = cols[inside_cols].min(), cols[inside_cols].max() + 1
+                box_height = read_raster(dem_file, (x0, y0, x1, y1), dataset='height')
+
+                height = np.full(grid.shape, np.nan, dtype=np.float32)
+                height[np.ix_(inside_rows, inside_cols)] = box_height[np.ix_(rows[inside_rows] - y0, cols[inside_cols] - x0)]
+                lats, lons = grid.lats, grid.lons
+
+        # Rows of MintPy files run north to south, earth relief grids south to north
+        if lats[0] > lats[-1]:
+            height, lats = height[::-1], lats[::-1]
+
+        elevation = xr.DataArray(np.asarray(height), coords={'lat': lats, 'lon': lons}, dims=('lat', 'lon'), name='elevation')
+        self._grids[key] = elevation
+
+        while len(self._grids) > self.max_entries:
+            self._grids.popitem(last=False)
+
+        return elevation
+
+
+# Shared by Relief, Isolines and the elevation sections of the process
+DEM_PROVIDER = DemProvider()
+
+
+def configure_dem_store(cache_dir=None, offline=False, max_size=None):
+    """
+    Serve the earth relief of the process from the on-disk tile store.
+
+    Args:
+        cache_dir (str): Directory of the store (default: $SCRATCHDIR/dem_cache).
+        offline (bool): Never download, fail on tiles missing from the store.
+        max_size (float): Maximum size of the store in GB, only enforced in a given cache_dir.
+    """
+    # Tiles are never evicted from a directory the user did not choose
+    DEM_PROVIDER.store = DemTileStore(cache_dir if cache_dir else default_cache_dir(), offline=offline,
+                                      max_size=max_size if cache_dir else None)
+
+
+def load_earth_relief(resolution, region):
+    return DEM_PROVIDER.get(resolution, region)
+
+
+def load_elevation(resolution, region, dem_file=None, grid=None):
+    """ Earth relief of region, or the height of dem_file resampled to grid if dem_file is given """
+    if dem_file:
+        return DEM_PROVIDER.get_geometry(dem_file, region, grid)
+
+    return load_earth_relief(resolution, region)
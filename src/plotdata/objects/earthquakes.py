@@ -10,6 +10,7 @@ from plotdata.objects.create_map import Mapper
 from plotdata.helper_functions import draw_box, calculate_distance
 from plotdata.volcano_functions import get_volcano_coord_id
 from plotdata.objects.get_methods import DataFetcherFactory
+from plotdata.utils.tracing import span
 
 
 class Earthquake():
@@ -47,12 +48,13 @@ class Earthquake():
             end_date=self.end_date.isoformat(),
             magnitude=self.magnitude
         )
-        data = fetcher.fetch_data(
-            max_lat=max_lat,
-            min_lat=min_lat,
-            max_lon=max_lon,
-            min_lon=min_lon
-        )
+        with span(f'get_earthquake_data {website}', 'fetch', magnitude=self.magnitude):
+            data = fetcher.fetch_data(
+                max_lat=max_lat,
+                min_lat=min_lat,
+                max_lon=max_lon,
+                min_lon=min_lon
+            )
 
         features = data['features']
 
@@ -0,0 +1,170 @@
+import math
+import numpy as np
+from dataclasses import dataclass
+from functools import cached_property
+
+# Fraction of a pixel within which a region edge is taken to be on a pixel boundary
+EDGE_TOLERANCE = 1e-6
+
+
+@dataclass(frozen=True)
+class GeoGrid():
+    """
+    Regular lat/lon grid of a geocoded raster.
+
+    X_FIRST/Y_FIRST are the outer corner of the first pixel, as in MintPy metadata. Rows run along
+    Y_STEP (negative for north-up rasters) and columns along X_STEP.
+    """
+    x_first: float
+    y_first: float
+    x_step: float
+    y_step: float
+    width: int
+    length: int
+
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        length = metadata['LENGTH'] if 'LENGTH' in metadata else metadata['FILE_LENGTH']
+
+        return cls(float(metadata['X_FIRST']), float(metadata['Y_FIRST']), float(metadata['X_STEP']), float(metadata['Y_STEP']),
+                   int(metadata['WIDTH']), int(length))
+
+
+    @classmethod
+    def from_region(cls, region, shape, origin='upper', registration='pixel'):
+        """
+        Grid of an array of the given (length, width) shape covering region [min_lon, max_lon, min_lat, max_lat].
+
+        origin is 'upper' for north-up arrays (MintPy) and 'lower' for south-up arrays (pygmt grids).
+        registration is 'pixel' if region is the outer edge of the pixels, 'gridline' if its edges are the
+        centres of the first and last pixels (pygmt earth relief).
+        """
+        length, width = shape
+
+        if registration == 'gridline':
+            x_step = (region[1] - region[0]) / (width - 1)
+            y_step = (region[3] - region[2]) / (length - 1)
+            region = [region[0] - x_step / 2, region[1] + x_step / 2, region[2] - y_step / 2, region[3] + y_step / 2]
+
+        x_step = (region[1] - region[0]) / width
+        y_step = (region[3] - region[2]) / length
+
+        if origin == 'upper':
+            return cls(region[0], region[3], x_step, -y_step, width, length)
+
+        return cls(region[0], region[2], x_step, y_step, width, length)
+
+
+    @property
+    def shape(self):
+        return self.length, self.width
+
+
+    @cached_property
+    def lats(self):
+        """ Latitude of the centre of each row """
+        return self.y_first + (np.arange(self.length) + 0.5) * self.y_step
+
+
+    @cached_property
+    def lons(self):
+        """ Longitude of the centre of each column """
+        return self.x_first + (np.arange(self.width) + 0.5) * self.x_step
+
+
+    @cached_property
+    def region(self):
+        """ Outer edges [min_lon, max_lon, min_lat, max_lat], as used for imshow extents and pygmt regions """
+        x_last = self.x_first + self.width * self.x_step
+        y_last = self.y_first + self.length * self.y_step
+
+        return [min(self.x_first, x_last), max(self.x_first, x_last), min(self.y_first, y_last), max(self.y_first, y_last)]
+
+
+    def lalo2yx(self, lat, lon):
+        """ Row and column of the pixels containing lat, lon (scalars or arrays) """
+        y = np.floor((np.asarray(lat) - self.y_first) / self.y_step).astype(int)
+        x = np.floor((np.asarray(lon) - self.x_first) / self.x_step).astype(int)
+
+        if y.ndim == 0:
+            return int(y), int(x)
+
+        return y, x
+
+
+    def yx2lalo(self, y, x):
+        """ Latitude and longitude of the centre of pixels y, x (scalars or arrays) """
+        lat = self.y_first + (np.asarray(y) + 0.5) * self.y_step
+        lon = self.x_first + (np.asarray(x) + 0.5) * self.x_step
+
+        if lat.ndim == 0:
+            return float(lat), float(lon)
+
+        return lat, lon
+
+
+    def contains(self, y, x):
+        """ True where the row and column are inside the grid """
+        return (y >= 0) & (y < self.length) & (x >= 0) & (x < self.width)
+
+
+    def region_box(self, region):
+        """
+        Pixel box covering region [min_lon, max_lon, min_lat, max_lat].
+
+        Returns:
+            tuple: (x0, y0, x1, y1) box, clipped to the grid.
+        """
+        cols = sorted([(region[0] - self.x_first) / self.x_step, (region[1] - self.x_first) / self.x_step])
+        rows = sorted([(region[2] - self.y_first) / self.y_step, (region[3] - self.y_first) / self.y_step])
+
+        # Edges on pixel boundaries are not moved outward by the rounding error of the divisions
+        x0, x1 = max(int(math.floor(cols[0] + EDGE_TOLERANCE)), 0), min(int(math.ceil(cols[1] - EDGE_TOLERANCE)), self.width)
+        y0, y1 = max(int(math.floor(rows[0] + EDGE_TOLERANCE)), 0), min(int(math.ceil(rows[1] - EDGE_TOLERANCE)), self.length)
+
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError(f'USER ERROR: region {region} is OUT of data coverage')
+
+        return x0, y0, x1, y1
+
+
+    def window_box(self, lat, lon, window_size=3):
+        """
+        Pixel box of the (2*window_size+1)^2 window centred on lat, lon.
+
+        Returns:
+            tuple: (x0, y0, x1, y1) box, clipped to the grid.
+        """
+        y, x = self.lalo2yx(lat, lon)
+
+        if not self.contains(y, x):
+            raise ValueError(f'input reference point is OUT of data coverage: {lat}, {lon}')
+
+        return max(x - window_size, 0), max(y - window_size, 0), min(x + window_size + 1, self.width), min(y + window_size + 1, self.length)
+
+
+    def subset(self, box):
+        """ Grid of the (x0, y0, x1, y1) box """
+        x0, y0, x1, y1 = box
+
+        return GeoGrid(self.x_first + x0 * self.x_step, self.y_first + y0 * self.y_step, self.x_step, self.y_step, x1 - x0, y1 - y0)
+
+
+    def is_aligned(self, other, tolerance=1e-3):
+        """ True if other has the same pixel size and its pixels fall on the pixels of this grid """
+        if not (math.isclose(self.x_step, other.x_step, rel_tol=1e-6) and math.isclose(self.y_step, other.y_step, rel_tol=1e-6)):
+            return False
+
+        dx = (other.x_first - self.x_first) / self.x_step
+        dy = (other.y_first - self.y_first) / self.y_step
+
+        return abs(dx - round(dx)) < tolerance and abs(dy - round(dy)) < tolerance
+
+
+    def offset(self, other):
+        """ Row and column of the first pixel of an aligned grid in this grid """
+        if not self.is_aligned(other):
+            raise ValueError('Grids are not aligned')
+
+        return int(round((other.y_first - self.y_first) / self.y_step)), int(round((other.x_first - self.x_first) / self.x_step))
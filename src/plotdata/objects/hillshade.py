@@ -0,0 +1,119 @@
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from matplotlib.colors import LightSource
+from plotdata.helper_functions import bin_raster
+from plotdata.objects.dem_provider import DEM_PROVIDER
+from plotdata.utils.tracing import span
+
+
+class HillshadeCache():
+    """
+    Shaded relief of elevation grids, as uint8 pyramids.
+
+    Each grid is shaded once per (elevation, azimuth, altitude, exaggeration): level 0 is the hillshade at the
+    resolution of the grid and every next level halves it, down to min_size pixels. Pyramids are kept in
+    memory and, if the DEM store is set, on disk next to its tiles (evicted with them).
+    """
+    def __init__(self, max_entries=16, min_size=64):
+        self.max_entries = max_entries
+        self.min_size = min_size
+        self._pyramids = OrderedDict()
+
+
+    @staticmethod
+    def key(values, azdeg, altdeg, vert_exag):
+        digest = hashlib.sha1(repr([values.shape, azdeg, altdeg, vert_exag]).encode())
+        digest.update(np.ascontiguousarray(values).tobytes())
+
+        return digest.hexdigest()
+
+
+    @property
+    def directory(self):
+        return os.path.join(DEM_PROVIDER.store.directory, 'hillshade') if DEM_PROVIDER.store else None
+
+
+    def build(self, values, azdeg, altdeg, vert_exag):
+        """ Hillshade pyramid of values, with negative and missing elevations set to 0 as in the relief """
+        values = np.fmax(values, 0)
+        shade = LightSource(azdeg=azdeg, altdeg=altdeg).hillshade(values, vert_exag=vert_exag, dx=1, dy=1)
+        levels = [np.round(shade * 255).astype(np.uint8)]
+
+        while min(levels[-1].shape) >= 2 * self.min_size:
+            levels.append(np.round(bin_raster(levels[-1], 2, 2)).astype(np.uint8))
+
+        return levels
+
+
+    def load(self, key):
+        file = os.path.join(self.directory, f'{key}.npz')
+
+        if not os.path.exists(file):
+            return None
+
+        # The modification time marks the last use, for the eviction of the DEM store
+        os.utime(file)
+
+        with np.load(file) as pyramid:
+            return [pyramid[f'level{i}'] for i in range(len(pyramid.files))]
+
+
+    def save(self, key, levels):
+        file = os.path.join(self.directory, f'{key}.npz')
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Written under a temporary name so that concurrent runs never read a partial pyramid
+        temp_file = f'{file[:-4]}.{os.getpid()}.tmp.npz'
+        np.savez(temp_file, **{f'level{i}': level for i, level in enumerate(levels)})
+        os.replace(temp_file, file)
+
+
+    def get(self, elevation, azdeg=315, altdeg=45, vert_exag=1.5, shape=None):
+        """
+        uint8 hillshade of elevation.
+
+        Args:
+            elevation (xarray.DataArray or numpy.ndarray): Elevation grid.
+            azdeg (float): Azimuth of the light source in degrees.
+            altdeg (float): Altitude of the light source in degrees.
+            vert_exag (float): Vertical exaggeration.
+            shape (tuple): (height, width) in pixels at which the hillshade is displayed. The smallest level
+                at least this large is returned, level 0 if None.
+
+        Returns:
+            numpy.ndarray: uint8 hillshade, in the row order of elevation.
+        """
+        values = np.asarray(elevation, dtype=np.float32)
+        key = self.key(values, azdeg, altdeg, vert_exag)
+
+        if key in self._pyramids:
+            self._pyramids.move_to_end(key)
+            levels = self._pyramids[key]
+
+        else:
+            levels = self.load(key) if self.directory else None
+
+            if levels is None:
+                with span('hillshade', 'dem', shape=list(values.shape)):
+                    levels = self.build(values, azdeg, altdeg, vert_exag)
+
+                if self.directory:
+                    self.save(key, levels)
+
+            self._pyramids[key] = levels
+
+            while len(self._pyramids) > self.max_entries:
+                self._pyramids.popitem(last=False)
+
+        if shape:
+            for level in reversed(levels):
+                if level.shape[0] >= shape[0] and level.shape[1] >= shape[1]:
+                    return level
+
+        return levels[0]
+
+
+# Shared by the Relief panels of the process
+HILLSHADE_CACHE = HillshadeCache()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+from contextlib import contextmanager
+
+MANIFEST_NAME = 'plotdata_manifest.json'
+
+
+class ProductCache():
+    """
+    Manifest of the derived products of one project directory.
+
+    Every product is recorded with a key built from the fingerprint of its input files, the keys of the
+    upstream products it was computed from and the parameters of the stage that wrote it. A product is
+    reused only if its key matches and the file on disk is the one that was recorded.
+    """
+    def __init__(self, directory, manifest_name=MANIFEST_NAME):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, manifest_name)
+        self.lock_file = self.manifest_file + '.lock'
+
+
+    @staticmethod
+    def fingerprint(file):
+        stat = os.stat(file)
+        return [stat.st_size, stat.st_mtime_ns]
+
+
+    def key(self, stage, inputs=[], params={}, upstream=[]):
+        """
+        Build the cache key of a stage.
+
+        Args:
+            stage (str): Name of the stage (e.g. 'timeseries2velocity').
+            inputs (list): Input files, fingerprinted by size and modification time.
+            params (dict): Parameters that change the output of the stage.
+            upstream (list): Keys of the products the stage reads.
+
+        Returns:
+            str: Hex digest identifying the product.
+        """
+        content = {
+            'stage': stage,
+            'inputs': [[os.path.abspath(file), self.fingerprint(file)] for file in inputs],
+            'params': params,
+            'upstream': list(upstream),
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+    @contextmanager
+    def _locked(self):
+        # The manifest is shared by the processes preparing the tracks of a project
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_file):
+            return {}
+
+        with open(self.manifest_file) as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                print(f'!WARNING: corrupted cache manifest {self.manifest_file}, starting a new one')
+                return {}
+
+
+    def _write_manifest(self, manifest):
+        tmp_file = f'{self.manifest_file}.{os.getpid()}.tmp'
+
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        os.replace(tmp_file, self.manifest_file)
+
+
+    def is_valid(self, output, key, verbose=True):
+        """
+        Returns True if output exists and was produced with key.
+
+        Read-only, so that planning (e.g. --dry-run) leaves the cache as it is: products reused by a run are
+        marked as used with touch.
+        """
+        output = os.path.abspath(output)
+
+        if not os.path.exists(output):
+            return False
+
+        # The manifest is replaced atomically, so it is read without the lock
+        entry = self.read_manifest().get(output)
+
+        if not entry or entry['key'] != key or entry['fingerprint'] != self.fingerprint(output):
+            return False
+
+        if verbose:
+            print('-'*50)
+            print(f'{output} up to date, skipping ...')
+
+        return True
+
+
+    def record(self, output, key, stage=None):
+        """ Records output as produced with key """
+        output = os.path.abspath(output)
+        now = time.time()
+
+        with self._locked():
+            manifest = self.read_manifest()
+            manifest[output] = {
+                'key': key,
+                'stage': stage,
+                'fingerprint': self.fingerprint(output),
+                'size': os.path.getsize(output),
+                'created': now,
+                'accessed': now,
+            }
+            self._write_manifest(manifest)
+
+
+    def touch(self, outputs):
+        """ Marks the recorded products among outputs as used now, for the eviction of the least recently used """
+        outputs = {os.path.abspath(output) for output in outputs}
+        now = time.time()
+
+        with self._locked():
+            manifest = self.read_manifest()
+
+            for output in outputs & set(manifest):
+                manifest[output]['accessed'] = now
+
+            self._write_manifest(manifest)
+
+
+    def evict(self, max_size=None, max_age=None, keep=[]):
+        """
+        Remove the least recently used products.
+
+        Args:
+            max_size (float): Maximum total size of the recorded products in GB.
+            max_age (float): Maximum number of days since a product was last used.
+            keep (list): Products that are never evicted (e.g. the ones used by the current run).
+        """
+        keep = {os.path.abspath(file) for file in keep}
+        removed = []
+
+        with self._locked():
+            manifest = self.read_manifest()
+
+            # Drop entries whose product was deleted by hand
+            manifest = {output: entry for output, entry in manifest.items() if os.path.exists(output)}
+            entries = sorted(manifest.items(), key=lambda item: item[1]['accessed'])
+
+            if max_age is not None:
+                oldest = time.time() - max_age * 86400
+                removed += [output for output, entry in entries if entry['accessed'] < oldest and output not in keep]
+
+            if max_size is not None:
+                total = sum(entry['size'] for output, entry in entries if output not in removed)
+
+                for output, entry in entries:
+                    if total <= max_size * 1024**3:
+                        break
+
+                    if output in removed or output in keep:
+                        continue
+
+                    removed.append(output)
+                    total -= entry['size']
+
+            for output in removed:
+                os.remove(output)
+                del manifest[output]
+
+            self._write_manifest(manifest)
+
+        for output in removed:
+            print(f'Evicted from cache: {output}')
+
+        return removed
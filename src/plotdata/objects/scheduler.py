@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from plotdata.utils.tracing import span, is_tracing, traced_call, add_events
+
+
+class Task():
+    """
+    One stage of the prepare pipeline.
+
+    Args:
+        name (str): Label shown in the plan (e.g. 'mask SenDT87 20200101:20231231').
+        func (callable): Module-level function running the stage, so that it can be sent to a worker process.
+        args (tuple): Positional arguments of func.
+        kwargs (dict): Keyword arguments of func.
+        deps (list): Tasks that must finish before this one starts.
+        outputs (dict): Products written by the task, mapped to their ProductCache key.
+        cache (ProductCache): Cache in which outputs are checked and recorded.
+        cost (int): Estimated number of bytes read by the task.
+        stage (str): Stage name recorded in the cache.
+    """
+    def __init__(self, name, func, args=(), kwargs={}, deps=[], outputs={}, cache=None, cost=0, stage=None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = [dep for dep in deps if dep is not None]
+        self.outputs = outputs
+        self.cache = cache
+        self.cost = cost
+        self.stage = stage if stage else name.split()[0]
+        self.result = None
+
+
+    def is_up_to_date(self):
+        if not self.outputs:
+            return False
+
+        return all(self.cache.is_valid(output, key, verbose=False) for output, key in self.outputs.items())
+
+
+    def finish(self):
+        for output, key in self.outputs.items():
+            self.cache.record(output, key, stage=self.stage)
+
+
+class Scheduler():
+    """
+    Runs a graph of Tasks, skipping those whose outputs are up to date.
+
+    A task runs if one of its outputs is missing or stale, or if a task it depends on runs. Tasks without
+    outputs run only when a task depending on them runs, or always if nothing depends on them (e.g. save_gbis). Ready tasks run concurrently in up to
+    ``jobs`` processes, started with initializer(*initargs). The return value of each task is kept in
+    task.result.
+    """
+    def __init__(self, jobs=1, initializer=None, initargs=()):
+        self.jobs = jobs
+        self.initializer = initializer
+        self.initargs = initargs
+        self.tasks = []
+
+
+    def add(self, task):
+        self.tasks.append(task)
+        return task
+
+
+    def plan(self):
+        """
+        Decide which tasks run.
+
+        Returns:
+            dict: True for the tasks to run, False for the up-to-date ones, keyed by task.
+        """
+        changed = {}
+        stale = {}
+
+        # Tasks are added after their dependencies, so the list is in topological order
+        for task in self.tasks:
+            missing = [dep.name for dep in task.deps if dep not in changed]
+            if missing:
+                raise ValueError(f'Task {task.name} depends on tasks not added before it: {", ".join(missing)}')
+
+            upstream = any(changed[dep] for dep in task.deps)
+
+            if task.outputs:
+                stale[task] = upstream or not task.is_up_to_date()
+                changed[task] = stale[task]
+            else:
+                changed[task] = upstream
+
+        dependents = {task: [] for task in self.tasks}
+        for task in self.tasks:
+            for dep in task.deps:
+                dependents[dep].append(task)
+
+        run = {}
+
+        for task in reversed(self.tasks):
+            if task.outputs:
+                run[task] = stale[task]
+            elif dependents[task]:
+                run[task] = any(run[dependent] for dependent in dependents[task])
+            else:
+                run[task] = True
+
+        return run
+
+
+    def print_plan(self, run=None):
+        run = run if run is not None else self.plan()
+        index = {task: i + 1 for i, task in enumerate(self.tasks)}
+        to_run = [task for task in self.tasks if run[task]]
+        width = max([len(task.name) for task in self.tasks] + [4])
+
+        print('-'*50)
+        print(f'Plan: {len(self.tasks)} tasks, {len(to_run)} to run, {len(self.tasks) - len(to_run)} up to date, '
+              f'estimated {sum(task.cost for task in to_run) / 1024**2:.1f} MB read')
+        print('-'*50)
+
+        for task in self.tasks:
+            status = 'run' if run[task] else 'skip'
+            after = ','.join(str(index[dep]) for dep in task.deps)
+            print(f'{index[task]:>3}  {status:<4}  {task.name:<{width}}  {task.cost / 1024**2:>10.1f} MB  {"after " + after if after else ""}')
+
+        print('-'*50)
+
+
+    def run(self):
+        """ Run the tasks of the plan, in worker processes if jobs > 1 """
+        run = self.plan()
+        pending = [task for task in self.tasks if run[task]]
+
+        for task in self.tasks:
+            if not run[task] and task.outputs:
+                print('-'*50)
+                print(f'{task.name} up to date, skipping ...')
+                task.cache.touch(task.outputs)
+
+        if self.jobs <= 1:
+            for task in pending:
+                with span(task.name, 'prepare'):
+                    task.result = task.func(*task.args, **task.kwargs)
+                task.finish()
+            return
+
+        done = {task for task in self.tasks if not run[task]}
+        running = {}
+
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=self.initializer, initargs=self.initargs) as executor:
+            while pending or running:
+                ready = [task for task in pending if all(dep in done for dep in task.deps)]
+
+                for task in ready:
+                    pending.remove(task)
+
+                    if is_tracing():
+                        running[executor.submit(traced_call, task.name, 'prepare', task.func, *task.args, **task.kwargs)] = task
+                    else:
+                        running[executor.submit(task.func, *task.args, **task.kwargs)] = task
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    task = running.pop(future)
+                    result = future.result()
+
+                    if is_tracing():
+                        result, events = result
+                        add_events(events)
+
+                    task.result = result
+                    task.finish()
+                    done.add(task)
@@ -2,15 +2,19 @@ from plotdata.objects.create_map import Mapper, Relief
 import numpy as np
 import pandas as pd
 from plotdata.helper_functions import calculate_distance
+from plotdata.objects.geogrid import GeoGrid
 
 
 
 class Section():
-    def __init__(self, data, region, latitude, longitude) -> None:
+    def __init__(self, data, region, latitude, longitude, grid=None) -> None:
         self.data = data
         self.region = region
 
-        lat_indices, lon_indices = self.draw_line(self.data, self.region, latitude, longitude)
+        # Without a grid, data is assumed south-up with its first and last nodes on region, as the pygmt relief grids
+        self.grid = grid if grid else GeoGrid.from_region(region, data.shape, origin='lower', registration='gridline')
+
+        lat_indices, lon_indices = self.draw_line(self.data, self.grid, latitude, longitude)
 
         # TODO test if data needs to be flipped
         if False:
@@ -28,23 +32,18 @@ class Section():
         self.values = np.nan_to_num(self.values)
 
 
-    def draw_line(self, data, region, latitude, longitude):
-        # Calculate the resolution in degrees
-        lat_res = (region[3] - region[2]) / (data.shape[0] - 1)
-        lon_res = (region[1] - region[0]) / (data.shape[1] - 1)
-
+    def draw_line(self, data, grid, latitude, longitude):
         # Calculate the distance between start and end points
         distance = np.sqrt((latitude[1] - latitude[0])**2 + (longitude[1] - longitude[0])**2)
 
-        # Determine the number of points based on the distance
-        num_points = int(distance / min(lat_res, lon_res))
+        # Determine the number of points based on the resolution in degrees
+        num_points = int(distance / min(abs(grid.y_step), abs(grid.x_step)))
 
         lon_points = np.linspace(longitude[0], longitude[1], num_points)
         lat_points = np.linspace(latitude[0], latitude[1], num_points)
 
-        # Snap points to the nearest grid points
-        lon_indices = np.round((lon_points - region[0]) / lon_res).astype(int)
-        lat_indices = np.round((lat_points - region[2]) / lat_res).astype(int)
+        # Snap points to the grid pixels containing them
+        lat_indices, lon_indices = grid.lalo2yx(lat_points, lon_points)
 
         # Ensure indices are within bounds
         lon_indices = np.clip(lon_indices, 0, data.shape[1] - 1)
@@ -98,4 +97,36 @@ class Section():
         distance = np.linspace(0, total_distance, len(self.values))
 
         # Plot the values data against the distance array
-        ax.scatter(distance, self.values, c='black', marker='o')
\ No newline at end of file
+        ax.scatter(distance, self.values, c='black', marker='o')
+
+def section_points(grid, line):
+    """ Number of points of a section [(lon1, lon2), (lat1, lat2)] at the resolution of grid, as in Section """
+    distance = np.sqrt((line[1][1] - line[1][0])**2 + (line[0][1] - line[0][0])**2)
+
+    return int(distance / min(abs(grid.y_step), abs(grid.x_step)))
+
+
+def sample_sections(data, grid, lines, num_points):
+    """
+    Values of data along many sections at once, snapped to the pixels containing the points as in Section.
+
+    Args:
+        data (numpy.ndarray): 2D raster on grid.
+        grid (GeoGrid): Grid of data.
+        lines (list): Sections [(lon1, lon2), (lat1, lat2)].
+        num_points (int): Number of points per section.
+
+    Returns:
+        numpy.ndarray: (sections, num_points) values, NaN replaced by 0.
+    """
+    lines = np.asarray(lines, dtype=float)
+    t = np.linspace(0, 1, num_points)
+
+    lons = lines[:, 0, :1] + (lines[:, 0, 1:] - lines[:, 0, :1]) * t
+    lats = lines[:, 1, :1] + (lines[:, 1, 1:] - lines[:, 1, :1]) * t
+
+    rows, cols = grid.lalo2yx(lats, lons)
+    rows = np.clip(rows, 0, data.shape[0] - 1)
+    cols = np.clip(cols, 0, data.shape[1] - 1)
+
+    return np.nan_to_num(np.asarray(data)[rows, cols])
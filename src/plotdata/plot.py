@@ -5,21 +5,36 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 import matplotlib.ticker as ticker
-from plotdata.objects.section import Section
-from plotdata.objects.create_map import Mapper, Isolines, Relief
-from plotdata.helper_functions import draw_vectors
+from plotdata.objects.section import Section, section_points, sample_sections
+from plotdata.objects.geogrid import GeoGrid
+from plotdata.objects.create_map import Mapper, Isolines, Relief, to_rgba
+from plotdata.objects.dem_provider import DEM_PROVIDER, configure_dem_store
+from plotdata.objects.scheduler import Task, Scheduler
+from plotdata.helper_functions import draw_vectors, select_section_vectors, sweep_sections, get_project_name
+from plotdata.volcano_functions import get_volcano_id
+from plotdata.velocity_functions import read_sliding_window_dates
+from plotdata.utils.tracing import span
 
 def run_plot(plot_info, inps):
+    if inps.sliding_window:
+        plot_sliding_windows(plot_info, inps)
+        return
+
     vmin = inps.vlim[0] if inps.vlim else None
     vmax = inps.vlim[1] if inps.vlim else None
+    configure_dem(inps)
+    dem_file = next(iter(plot_info.values()))['dem_file'] if inps.dem_source == 'geometry' else None
     fig = plt.figure()
     plots = []
+    panels = []
+    sweeps = []
 
     if inps.plot_type == 'shaded_relief':
         main_gs = gridspec.GridSpec(1, 1, figure=fig) #rows, columns
         ax = fig.add_subplot(main_gs[0, 0])
-        rel_map = Mapper(ax=ax, region=inps.region)
-        Relief(map=rel_map, resolution = inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, zorder=None)
+        with span('panel shaded_relief', 'plot'):
+            rel_map = Mapper(ax=ax, region=inps.region)
+            Relief(map=rel_map, resolution = inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, zorder=None, dem_file=dem_file)
 
     if inps.plot_type == 'horzvert':
         main_gs = gridspec.GridSpec(2, len(plot_info.keys()), figure=fig)
@@ -37,9 +52,9 @@ def run_plot(plot_info, inps):
                 fig.add_subplot(main_gs[1, col]),
             ]
 
-            horz_map = processing_maps(ax=axes[0], file=horz_file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement)
+            panels += [(axes[0], horz_file), (axes[1], vert_file)]
 
-            vert_map = processing_maps(ax=axes[1], file=vert_file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement)
+        maps = render_panels(panels, inps, vmin, vmax, dem_file)
 
 
     if inps.plot_type == 'vectors':
@@ -66,60 +81,35 @@ def run_plot(plot_info, inps):
                 ax.xaxis.set_major_locator(ticker.MaxNLocator(nbins=3))
                 ax.yaxis.set_major_locator(ticker.MaxNLocator(nbins=3))
 
-            asc_map = processing_maps(ax=axes[0],
-                            file=asc_file,
-                            no_dem=inps.no_dem,
-                            resolution=inps.resolution,
-                            interpolate=inps.interpolate,
-                            no_shade=inps.no_shade,
-                            style=inps.style,
-                            vmin=vmin,
-                            vmax=vmax,
-                            isolines=inps.isolines,
-                            iso_color=inps.iso_color,
-                            linewidth=inps.linewidth,
-                            inline=inps.inline,
-                            movement=inps.movement)
-
-            desc_map = processing_maps(ax=axes[1],
-                            file=desc_file,
-                            no_dem=inps.no_dem,
-                            resolution=inps.resolution,
-                            interpolate=inps.interpolate,
-                            no_shade=inps.no_shade,
-                            style=inps.style,
-                            vmin=vmin,
-                            vmax=vmax,
-                            isolines=inps.isolines,
-                            iso_color=inps.iso_color,
-                            linewidth=inps.linewidth,
-                            inline=inps.inline,
-                            movement=inps.movement)
+            panels += [(axes[0], asc_file), (axes[1], desc_file)]
 
             # Process horizontal data
-            horizontal_data = Mapper(file=horz_file)
+            horizontal_data = Mapper(file=horz_file, region=inps.region)
             # Get horizontal data section
             horizontal_section = Section(
                 horizontal_data.velocity,
                 horizontal_data.region,
                 inps.line[1],  # Vertical coordinate
-                inps.line[0]   # Horizontal coordinate
+                inps.line[0],   # Horizontal coordinate
+                grid=horizontal_data.grid
             )
 
             # Process vertical data
-            vertical_data = Mapper(file=vert_file)
+            vertical_data = Mapper(file=vert_file, region=inps.region)
             # Get vertical data section
             vertical_section = Section(
                 vertical_data.velocity,
                 vertical_data.region,
                 inps.line[1],
-                inps.line[0]
+                inps.line[0],
+                grid=vertical_data.grid
             )
 
             # Create elevation data
             elevation = Relief(
                 map=horizontal_data,
-                resolution=inps.resolution
+                resolution=inps.resolution,
+                dem_file=dem_file
             )
 
             # Get elevation data section
@@ -160,17 +150,8 @@ def run_plot(plot_info, inps):
             magnitudes = np.sqrt(v**2 + h**2)
             non_zero_magnitudes = magnitudes[magnitudes != 0] # No need??
 
-            # Resample vectors
-            for i in range(len(h)):
-                if i % inps.resample_vector != 0:
-                    h[i] = 0
-                    v[i] = 0
-
-            # Cancel vectors outside the plot
-            for i in range(len(h)):
-                if np.any(h[i] * rescale_h + x[i] < x[0]) or np.any(h[i] * rescale_h + x[i] > x[-1]):
-                    h[i] = 0
-                    v[i] = 0
+            # Resample vectors and cancel those outside the plot
+            h, v = select_section_vectors(x, h, v, rescale_h, inps.resample_vector)
 
             # Filter out zero-length vectors
             non_zero_indices = np.where((h != 0) | (v != 0))
@@ -196,7 +177,18 @@ def run_plot(plot_info, inps):
                 axes[2].quiver([start_x], [start_y], [np.mean(rescale_h)],[0], color='red', scale_units='xy', width=(1 / 10**(2.5)))
                 axes[2].quiver([start_x], [start_y], [0],[np.mean(rescale_v)], color='red', scale_units='xy', width=(1 / 10**(2.5)))
 
-    plt.show()
+            if inps.section_sweep:
+                sweeps.append((key, plot_section_sweep(horizontal_data, vertical_data, elevation, inps)))
+
+        maps = render_panels(panels, inps, vmin, vmax, dem_file)
+
+    if inps.save:
+        save_figure(fig, plot_info, inps)
+
+        for key, sweep_fig in sweeps:
+            save_figure(sweep_fig, {key: plot_info[key]}, inps, suffix='sweep')
+    else:
+        plt.show()
     return
 
 ################################################################
@@ -255,7 +247,9 @@ def run_plot(plot_info, inps):
                                       iso_color=inps.iso_color,
                                       linewidth=inps.linewidth,
                                       inline=inps.inline,
-                                      movement=inps.movement)
+                                      movement=inps.movement,
+                                      region=inps.region,
+                                      lod=inps.lod)
             desc_map = processing_maps(ax=axes[i],
                                       file=file,
                                       no_dem=inps.no_dem,
@@ -269,7 +263,9 @@ def run_plot(plot_info, inps):
                                       iso_color=inps.iso_color,
                                       linewidth=inps.linewidth,
                                       inline=inps.inline,
-                                      movement=inps.movement)
+                                      movement=inps.movement,
+                                      region=inps.region,
+                                      lod=inps.lod)
 
             horizontal_file = plot_info['horizontal'].pop(0)
             horizontal_data = Mapper(file=horizontal_file)
@@ -284,17 +280,17 @@ def run_plot(plot_info, inps):
         if plot == 'descending':
             file = plot_info['descending'][0]
             plot_info['descending'].remove(file)
-            desc_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement)
+            desc_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement, region=inps.region, lod=inps.lod)
 
         if plot == 'horizontal':
             file = plot_info['horizontal'][0]
             plot_info['horizontal'].remove(file)
-            horz_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement)
+            horz_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement, region=inps.region, lod=inps.lod)
 
         if plot == 'vertical':
             file = plot_info['vertical'][0]
             plot_info['vertical'].remove(file)
-            vert_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement)
+            vert_map = processing_maps(ax=axes[i], file=file, no_dem=inps.no_dem, resolution=inps.resolution, interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines, iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement, region=inps.region, lod=inps.lod)
 
         if plot == 'shaded_relief':
             rel_map = Mapper(ax=axes[i], region=inps.region)
@@ -392,20 +388,218 @@ def run_plot(plot_info, inps):
     plt.show()
 
 
-def processing_maps(ax, file, no_dem, resolution, interpolate, no_shade, style, vmin, vmax, isolines, iso_color, linewidth, inline, movement=None):
-    map = Mapper(ax=ax, file=file)
+def plot_section_sweep(horizontal_data, vertical_data, elevation, inps):
+    """
+    Vectors along the --section-sweep COUNT sections parallel to --section, one profile per row of a new figure.
+
+    The sections are sampled, scaled and filtered as (sections, points) arrays in single calls, so dozens of
+    profiles cost about as much as one; only the drawing loops over them.
+    """
+    count, step = inps.section_sweep
+    lines = sweep_sections(inps.line, count, step)
+    elevation_grid = GeoGrid.from_region(elevation.map.region, elevation.elevation.shape, origin='lower', registration='gridline')
+
+    with span('section sweep', 'plot', sections=count):
+        elevations = sample_sections(elevation.elevation, elevation_grid, lines, section_points(elevation_grid, inps.line))
+        horizontals = sample_sections(horizontal_data.velocity, horizontal_data.grid, lines, section_points(horizontal_data.grid, inps.line))
+        verticals = sample_sections(vertical_data.velocity, vertical_data.grid, lines, section_points(vertical_data.grid, inps.line))
+
+        x, v, h = draw_vectors(elevations, verticals, horizontals, inps.line)
+
+    fig, axes = plt.subplots(count, 1, sharex=True, squeeze=False, figsize=(6.4, 1.2 * count))
+    axes = axes[:, 0]
+
+    # Same scaling as the profile of the vectors plot, per section and per row of the figure
+    fig_width, fig_height = fig.get_size_inches()
+    top = 2 * elevations.max(axis=1)
+
+    # Sections at sea level (elevations are clipped at 0) are scaled as the highest one of the sweep, or to 1 m
+    top = np.where(top > 0, top, top.max() if top.max() > 0 else 1)
+    v_adj = top / max(x)
+    rescale_h = 1 / v_adj / fig_width
+    rescale_v = v_adj / (fig_height / count)
+
+    h, v = select_section_vectors(x, h, v, rescale_h, inps.resample_vector)
+
+    for i, ax in enumerate(axes):
+        ax.plot(x, elevations[i])
+        ax.set_ylim([0, top[i]])
+        ax.set_xlim([min(x), max(x)])
+        ax.yaxis.set_major_locator(ticker.MaxNLocator(nbins=2))
+
+        non_zero_indices = np.where((h[i] != 0) | (v[i] != 0))
+        ax.quiver(
+            x[non_zero_indices],
+            elevations[i][non_zero_indices],
+            h[i][non_zero_indices] * rescale_h[i],
+            v[i][non_zero_indices] * rescale_v[i],
+            color='red',
+            scale_units='xy',
+            width=(1 / 10**(2.5))
+        )
+
+    return fig
+
+
+def plot_sliding_windows(plot_info, inps):
+    """
+    One page per window of the --sliding-window files, with the map of every track side by side.
+
+    The windows are paged with Mapper.set_window. With --save each page is written with a window<index>
+    suffix, otherwise the pages are shown one after the other.
+    """
+    vmin = inps.vlim[0] if inps.vlim else None
+    vmax = inps.vlim[1] if inps.vlim else None
+    configure_dem(inps)
+    info = plot_info['sliding_window']
+    dem_file = info['dem_file'] if inps.dem_source == 'geometry' else None
+
+    # Tracks have their own acquisition dates, hence their own windows
+    windows = {file: read_sliding_window_dates(file) for file in info['files']}
+
+    for index in range(max(len(dates) for dates in windows.values())):
+        fig = plt.figure()
+        files = [file for file in info['files'] if index < len(windows[file])]
+        main_gs = gridspec.GridSpec(1, len(files), figure=fig)
+        panels = [(fig.add_subplot(main_gs[0, col]), file) for col, file in enumerate(files)]
+
+        maps = render_panels(panels, inps, vmin, vmax, dem_file, window=index)
+
+        for map in maps:
+            map.ax.set_title(f"{map.start_date.strftime('%Y%m%d')}-{map.end_date.strftime('%Y%m%d')}", fontsize=8)
+
+        if inps.save:
+            save_figure(fig, plot_info, inps, suffix=f'window{index:03d}')
+        else:
+            plt.show()
+
+
+def get_figure_name(plot_info, inps, suffix=None):
+    """ Deterministic file name of a figure: <volcano name or id>_<plot type>[_<start>-<end>...][_<suffix>] """
+    name = get_project_name(inps.data_dir[0])
+
+    if inps.save == 'volcano-id':
+        name = str(get_volcano_id(None, name))
+
+    periods = [key.replace(':', '-') for key in plot_info if key not in ['None:None', 'sliding_window']]
+
+    return '_'.join([name, inps.plot_type] + periods + ([suffix] if suffix else []))
+
+
+def save_figure(fig, plot_info, inps, suffix=None):
+    """ Write fig to inps.outdir in every format of --save-format, without the dates that change between runs """
+    os.makedirs(inps.outdir, exist_ok=True)
+    name = get_figure_name(plot_info, inps, suffix)
+    metadata = {'png': {}, 'pdf': {'CreationDate': None}, 'svg': {'Date': None}}
+
+    with plt.rc_context({'svg.hashsalt': name}):
+        for format in inps.save_format:
+            out_file = os.path.join(inps.outdir, f'{name}.{format}')
+            fig.savefig(out_file, format=format, dpi=inps.dpi, bbox_inches='tight', metadata=metadata[format])
+            print(f'Figure saved to {out_file}')
+
+    plt.close(fig)
+
+
+def configure_dem(inps):
+    """ Earth relief settings of the process, also run in every panel worker """
+    # Tiles are kept on disk only on request, otherwise earth relief is cached in memory
+    if inps.dem_cache_dir or inps.offline:
+        configure_dem_store(inps.dem_cache_dir, offline=inps.offline, max_size=inps.dem_cache_max_size)
+    else:
+        DEM_PROVIDER.store = None
+
+    DEM_PROVIDER.max_pixels = inps.dem_max_pixels
+
+
+def prepare_panel(file, region, display_shape, no_dem, resolution, interpolate, no_shade, style, vmin, vmax, isolines, iso_color, linewidth, inline, movement=None, lod='mean', dem_file=None, window=None):
+    """
+    Layers of one map panel, colormapped to RGBA.
+
+    Reads the data, crops it, loads the relief and shades it without axes, so that it can run in a worker
+    process; draw_panel only composites the layers. Inline isolines are left to draw_panel, which needs
+    the axes to label them. window selects a window of a sliding-window file.
+
+    Returns:
+        list: Layers for Mapper.draw_layer, from bottom to top.
+    """
+    with span(f'read {os.path.basename(file)}', 'plot'):
+        map = Mapper(file=file, region=region, display_shape=display_shape, window=window)
+
+    layers = []
 
     if not no_dem:
-        Relief(map=map, resolution = resolution, cmap = 'terrain', interpolate=interpolate, no_shade=no_shade, zorder=None)
+        layers.append(Relief(map=map, resolution = resolution, cmap = 'terrain', interpolate=interpolate, no_shade=no_shade, zorder=None, dem_file=dem_file).get_layer())
+
+    with span(f'add_file {style}', 'plot'):
+        layers.append(map.get_layer(style=style, vmin=vmin, vmax=vmax, movement=movement, lod=lod))
+
+    if isolines != 0 and not inline:
+        layers.append(Isolines(map=map, resolution = resolution, color = iso_color, linewidth = linewidth, levels = isolines, zorder = None, dem_file = dem_file).get_layer())
+
+    return [to_rgba(layer) for layer in layers]
 
-    map.add_file(style=style, vmin=vmin, vmax=vmax, zorder=None, movement=movement)
 
-    if isolines != 0:
-        Isolines(map=map, resolution = resolution, color = iso_color, linewidth = linewidth, levels = isolines, inline = inline, zorder = None) # TODO add zorder
+def draw_panel(ax, file, layers, resolution, isolines, iso_color, linewidth, inline, region=None, dem_file=None, window=None):
+    """ Composite the layers of prepare_panel on ax """
+    map = Mapper(ax=ax, file=file, region=region, window=window)
+
+    for layer in layers:
+        map.draw_layer(layer, zorder=map.get_next_zorder())
+
+    if isolines != 0 and inline:
+        Isolines(map=map, resolution = resolution, color = iso_color, linewidth = linewidth, levels = isolines, inline = inline, zorder = None, dem_file = dem_file)
 
     return map
 
 
+def render_panels(panels, inps, vmin, vmax, dem_file=None, window=None):
+    """
+    Prepare the (ax, file) map panels in up to inps.jobs processes and draw them, at window of
+    sliding-window files.
+
+    Panels covering the same region wait for the first of them, so that its relief, hillshade and
+    contours are computed once and read from the caches by the others.
+
+    Returns:
+        list: Mapper of each panel.
+    """
+    scheduler = Scheduler(jobs=min(inps.jobs, len(panels)), initializer=configure_dem, initargs=(inps,))
+    first = {}
+    tasks = []
+
+    for ax, file in panels:
+        bbox = ax.get_window_extent()
+        map = Mapper(file=file, region=inps.region)
+        kwargs = dict(file=file, region=inps.region, display_shape=(bbox.height, bbox.width), no_dem=inps.no_dem, resolution=inps.resolution,
+                      interpolate=inps.interpolate, no_shade=inps.no_shade, style=inps.style, vmin=vmin, vmax=vmax, isolines=inps.isolines,
+                      iso_color=inps.iso_color, linewidth=inps.linewidth, inline=inps.inline, movement=inps.movement, lod=inps.lod, dem_file=dem_file, window=window)
+
+        key = (tuple(map.region), kwargs['display_shape'])
+        tasks.append(scheduler.add(Task(f'panel {os.path.basename(file)}', prepare_panel, kwargs=kwargs, deps=[first.get(key)])))
+        first.setdefault(key, tasks[-1])
+
+    with span('prepare_panels', 'plot', panels=len(panels), jobs=scheduler.jobs):
+        scheduler.run()
+
+    maps = []
+
+    for (ax, file), task in zip(panels, tasks):
+        with span(f'draw {os.path.basename(file)}', 'plot'):
+            maps.append(draw_panel(ax, file, task.result, inps.resolution, inps.isolines, inps.iso_color, inps.linewidth, inps.inline, region=inps.region, dem_file=dem_file, window=window))
+
+    return maps
+
+
+def processing_maps(ax, file, no_dem, resolution, interpolate, no_shade, style, vmin, vmax, isolines, iso_color, linewidth, inline, movement=None, region=None, lod='mean', dem_file=None):
+    with span(f'panel {os.path.basename(file)}', 'plot', style=style):
+        bbox = ax.get_window_extent()
+        layers = prepare_panel(file, region, (bbox.height, bbox.width), no_dem, resolution, interpolate, no_shade, style, vmin, vmax,
+                               isolines, iso_color, linewidth, inline, movement=movement, lod=lod, dem_file=dem_file)
+
+        return draw_panel(ax, file, layers, resolution, isolines, iso_color, linewidth, inline, region=region, dem_file=dem_file)
+
+
 def point_on_globe(latitude, longitude, size='1'):
     fig = pygmt.Figure()
 
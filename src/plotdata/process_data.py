@@ -6,100 +6,110 @@
 # Output is  written into  `$SCRATCHDIR/MaunaLoa/SenDT87` and `$SCRATCHDIR/MaunaLoa/SenAT124`
 
 import os
-from mintpy.utils import readfile
-from mintpy.cli import reference_point, asc_desc2horz_vert, save_gdal, mask, geocode
-from plotdata.helper_functions import get_file_names
+from concurrent.futures import ProcessPoolExecutor
+from mintpy.utils import readfile, writefile
+from mintpy.cli import reference_point, save_gdal, mask, geocode
+from plotdata.helper_functions import get_file_names, get_lookup_file, read_metadata, read_date_list, subset_metadata
+from plotdata.objects.product_cache import ProductCache
+from plotdata.objects.scheduler import Scheduler, Task
+from plotdata.utils.tracing import span, is_tracing, traced_call, add_events
+from plotdata.velocity_functions import read_box, estimate_velocities, estimate_velocity_incremental, velocity_metadata, read_temporal_coherence, mask_velocity
+from plotdata.velocity_functions import reference_velocity, get_los_geometry, asc_desc2horz_vert, write_velocity
+from plotdata.velocity_functions import get_period_indices, parse_duration, get_sliding_windows, estimate_sliding_velocities
 from plotdata.helper_functions import prepend_scratchdir_if_needed, find_nearest_start_end_date
 from plotdata.helper_functions import  save_gbis_plotdata, find_longitude_degree, select_reference_point
 from mintpy.cli import timeseries2velocity as ts2v
+from mintpy.cli import asc_desc2horz_vert as ad2hv
 
 
 def run_prepare(inps):
-    root_dir = os.getenv('SCRATCHDIR')
-    os.chdir(root_dir)
-
     data_dir = inps.data_dir
-    dem_file =  inps.dem_file if inps.dem_file else inps.data_dir[0] + '/geo/geo_geometryRadar.h5'
+    dem_file = prepend_scratchdir_if_needed(inps.dem_file if inps.dem_file else inps.data_dir[0] + '/geo/geo_geometryRadar.h5')
     plot_type = inps.plot_type
     ref_lalo = inps.ref_lalo
-    mask_vmin = inps.mask_vmin
-    flag_save_gbis =  inps.flag_save_gbis
-    out_mskd_file = []
+    periods = list(zip(inps.start_date, inps.end_date))
     horz_name = []
     vert_name = []
     project_base_dir = None
+    scheduler = Scheduler(jobs=inps.jobs)
+    tracks = []
+    used_files = []
     plot_info = {}
 
-    for start, end in zip(inps.start_date, inps.end_date):
-        if plot_type != 'shaded_relief':
-            for dir in data_dir:
-                work_dir = prepend_scratchdir_if_needed(dir)
-                eos_file, vel_file, geometry_file, project_base_dir, out_vel_file, inputs_folder = get_file_names(work_dir)
-                out_vel_file = out_vel_file.replace('.h5', f'_{start}_{end}.h5')
-                start_date, end_date = find_nearest_start_end_date(eos_file, start, end)
-                temp_coh_file=out_vel_file.replace(f'velocity_{start}_{end}.h5','temporalCoherence.tif')
-                metadata = None
-
-                if start and end:
-                    horz_name = os.path.join(project_base_dir, f'hz_{start}_{end}.h5')
-                    vert_name = os.path.join(project_base_dir, f'up_{start}_{end}.h5')
-
-                if os.path.exists(out_vel_file):
-                    metadata = readfile.read(out_vel_file)[1]
-                    if start_date != metadata['START_DATE'] or end_date != metadata['END_DATE']:
-                        # Convert timeseries to velocity
-                        run_timeseries2velocity(eos_file, start_date, end_date, out_vel_file)
-                else:
-                    run_timeseries2velocity(eos_file, start_date, end_date, out_vel_file)
+    if inps.sliding_window:
+        work_dirs = [prepend_scratchdir_if_needed(dir) for dir in data_dir]
+        tracks = prepare_tracks(work_dirs, periods, inps, prepare_sliding_window)
+        files = [track['sliding_window'] for track in tracks]
+
+        plot_info['sliding_window'] = {
+            'ascending': [item for item in files if 'SenA' in item],
+            'descending': [item for item in files if 'SenD' in item],
+            'files': files,
+            'directory': tracks[-1]['project_base_dir'],
+            'dem_file': dem_file,
+            }
 
-                if not metadata:
-                    metadata = readfile.read(out_vel_file)[1]
+        return plot_info
 
-                if 'Y_STEP' in metadata:
-                    print('-'*50)
-                    print(f'{out_vel_file} already geocoded, skipping ...')
+    if plot_type != 'shaded_relief':
+        work_dirs = [prepend_scratchdir_if_needed(dir) for dir in data_dir]
 
-                # Geocode the velocity file
-                else:
-                    if not ref_lalo:
-                        for key in ['LAT_REF1', 'REF_LAT']:
-                            if key in metadata:
-                                ref_lat = metadata[key]
-                                break
+        if inps.in_memory:
+            write_tracks = plot_type != 'horzvert' or inps.save_intermediate
+            tracks = [get_track_in_memory(work_dir, periods, inps) for work_dir in work_dirs]
+            stale = [period for period in periods if not is_period_up_to_date(tracks, period, inps, write_tracks)]
 
-                    lat_step = inps.lat_step if inps.lat_step else metadata['mintpy.geocode.laloStep'].split(',')[0]
+            for start, end in sorted(set(periods) - set(stale), key=periods.index):
+                print('-'*50)
+                print(f'{start}:{end} up to date, skipping ...')
 
-                    run_geocode(ref_lat, lat_step, project_base_dir, vel_file)
+            # Only the periods with a missing or stale product read the time-series
+            if stale:
+                for track, prepared in zip(tracks, prepare_tracks(work_dirs, stale, inps, prepare_track_in_memory)):
+                    track.update(arrays=prepared['arrays'], los_geometry=prepared['los_geometry'])
+        else:
+            tracks = [add_track_tasks(scheduler, work_dir, periods, inps) for work_dir in work_dirs]
 
-                    # Go back to SCRACTDIR
-                    os.chdir(root_dir)
+    for start, end in periods:
+        out_mskd_file = [track[(start, end)] for track in tracks]
 
-                if not os.path.exists(temp_coh_file):
-                    run_save_gdal(eos_file, temp_coh_file)
+        if tracks:
+            project_base_dir = tracks[-1]['project_base_dir']
+            cache = ProductCache(project_base_dir)
+            run_horzvert = False
+            used_files.extend(out_mskd_file)
 
-                if not os.path.exists(out_vel_file.replace('.h5', '_msk.h5')):
-                    out_mskd_file.append(run_mask(out_vel_file, temp_coh_file, mask_vmin))
+            # The referenced copies are plotted and decomposed, the masked velocities stay valid for any --ref-lalo
+            if ref_lalo and (inps.in_memory or plot_type in ['horzvert','vectors']):
+                out_mskd_file = get_reference_files(tracks, (start, end), inps)[0]
+                used_files.extend(out_mskd_file)
 
-                else:
-                    out_mskd_file.append(out_vel_file.replace('.h5', '_msk.h5'))
+            if start and end:
+                horz_name = os.path.join(project_base_dir, f'hz_{start}_{end}.h5')
+                vert_name = os.path.join(project_base_dir, f'up_{start}_{end}.h5')
 
             if plot_type in ['horzvert','vectors']:
-                if not os.path.exists(horz_name) or not os.path.exists(vert_name):
-                    if len(out_mskd_file) != 2:
-                        raise ValueError(f'Need two velocity files for {plot_type} plot')
+                if len(out_mskd_file) < 2:
+                    raise ValueError(f'Need at least two velocity files for {plot_type} plot')
+
+                horzvert_key = get_horzvert_key(tracks, (start, end), inps)
+                used_files.extend([horz_name, vert_name])
 
-                    if ref_lalo:
-                        select_reference_point(out_mskd_file, inps.window_size, ref_lalo)
+            if inps.in_memory and (start, end) in stale:
+                if plot_type in ['horzvert','vectors']:
+                    run_horzvert = not cache.is_valid(horz_name, horzvert_key) or not cache.is_valid(vert_name, horzvert_key)
 
-                        for geo_vel in out_mskd_file:
-                            run_reference_point(geo_vel, ref_lalo)
+                with span(f'finish_period_in_memory {start}:{end}', 'prepare'):
+                    finish_period_in_memory(tracks, (start, end), inps, write_tracks,
+                                            horz_name=horz_name if run_horzvert else None,
+                                            vert_name=vert_name if run_horzvert else None)
 
-                    run_asc_desc2horz_vert(out_mskd_file, horz_name=horz_name, vert_name=vert_name)
+                if run_horzvert:
+                    cache.record(horz_name, horzvert_key, stage='asc_desc2horz_vert')
+                    cache.record(vert_name, horzvert_key, stage='asc_desc2horz_vert')
 
-            if flag_save_gbis:
-                for eos, vel in zip(eos_file, out_vel_file):
-                    start_date, end_date = find_nearest_start_end_date(eos, start_date, end_date)
-                    save_gbis_plotdata(eos, vel, start_date, end_date)
+            elif not inps.in_memory and plot_type in ['horzvert','vectors']:
+                add_horzvert_tasks(scheduler, tracks, (start, end), horz_name, vert_name, horzvert_key, inps)
 
         plot_info[f"{start}:{end}"] = {
             'ascending': [item for item in out_mskd_file if 'SenA' in item],
@@ -107,24 +117,444 @@ def run_prepare(inps):
             'horizontal': horz_name,
             'vertical': vert_name,
             'directory': project_base_dir,
+            'dem_file': dem_file,
             }
-        out_mskd_file = []
+
+    if inps.dry_run:
+        scheduler.print_plan()
+        return plot_info
+
+    with span('scheduler', 'prepare', tasks=len(scheduler.tasks)):
+        scheduler.run()
+
+    # Products reused by this run count as used, for the eviction of the least recently used ones (the scheduler
+    # marks those of its tasks)
+    if inps.in_memory:
+        for project_dir in {track['project_base_dir'] for track in tracks}:
+            ProductCache(project_dir).touch(used_files)
+
+    if inps.cache_max_size is not None or inps.cache_max_age is not None:
+        with span('evict', 'prepare'):
+            for project_dir in {track['project_base_dir'] for track in tracks}:
+                ProductCache(project_dir).evict(max_size=inps.cache_max_size, max_age=inps.cache_max_age, keep=used_files)
 
     return plot_info
 
 
+def prepare_tracks(work_dirs, periods, inps, prepare):
+    """Run prepare on every track for all periods, in a process pool if ``inps.jobs`` > 1.
+
+    Tracks do not depend on each other until the horizontal/vertical decomposition,
+    so each one runs in its own worker and the results are joined in input order.
+    """
+    jobs = min(inps.jobs, len(work_dirs))
+
+    if jobs <= 1:
+        tracks = []
+
+        for work_dir in work_dirs:
+            with span(f'{prepare.__name__} {os.path.basename(work_dir)}', 'prepare'):
+                tracks.append(prepare(work_dir, periods, inps))
+
+        return tracks
+
+    print('-'*50)
+    print(f'Preparing {len(work_dirs)} tracks with {jobs} processes ...')
+    print('-'*50)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if not is_tracing():
+            futures = [executor.submit(prepare, work_dir, periods, inps) for work_dir in work_dirs]
+            return [future.result() for future in futures]
+
+        futures = [executor.submit(traced_call, f'{prepare.__name__} {os.path.basename(work_dir)}', 'prepare', prepare, work_dir, periods, inps)
+                   for work_dir in work_dirs]
+        tracks = []
+
+        for future in futures:
+            track, events = future.result()
+            add_events(events)
+            tracks.append(track)
+
+        return tracks
+
+
+def add_track_tasks(scheduler, work_dir, periods, inps):
+    """Add the velocity, geocode, coherence, mask and gbis tasks of one track to the scheduler.
+
+    Products are reused when the project ProductCache has them recorded with the same inputs and parameters.
+    With --subset-lalo, velocity and coherence of a geocoded time-series are computed over the subset only,
+    and a radar-coded velocity is geocoded over the subset only.
+
+    Returns:
+        dict: masked velocity file, its cache key and its mask task for each (start, end) period, and the project base directory.
+    """
+    ref_lalo = inps.ref_lalo
+    mask_vmin = inps.mask_vmin
+    track = {}
+
+    eos_file, vel_file, geometry_file, project_base_dir, out_vel_file, inputs_folder = get_file_names(work_dir)
+    temp_coh_file = out_vel_file.replace('velocity.h5', 'temporalCoherence.tif')
+    cache = ProductCache(project_base_dir)
+    metadata = read_metadata(eos_file)
+    date_list = read_date_list(eos_file)
+    name = os.path.basename(os.path.dirname(out_vel_file))
+
+    # Only the hyperslab covering --subset-lalo is read from a geocoded HDF-EOS5 file
+    box = read_box(eos_file, inps.region) if inps.region and 'Y_STEP' in metadata else None
+    raster_bytes = get_raster_bytes(subset_metadata(metadata, box) if box else metadata)
+    track['project_base_dir'] = project_base_dir
+    track['eos_file'] = eos_file
+    track['raster_bytes'] = raster_bytes
+    track['cache_keys'] = {}
+    track['mask_tasks'] = {}
+
+    if not periods:
+        return track
+
+    dates = {(start, end): find_nearest_start_end_date(eos_file, start, end) for start, end in periods}
+    period_vel_files = {(start, end): out_vel_file.replace('.h5', f'_{start}_{end}.h5') for start, end in periods}
+    velocity_keys = {period: cache.key('timeseries2velocity', inputs=[eos_file], params={'start_date': dates[period][0], 'end_date': dates[period][1], 'box': box})
+                     for period in periods}
+    stale = [period for period in periods if not cache.is_valid(period_vel_files[period], velocity_keys[period], verbose=False)]
+
+    # Stale periods are estimated together from a single read of the time-series
+    velocity_tasks = {}
+
+    for group in ([stale] if stale else []) + [[period] for period in periods if period not in stale]:
+        n_dates = len({i for period in group for i in get_period_indices(date_list, *dates[period])})
+
+        task = scheduler.add(Task(f'timeseries2velocity {name} ' + ','.join(f'{start}:{end}' for start, end in group),
+                                  run_velocity,
+                                  args=([dates[period] for period in group], [period_vel_files[period] for period in group], eos_file, inps.incremental, box),
+                                  outputs={period_vel_files[period]: velocity_keys[period] for period in group},
+                                  cache=cache,
+                                  cost=n_dates * raster_bytes))
+
+        velocity_tasks.update({period: task for period in group})
+
+    geocode_task = None
+
+    # Geocode the velocity file
+    if 'Y_STEP' not in metadata:
+        if ref_lalo:
+            ref_lat = ref_lalo[0]
+        else:
+            for key in ['LAT_REF1', 'REF_LAT']:
+                if key in metadata:
+                    ref_lat = metadata[key]
+                    break
+
+        lat_step = inps.lat_step if inps.lat_step else metadata['mintpy.geocode.laloStep'].split(',')[0]
+
+        # Named by MintPy's geocode.py after the input file
+        geo_file = os.path.join(project_base_dir, 'geo_' + os.path.basename(vel_file))
+        geocode_key = cache.key('geocode', inputs=[vel_file] if os.path.exists(vel_file) else [],
+                                params={'ref_lat': ref_lat, 'lat_step': lat_step, 'region': inps.region}, upstream=[velocity_keys[period] for period in periods])
+
+        geocode_task = scheduler.add(Task(f'geocode {name}', run_geocode,
+                                          args=(ref_lat, lat_step, project_base_dir, vel_file, inps.region),
+                                          deps=list(dict.fromkeys(velocity_tasks.values())),
+                                          outputs={geo_file: geocode_key},
+                                          cache=cache,
+                                          cost=raster_bytes))
+
+    if box:
+        temp_coh_file = out_vel_file.replace('velocity.h5', 'temporalCoherence_subset.h5')
+        coherence_key = cache.key('coherence', inputs=[eos_file], params={'box': box})
+        coherence_task = scheduler.add(Task(f'coherence {name}', run_save_coherence,
+                                            args=(eos_file, temp_coh_file, box),
+                                            outputs={temp_coh_file: coherence_key},
+                                            cache=cache,
+                                            cost=raster_bytes))
+    else:
+        coherence_key = cache.key('save_gdal', inputs=[eos_file], params={'dset': 'temporalCoherence'})
+        coherence_task = scheduler.add(Task(f'save_gdal {name}', run_save_gdal,
+                                            args=(eos_file, temp_coh_file),
+                                            outputs={temp_coh_file: coherence_key},
+                                            cache=cache,
+                                            cost=raster_bytes))
+
+    for start, end in periods:
+        period_vel_file = period_vel_files[(start, end)]
+        out_mskd_file = period_vel_file.replace('.h5', '_msk.h5')
+        mask_key = cache.key('mask', params={'mask_vmin': mask_vmin}, upstream=[velocity_keys[(start, end)], coherence_key])
+
+        track[(start, end)] = out_mskd_file
+        track['cache_keys'][(start, end)] = mask_key
+        track['mask_tasks'][(start, end)] = scheduler.add(Task(f'mask {name} {start}:{end}', run_mask,
+                                                               args=(period_vel_file, temp_coh_file, mask_vmin),
+                                                               deps=[velocity_tasks[(start, end)], coherence_task, geocode_task],
+                                                               outputs={out_mskd_file: mask_key},
+                                                               cache=cache,
+                                                               cost=2 * raster_bytes))
+
+        if inps.flag_save_gbis:
+            scheduler.add(Task(f'save_gbis {name} {start}:{end}', save_gbis_plotdata,
+                               args=(eos_file, period_vel_file, *dates[(start, end)]),
+                               deps=[velocity_tasks[(start, end)]],
+                               cost=2 * raster_bytes))
+
+    return track
+
+
+def get_reference_files(tracks, period, inps):
+    """Referenced copies of the masked velocities of one period and their cache key.
+
+    The key covers the masked velocities of all tracks, since the reference point is the pixel nearest
+    --ref-lalo that is valid in every track.
+    """
+    ref_files = [track[period].replace('_msk.h5', '_msk_ref.h5') for track in tracks]
+    ref_key = ProductCache(tracks[-1]['project_base_dir']).key('reference_point',
+                                                             params={'ref_lalo': inps.ref_lalo, 'window_size': inps.window_size},
+                                                             upstream=[track['cache_keys'][period] for track in tracks])
+
+    return ref_files, ref_key
+
+
+def add_horzvert_tasks(scheduler, tracks, period, horz_name, vert_name, horzvert_key, inps):
+    """Add the reference point and horizontal/vertical decomposition tasks of one period to the scheduler."""
+    out_mskd_file = [track[period] for track in tracks]
+    deps = [track['mask_tasks'][period] for track in tracks]
+    cost = sum(track['raster_bytes'] for track in tracks)
+    cache = ProductCache(tracks[-1]['project_base_dir'])
+    label = f'{period[0]}:{period[1]}'
+
+    if inps.ref_lalo:
+        ref_files, ref_key = get_reference_files(tracks, period, inps)
+        deps = [scheduler.add(Task(f'reference_point {label}', run_reference,
+                                   args=(out_mskd_file, ref_files, inps.window_size, inps.ref_lalo),
+                                   deps=deps,
+                                   outputs={ref_file: ref_key for ref_file in ref_files},
+                                   cache=cache,
+                                   cost=cost))]
+        out_mskd_file = ref_files
+
+    scheduler.add(Task(f'asc_desc2horz_vert {label}', run_asc_desc2horz_vert,
+                       args=(out_mskd_file, horz_name, vert_name, [track['eos_file'] for track in tracks], inps.region),
+                       deps=deps,
+                       outputs={horz_name: horzvert_key, vert_name: horzvert_key},
+                       cache=cache,
+                       cost=cost))
+
+
+def get_horzvert_key(tracks, period, inps):
+    """Cache key of the horizontal and vertical velocities of one period"""
+    return ProductCache(tracks[-1]['project_base_dir']).key('asc_desc2horz_vert',
+                                                          params={'ref_lalo': inps.ref_lalo, 'window_size': inps.window_size, 'in_memory': inps.in_memory},
+                                                          upstream=[track['cache_keys'][period] for track in tracks])
+
+
+def get_track_in_memory(work_dir, periods, inps):
+    """Masked velocity file and cache key of each period of one track, from the metadata of its HDF-EOS5 file.
+
+    The time-series is not read, so that run_prepare can check the products of every period first.
+    """
+    eos_file, vel_file, geometry_file, project_base_dir, out_vel_file, inputs_folder = get_file_names(work_dir)
+    cache = ProductCache(project_base_dir)
+    track = {'project_base_dir': project_base_dir, 'eos_file': eos_file, 'cache_keys': {}, 'dates': {}, 'arrays': {}}
+
+    if 'Y_STEP' not in read_metadata(eos_file):
+        raise ValueError(f'USER ERROR: --in-memory requires a geocoded HDF-EOS5 file: {eos_file}')
+
+    # Only the hyperslab covering --subset-lalo is read from the HDF-EOS5 file
+    box = read_box(eos_file, inps.region)
+    track['box'] = box
+
+    for start, end in periods:
+        out_mskd_file = out_vel_file.replace('.h5', f'_{start}_{end}_msk.h5')
+        start_date, end_date = find_nearest_start_end_date(eos_file, start, end)
+
+        track[(start, end)] = out_mskd_file
+        track['dates'][(start, end)] = (start_date, end_date)
+        track['cache_keys'][(start, end)] = cache.key('velocity_mask', inputs=[eos_file],
+                                                      params={'start_date': start_date, 'end_date': end_date, 'mask_vmin': inps.mask_vmin, 'box': box})
+
+    return track
+
+
+def is_period_up_to_date(tracks, period, inps, write_tracks):
+    """True if every product written by finish_period_in_memory for period is up to date, so no track is read"""
+    products = []
+
+    if write_tracks:
+        products += [(track['project_base_dir'], track[period], track['cache_keys'][period]) for track in tracks]
+
+        if inps.ref_lalo:
+            ref_files, ref_key = get_reference_files(tracks, period, inps)
+            products += [(track['project_base_dir'], ref_file, ref_key) for track, ref_file in zip(tracks, ref_files)]
+
+    if inps.plot_type in ['horzvert','vectors']:
+        project_base_dir = tracks[-1]['project_base_dir']
+        horzvert_key = get_horzvert_key(tracks, period, inps)
+        products += [(project_base_dir, os.path.join(project_base_dir, f'{name}_{period[0]}_{period[1]}.h5'), horzvert_key) for name in ['hz', 'up']]
+
+    return all(ProductCache(directory).is_valid(file, key, verbose=False) for directory, file, key in products)
+
+
+def prepare_track_in_memory(work_dir, periods, inps):
+    """Estimate and mask the velocity of one track for all periods without intermediate files.
+
+    The masked velocities are returned as arrays in track['arrays'] and written by finish_period_in_memory.
+    Periods whose masked velocity is up to date in the ProductCache are not recomputed.
+    """
+    track = get_track_in_memory(work_dir, periods, inps)
+    eos_file, box = track['eos_file'], track['box']
+    cache = ProductCache(track['project_base_dir'])
+    track['los_geometry'] = get_los_geometry(eos_file, read_metadata(eos_file), box)
+
+    stale = [(period, *track['dates'][period], track[period].replace('_msk.h5', '.h5'))
+             for period in periods if not cache.is_valid(track[period], track['cache_keys'][period])]
+
+    if not stale:
+        return track
+
+    with span(f'estimate_velocities {os.path.basename(work_dir)}', 'prepare', periods=len(stale)):
+        if inps.incremental:
+            velocities = [estimate_velocity_incremental(eos_file, start_date, end_date, get_normal_equations_file(period_vel_file, start_date, end_date), box)
+                          for _, start_date, end_date, period_vel_file in stale]
+
+        # All periods are estimated from a single read of the time-series
+        else:
+            velocities = estimate_velocities(eos_file, [(start_date, end_date) for _, start_date, end_date, _ in stale], box)
+
+    with span(f'read_temporal_coherence {os.path.basename(work_dir)}', 'prepare'):
+        coherence = read_temporal_coherence(eos_file, box)
+
+    for (period, start_date, end_date, period_vel_file), velocity in zip(stale, velocities):
+        metadata = velocity_metadata(eos_file, start_date, end_date, box)
+
+        if inps.save_intermediate or inps.flag_save_gbis:
+            write_velocity(velocity, metadata, period_vel_file)
+
+        if inps.flag_save_gbis:
+            save_gbis_plotdata(eos_file, period_vel_file, start_date, end_date)
+
+        track['arrays'][period] = (mask_velocity(velocity, coherence, inps.mask_vmin), metadata)
+
+    return track
+
+
+def finish_period_in_memory(tracks, period, inps, write_tracks, horz_name=None, vert_name=None):
+    """Write the in-memory velocities of one period and their referenced copies, and decompose them if horz_name is given."""
+    velocities = []
+    metadata_list = []
+
+    for track in tracks:
+        if period in track['arrays']:
+            velocity, metadata = track['arrays'].pop(period)
+
+            if write_tracks:
+                write_velocity(velocity, metadata, track[period])
+                ProductCache(track['project_base_dir']).record(track[period], track['cache_keys'][period], stage='velocity_mask')
+
+        elif horz_name or inps.ref_lalo:
+            velocity, metadata = readfile.read(track[period])
+
+        # Masked velocity up to date on disk
+        else:
+            continue
+
+        velocities.append(velocity)
+        metadata_list.append(metadata)
+
+    if inps.ref_lalo:
+        # Nearest pixel to --ref-lalo that is valid in every track, as run_reference
+        ref_lalo = select_reference_point([track[period] for track in tracks], inps.window_size, inps.ref_lalo,
+                                          velocities=list(zip(velocities, metadata_list)))
+        referenced = [reference_velocity(velocity, metadata, ref_lalo) for velocity, metadata in zip(velocities, metadata_list)]
+        velocities = [velocity for velocity, _ in referenced]
+        metadata_list = [metadata for _, metadata in referenced]
+
+        if write_tracks:
+            ref_files, ref_key = get_reference_files(tracks, period, inps)
+
+            for track, ref_file, velocity, metadata in zip(tracks, ref_files, velocities, metadata_list):
+                write_velocity(velocity, metadata, ref_file)
+                ProductCache(track['project_base_dir']).record(ref_file, ref_key, stage='reference_point')
+
+    if horz_name:
+        horz, vert, metadata = asc_desc2horz_vert(velocities, metadata_list, [track['los_geometry'] for track in tracks])
+        write_velocity(horz, metadata, horz_name)
+        write_velocity(vert, metadata, vert_name)
+
+
+def prepare_sliding_window(work_dir, periods, inps):
+    """Estimate the velocity of every --sliding-window window of one track in a single pass over the time-series.
+
+    The windows are written as one stacked file, paged by Mapper.set_window. Periods are not used.
+    """
+    length, step = inps.sliding_window
+    eos_file, vel_file, geometry_file, project_base_dir, out_vel_file, inputs_folder = get_file_names(work_dir)
+    out_file = out_vel_file.replace('velocity.h5', f'velocity_windows_{length}_{step}.h5')
+    cache = ProductCache(project_base_dir)
+    track = {'project_base_dir': project_base_dir, 'sliding_window': out_file}
+
+    box = read_box(eos_file, inps.region)
+    key = cache.key('sliding_window', inputs=[eos_file], params={'length': length, 'step': step, 'box': box, 'mask_vmin': inps.mask_vmin})
+
+    if cache.is_valid(out_file, key):
+        cache.touch([out_file])
+        return track
+
+    windows = get_sliding_windows(read_date_list(eos_file), parse_duration(length), parse_duration(step))
+
+    if not windows:
+        raise ValueError(f'USER ERROR: no {length} window with two or more acquisitions in {eos_file}')
+
+    print('-'*50)
+    print(f'Estimating {len(windows)} velocities of {length} windows stepped by {step}: {out_file}')
+
+    with span(f'estimate_sliding_velocities {os.path.basename(work_dir)}', 'prepare', windows=len(windows)):
+        estimate_sliding_velocities(eos_file, windows, out_file, read_metadata(eos_file), box, inps.mask_vmin)
+    cache.record(out_file, key, stage='sliding_window')
+
+    return track
+
+
+def get_normal_equations_file(out_vel_file, start_date, end_date):
+    return os.path.join(os.path.dirname(out_vel_file), f'normal_equations_{start_date}_{end_date}.npz')
+
+
+def get_raster_bytes(metadata):
+    return int(metadata['LENGTH']) * int(metadata['WIDTH']) * 4
+
+
+def run_velocity(dates, output_files, eos_file, incremental=False, box=None):
+    """Estimate the velocity of each (start_date, end_date) period of eos_file into its output file, over the (x0, y0, x1, y1) box if given."""
+    # Only the acquisitions added since the last run are read
+    if incremental:
+        for (start_date, end_date), output_file in zip(dates, output_files):
+            velocity = estimate_velocity_incremental(eos_file, start_date, end_date, get_normal_equations_file(output_file, start_date, end_date), box)
+            write_velocity(velocity, velocity_metadata(eos_file, start_date, end_date, box), output_file)
+
+    # Several periods are estimated from a single read of the time-series, a subset from a read of its hyperslab
+    elif len(dates) > 1 or box:
+        for (start_date, end_date), output_file, velocity in zip(dates, output_files, estimate_velocities(eos_file, dates, box)):
+            write_velocity(velocity, velocity_metadata(eos_file, start_date, end_date, box), output_file)
+
+    else:
+        run_timeseries2velocity(eos_file, dates[0][0], dates[0][1], output_files[0])
+
+
 def run_timeseries2velocity(eos_file, start_date, end_date, output_file):
     cmd = f'{eos_file} --start-date {start_date} --end-date {end_date} --output {output_file}'
     ts2v.main(cmd.split())
 
 
-def run_geocode(ref_lat, lat_step, outdir, file_fullpath):
+def run_geocode(ref_lat, lat_step, outdir, file_fullpath, region=None):
     lon_step = find_longitude_degree(ref_lat, lat_step)
 
-    # Go to folder with all the input files
-    os.chdir(outdir)
-
     cmd = f"{file_fullpath} --lalo-step {lat_step} {lon_step} --outdir {outdir}"
+
+    if region:
+        cmd += f" --bbox {region[2]} {region[3]} {region[0]} {region[1]}"
+
+    # Pass the lookup table explicitly instead of letting MintPy search the current directory
+    lookup_file = get_lookup_file(os.path.dirname(file_fullpath))
+    if lookup_file:
+        cmd += f" --lookup {lookup_file}"
+
     geocode.main(cmd.split())
 
 
@@ -133,6 +563,13 @@ def run_save_gdal(eos_file, temp_coh_file):
     save_gdal.main( cmd.split() )
 
 
+def run_save_coherence(eos_file, out_file, box):
+    """Write the temporal coherence of the (x0, y0, x1, y1) box of eos_file, for mask.py"""
+    metadata = subset_metadata(read_metadata(eos_file), box)
+    metadata.update({'FILE_TYPE': 'temporalCoherence', 'DATA_TYPE': 'float32', 'UNIT': '1'})
+    writefile.write({'temporalCoherence': read_temporal_coherence(eos_file, box)}, out_file=out_file, metadata=metadata)
+
+
 def run_mask(out_vel_file, temp_coh_file, mask_vmin):
     out_mskd_file = out_vel_file.replace('.h5', '_msk.h5')
     cmd = f'{out_vel_file} --mask {temp_coh_file} --mask-vmin { mask_vmin} --outfile {out_mskd_file}'
@@ -141,11 +578,37 @@ def run_mask(out_vel_file, temp_coh_file, mask_vmin):
     return out_mskd_file
 
 
-def run_reference_point(out_mskd_file, ref_lalo):
-    cmd = f'{out_mskd_file} --lat {ref_lalo[0]} --lon {ref_lalo[1]}'
+def run_reference_point(out_mskd_file, ref_lalo, out_file):
+    # Without --force MintPy does not write out_file when the input already has the same REF_Y/REF_X
+    cmd = f'{out_mskd_file} --lat {ref_lalo[0]} --lon {ref_lalo[1]} --outfile {out_file} --force'
     reference_point.main( cmd.split() )
 
 
-def run_asc_desc2horz_vert(mskd_file, horz_name, vert_name):
-    cmd = f'{mskd_file[0]} {mskd_file[1]} --output {horz_name} {vert_name}'
-    asc_desc2horz_vert.main( cmd.split() )
\ No newline at end of file
+def run_reference(out_mskd_file, ref_files, window_size, ref_lalo):
+    # Nearest pixel to ref_lalo that is valid in every track
+    ref_lalo = select_reference_point(out_mskd_file, window_size, ref_lalo)
+
+    for geo_vel, ref_file in zip(out_mskd_file, ref_files):
+        run_reference_point(geo_vel, ref_lalo, ref_file)
+
+
+def run_asc_desc2horz_vert(mskd_file, horz_name, vert_name, eos_files, region=None):
+    # MintPy's asc_desc2horz_vert.py takes exactly two files, more tracks are decomposed by least squares
+    if len(mskd_file) == 2:
+        cmd = f'{" ".join(mskd_file)} --output {horz_name} {vert_name}'
+        ad2hv.main( cmd.split() )
+        return
+
+    velocities, metadata_list = zip(*[readfile.read(file) for file in mskd_file])
+    los_geometry = []
+
+    for eos_file in eos_files:
+        metadata = read_metadata(eos_file)
+
+        # Mean angles over --subset-lalo, which only applies to geocoded time-series
+        box = read_box(eos_file, region) if 'Y_STEP' in metadata else None
+        los_geometry.append(get_los_geometry(eos_file, metadata, box))
+
+    horz, vert, metadata = asc_desc2horz_vert(list(velocities), list(metadata_list), los_geometry)
+    write_velocity(horz, metadata, horz_name)
+    write_velocity(vert, metadata, vert_name)
\ No newline at end of file
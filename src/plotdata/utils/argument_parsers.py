@@ -58,7 +58,7 @@ def add_location_arguments(parser):
                         nargs='?',
                         dest='plot_box',
                         type=str,
-                        help='Geographic area plotted')
+                        help='Geographic area processed and plotted')
     location.add_argument('--ref-lalo',
                         nargs='*',
                         metavar=('LATITUDE,LONGITUDE or LATITUDE LONGITUDE'),
@@ -108,6 +108,10 @@ def add_plot_parameters_arguments(parser):
                         default='scatter',
                         choices=['pixel', 'scatter', 'ifgram'],
                         help='Style of the plot (default: %(default)s).')
+    plot_parameters.add_argument('--lod',
+                        default='mean',
+                        choices=['mean', 'median', 'none'],
+                        help='With --style scatter, aggregate the data to the pixels of the axes before drawing (default: %(default)s).')
     plot_parameters.add_argument('--no-show',
                         dest='show_flag',
                         action='store_false',
@@ -177,7 +181,13 @@ def add_map_parameters_arguments(parser):
     map_parameters.add_argument('--resolution',
                         type=str,
                         default='01m',
-                        help='Resolution for the map (default: %(default)s).')
+                        help='Resolution of the earth relief (e.g. 15s, 01m), or auto to follow the size of the axes (default: %(default)s).')
+    map_parameters.add_argument('--dem-max-pixels',
+                        dest='dem_max_pixels',
+                        type=int,
+                        default=4000000,
+                        metavar='PIXELS',
+                        help='With --resolution auto, largest earth relief grid fetched per panel; finer views are resampled (default: %(default)s).')
     map_parameters.add_argument('--color',
                         type=str,
                         default='black',
@@ -197,7 +207,26 @@ def add_map_parameters_arguments(parser):
     map_parameters.add_argument('--no-shade',
                         action='store_true',
                         help='Shade the dem')
-
+    map_parameters.add_argument('--dem-source',
+                        dest='dem_source',
+                        choices=['gmt', 'geometry'],
+                        default='gmt',
+                        help='Elevation of relief, isolines and sections: GMT earth relief, or the height of --dem resampled to the data grid (default: %(default)s).')
+    map_parameters.add_argument('--dem-cache-dir',
+                        dest='dem_cache_dir',
+                        type=str,
+                        default=None,
+                        metavar='DIR',
+                        help='Keep earth relief tiles across runs in DIR (default: in memory for the run only, or $SCRATCHDIR/dem_cache with --offline).')
+    map_parameters.add_argument('--dem-cache-max-size',
+                        dest='dem_cache_max_size',
+                        type=float,
+                        default=5,
+                        metavar='GB',
+                        help='Evict least recently used earth relief tiles of --dem-cache-dir above this size (default: %(default)s).')
+    map_parameters.add_argument('--offline',
+                        action='store_true',
+                        help='Never download earth relief, use only the tiles in --dem-cache-dir (default: $SCRATCHDIR/dem_cache)')
 
     return parser
 
@@ -219,12 +248,22 @@ def add_save_arguments(parser):
                       default=None,
                       const='volcano-name',
                       nargs='?',
-                      help='Save the plot. If --save is provided without a value, default is %(const)s.')
+                      help='Save the plot without displaying it, named after the volcano name or id, plot type and periods. If --save is provided without a value, default is %(const)s.')
     save.add_argument('--outdir',
                       type=str,
                       default=os.getcwd(),
                       metavar='PATH',
                       help='Folder to save the plot (default: %(default)s).')
+    save.add_argument('--save-format',
+                      dest='save_format',
+                      nargs='+',
+                      choices=['png', 'pdf', 'svg'],
+                      default=['png'],
+                      help='Formats of the saved plot (default: %(default)s).')
+    save.add_argument('--dpi',
+                      type=int,
+                      default=300,
+                      help='Resolution of the saved png plot (default: %(default)s).')
     save.add_argument('--save-gbis',
                       dest='flag_save_gbis',
                       action='store_true',
@@ -234,6 +273,67 @@ def add_save_arguments(parser):
     return parser
 
 
+def add_processing_arguments(parser):
+    """
+    Argument parser for the data preparation options.
+
+    Args:
+        parser (argparse.ArgumentParser): The argument parser object.
+
+    Returns:
+        argparse.ArgumentParser: The argument parser object with added processing arguments.
+    """
+    processing = parser.add_argument_group('Processing options')
+    processing.add_argument('--jobs',
+                        dest='jobs',
+                        type=int,
+                        default=1,
+                        metavar='N',
+                        help='Number of parallel processes preparing tracks and map panels (default: %(default)s).')
+    processing.add_argument('--dry-run',
+                        dest='dry_run',
+                        action='store_true',
+                        help='Print the tasks of the prepare pipeline, whether they run or are up to date and their estimated cost, without running them')
+    processing.add_argument('--in-memory',
+                        dest='in_memory',
+                        action='store_true',
+                        help='Estimate, mask, reference and decompose velocities in memory, writing only the products used for plotting')
+    processing.add_argument('--save-intermediate',
+                        dest='save_intermediate',
+                        action='store_true',
+                        help='With --in-memory, also write the unmasked and per-track velocity files')
+    processing.add_argument('--incremental',
+                        dest='incremental',
+                        action='store_true',
+                        help='Keep the velocity normal equations per pixel and only add new acquisitions when the time-series grows')
+    processing.add_argument('--sliding-window',
+                        dest='sliding_window',
+                        nargs=2,
+                        default=None,
+                        metavar=('LENGTH', 'STEP'),
+                        help='Estimate velocities in windows of LENGTH stepped by STEP across the whole time-series (e.g. 6M 1M), written as one stacked file per track and plotted one page per window')
+    processing.add_argument('--profile',
+                        dest='profile',
+                        type=str,
+                        default=None,
+                        metavar='FILE',
+                        help='Write the wall time, CPU time and bytes read/written of each stage as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)')
+    processing.add_argument('--cache-max-size',
+                        dest='cache_max_size',
+                        type=float,
+                        default=None,
+                        metavar='GB',
+                        help='Evict least recently used derived products above this size per project (default: %(default)s).')
+    processing.add_argument('--cache-max-age',
+                        dest='cache_max_age',
+                        type=float,
+                        default=None,
+                        metavar='DAYS',
+                        help='Evict derived products not used for this many days (default: %(default)s).')
+
+    return parser
+
+
 def add_gps_arguments(parser):
     """
     Add GPS-related arguments to the given argument parser.
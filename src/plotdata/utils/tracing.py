@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Spans recorded since enable_tracing, as Chrome trace 'complete' events
+_events = []
+_enabled = False
+
+
+def enable_tracing():
+    global _enabled
+    _enabled = True
+
+
+def is_tracing():
+    return _enabled
+
+
+def read_io_counters():
+    """
+    Bytes read and written by this process so far, from /proc/self/io.
+
+    rchar/wchar count every read/write call, including the ones served by the page cache,
+    which is what a re-read of a cached HDF5 file costs. Returns zeros where /proc is not available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+@contextmanager
+def span(name, category='plotdata', **args):
+    """
+    Record the wall time, CPU time, bytes read and bytes written of the enclosed block.
+
+    Does nothing unless enable_tracing was called (--profile).
+
+    Args:
+        name (str): Name of the span (e.g. 'mask SenDT87 20200101:20231231').
+        category (str): Category of the span (e.g. 'prepare', 'plot', 'dem').
+        **args: Extra values shown with the span.
+    """
+    if not _enabled:
+        yield
+        return
+
+    read_start, written_start = read_io_counters()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        read_end, written_end = read_io_counters()
+
+        args.update({
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'bytes_read': read_end - read_start,
+            'bytes_written': written_end - written_start,
+        })
+
+        _events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': wall_start * 1e6,
+            'dur': wall * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+
+def traced_call(name, category, func, *args, **kwargs):
+    """
+    Run func in a span and return its result with the spans recorded during the call.
+
+    Used for functions running in worker processes, whose spans are passed back with add_events.
+    """
+    enable_tracing()
+    start = len(_events)
+
+    with span(name, category):
+        result = func(*args, **kwargs)
+
+    events = _events[start:]
+    del _events[start:]
+
+    return result, events
+
+
+def add_events(events):
+    _events.extend(events)
+
+
+def write_trace(out_file):
+    """ Write the recorded spans as a Chrome trace file, readable by chrome://tracing and Perfetto """
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    os.makedirs(out_dir, exist_ok=True)
+
+    with open(out_file, 'w') as f:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, f)
+
+    print('-'*50)
+    print(f'Trace with {len(_events)} spans written to {out_file}')
@@ -0,0 +1,545 @@
+#! /usr/bin/env python3
+# In-memory versions of the MintPy stages used by run_prepare (timeseries2velocity, mask, reference_point,
+# asc_desc2horz_vert). Arrays are kept in memory between the stages and only the products are written.
+
+import os
+import re
+import h5py
+import bisect
+import numpy as np
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from mintpy.utils import writefile
+from mintpy.utils import utils as ut
+from plotdata.helper_functions import get_subset_box, subset_metadata, read_metadata, read_date_list, lalo2yx
+
+HDFEOS_DISPLACEMENT = 'HDFEOS/GRIDS/timeseries/observation/displacement'
+HDFEOS_COHERENCE = 'HDFEOS/GRIDS/timeseries/quality/temporalCoherence'
+HDFEOS_INCIDENCE = 'HDFEOS/GRIDS/timeseries/geometry/incidenceAngle'
+HDFEOS_AZIMUTH = 'HDFEOS/GRIDS/timeseries/geometry/azimuthAngle'
+
+# Number of rows of the time-series read at once
+CHUNK_ROWS = 256
+
+# Memory used by the cumulative sums of the sliding-window estimator, in bytes
+SLIDING_WINDOW_MEMORY = 2**28
+
+
+def date_list2years(date_list):
+    """ Returns the time of each YYYYMMDD date in years since the first date """
+    ordinals = np.array([datetime.strptime(date, '%Y%m%d').toordinal() for date in date_list], dtype=np.float64)
+    return (ordinals - ordinals[0]) / 365.25
+
+
+def get_period_indices(date_list, start_date, end_date):
+    """ Returns the indices of the dates within [start_date, end_date] """
+    indices = [i for i, date in enumerate(date_list) if int(start_date) <= int(date) <= int(end_date)]
+
+    if len(indices) < 2:
+        raise ValueError(f'Need at least two acquisitions between {start_date} and {end_date} to estimate velocity')
+
+    return np.array(indices)
+
+
+def design_matrix(date_list):
+    """ Design matrix of the linear model displacement = velocity * t + offset, with t in years """
+    t = date_list2years(date_list)
+    return np.vstack([t, np.ones_like(t)]).T
+
+
+def read_box(eos_file, region=None):
+    """ Returns the (x0, y0, x1, y1) box of the HDF-EOS5 grid covering region, or the full grid if region is None """
+    metadata = read_metadata(eos_file)
+
+    if region is None:
+        return 0, 0, int(metadata['WIDTH']), int(metadata['LENGTH'])
+
+    return get_subset_box(metadata, region)
+
+
+def estimate_velocity(eos_file, start_date, end_date, box=None, chunk_rows=CHUNK_ROWS):
+    """
+    Least-squares linear velocity of the HDF-EOS5 time-series between start_date and end_date.
+
+    Only the (x0, y0, x1, y1) box of the stack is read, in blocks of chunk_rows rows, so memory and I/O
+    scale with the subset. Pixels with a NaN acquisition in the period are NaN.
+
+    Returns:
+        numpy.ndarray: 2D float32 velocity in m/year.
+    """
+    return estimate_velocities(eos_file, [(start_date, end_date)], box, chunk_rows)[0]
+
+
+def estimate_velocities(eos_file, periods, box=None, chunk_rows=CHUNK_ROWS):
+    """
+    Velocities of several periods from a single read of the HDF-EOS5 time-series.
+
+    The stack is read once, block by block over the dates spanned by all periods, and each block is
+    solved for every period with that period's design matrix.
+
+    Args:
+        eos_file (str): HDF-EOS5 file.
+        periods (list): (start_date, end_date) pairs given as YYYYMMDD.
+        box (tuple): (x0, y0, x1, y1) box to read (default: full grid).
+        chunk_rows (int): Number of rows read at once.
+
+    Returns:
+        list: 2D float32 velocity in m/year for each period.
+    """
+    date_list = read_date_list(eos_file)
+    indices = [get_period_indices(date_list, start_date, end_date) for start_date, end_date in periods]
+    A_invs = [np.linalg.pinv(design_matrix([date_list[i] for i in index])) for index in indices]
+
+    # Dates are sorted, so all periods are inside one contiguous slice of the stack
+    first = min(index[0] for index in indices)
+    last = max(index[-1] for index in indices)
+
+    with h5py.File(eos_file, 'r') as f:
+        dset = f[HDFEOS_DISPLACEMENT]
+        x0, y0, x1, y1 = box if box else (0, 0, dset.shape[2], dset.shape[1])
+        velocities = [np.empty((y1 - y0, x1 - x0), dtype=np.float32) for _ in periods]
+
+        for row0 in range(y0, y1, chunk_rows):
+            row1 = min(row0 + chunk_rows, y1)
+            block = dset[first:last + 1, row0:row1, x0:x1].reshape(last - first + 1, -1)
+
+            for velocity, index, A_inv in zip(velocities, indices, A_invs):
+                velocity[row0 - y0:row1 - y0] = (A_inv[0] @ block[index - first]).reshape(row1 - row0, x1 - x0)
+
+    return velocities
+
+
+def get_fingerprint(eos_file):
+    """ Size and modification time of eos_file, which change when it is appended to or reprocessed """
+    stat = os.stat(eos_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def get_probe_pixels(box):
+    """ Rows and columns of the 3 x 3 pixels of the (x0, y0, x1, y1) box whose values identify each acquisition """
+    x0, y0, x1, y1 = box
+    ys = [y0 + (y1 - y0) * k // 4 for k in (1, 2, 3)]
+    xs = [x0 + (x1 - x0) * k // 4 for k in (1, 2, 3)]
+
+    return np.repeat(ys, 3), np.tile(xs, 3)
+
+
+def read_probes(eos_file, date_list, dates, box):
+    """ Displacement of the probe pixels of box for each of the dates, shape (len(dates), 9) """
+    indices = [date_list.index(date) for date in dates]
+    ys, xs = get_probe_pixels(box)
+
+    with h5py.File(eos_file, 'r') as f:
+        dset = f[HDFEOS_DISPLACEMENT]
+        return np.array([dset[:, y, x][indices] for y, x in zip(ys, xs)], dtype=np.float64).T.reshape(len(dates), len(ys))
+
+
+def init_normal_equations(start_date, box, metadata):
+    """ Empty per-pixel normal equations of the linear model, with time measured in years from start_date """
+    x0, y0, x1, y1 = box
+    shape = (y1 - y0, x1 - x0)
+
+    return {
+        'start_date': start_date,
+        'box': np.array(box),
+        'reference': np.array([metadata.get(key, '') for key in ['REF_DATE', 'REF_Y', 'REF_X']]),
+        'dates': np.array([], dtype=str),
+        'n': 0.0,
+        'sum_t': 0.0,
+        'sum_tt': 0.0,
+        'sum_d': np.zeros(shape, dtype=np.float64),
+        'sum_td': np.zeros(shape, dtype=np.float64),
+        'nan_count': np.zeros(shape, dtype=np.int32),
+        'fingerprint': np.zeros(2, dtype=np.int64),
+        'probe': np.zeros((0, 9), dtype=np.float64),
+    }
+
+
+def load_normal_equations(state_file):
+    if not os.path.exists(state_file):
+        return None
+
+    with np.load(state_file) as data:
+        state = {key: data[key] for key in data.files}
+
+    state['start_date'] = str(state['start_date'])
+    for key in ['n', 'sum_t', 'sum_tt']:
+        state[key] = float(state[key])
+
+    return state
+
+
+def save_normal_equations(state, state_file):
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    tmp_file = state_file.replace('.npz', f'.{os.getpid()}.tmp.npz')
+    np.savez(tmp_file, **state)
+    os.replace(tmp_file, state_file)
+
+
+def update_normal_equations(state, eos_file, date_list, add=[], remove=[]):
+    """ Adds (or removes) the contribution of the given acquisitions to the normal equations, reading only those """
+    x0, y0, x1, y1 = state['box']
+    t0 = datetime.strptime(state['start_date'], '%Y%m%d').toordinal()
+    ys, xs = get_probe_pixels(state['box'])
+    probes = dict(zip(state['dates'].tolist(), state['probe']))
+
+    with h5py.File(eos_file, 'r') as f:
+        dset = f[HDFEOS_DISPLACEMENT]
+
+        for sign, dates in [(1, add), (-1, remove)]:
+            for date in dates:
+                t = (datetime.strptime(date, '%Y%m%d').toordinal() - t0) / 365.25
+                data = dset[date_list.index(date), y0:y1, x0:x1].astype(np.float64)
+                finite = np.isfinite(data)
+                data[~finite] = 0
+
+                state['n'] += sign
+                state['sum_t'] += sign * t
+                state['sum_tt'] += sign * t * t
+                state['sum_d'] += sign * data
+                state['sum_td'] += sign * t * data
+                state['nan_count'] += sign * (~finite).astype(np.int32)
+
+                if sign > 0:
+                    probes[date] = np.where(finite, data, np.nan)[ys - y0, xs - x0]
+                else:
+                    probes.pop(date, None)
+
+    dates = sorted(probes)
+    state['dates'] = np.array(dates, dtype=str)
+    state['probe'] = np.array([probes[date] for date in dates], dtype=np.float64).reshape(len(dates), len(ys))
+
+    return state
+
+
+def solve_normal_equations(state):
+    """ Velocity (m/year) from the normal equations; pixels with a NaN acquisition are NaN """
+    n, sum_t, sum_tt = state['n'], state['sum_t'], state['sum_tt']
+    velocity = (n * state['sum_td'] - sum_t * state['sum_d']) / (n * sum_tt - sum_t ** 2)
+    velocity[state['nan_count'] > 0] = np.nan
+
+    return velocity.astype(np.float32)
+
+
+def estimate_velocity_incremental(eos_file, start_date, end_date, state_file, box=None):
+    """
+    Velocity between start_date and end_date from normal equations persisted in state_file.
+
+    When acquisitions are appended to the HDF-EOS5 file only their contribution is read and added, and
+    acquisitions no longer in the period are subtracted. The stored equations are rebuilt when the box or
+    the reference of the time-series changed, or when updating would read as many dates as a full fit.
+    When the file changed since the last update, the acquisitions already in the equations are checked at
+    a few probe pixels and the equations rebuilt if the file was reprocessed.
+    """
+    date_list = read_date_list(eos_file)
+    metadata = read_metadata(eos_file)
+    target = [date_list[i] for i in get_period_indices(date_list, start_date, end_date)]
+    box = box if box else (0, 0, int(metadata['WIDTH']), int(metadata['LENGTH']))
+    reference = [metadata.get(key, '') for key in ['REF_DATE', 'REF_Y', 'REF_X']]
+
+    state = load_normal_equations(state_file)
+    stored = state['dates'].tolist() if state else []
+    add = [date for date in target if date not in stored]
+    remove = [date for date in stored if date not in target]
+
+    fingerprint = get_fingerprint(eos_file)
+
+    rebuild = (state is None
+               or 'probe' not in state
+               or state['start_date'] != start_date
+               or list(state['box']) != list(box)
+               or state['reference'].tolist() != reference
+               or any(date not in date_list for date in remove)
+               or len(add) + len(remove) >= len(target))
+
+    if not rebuild and not np.array_equal(state['fingerprint'], fingerprint):
+        if not np.array_equal(read_probes(eos_file, date_list, stored, box), state['probe'], equal_nan=True):
+            print(f'WARNING: acquisitions of {os.path.basename(eos_file)} changed since {os.path.basename(state_file)} was saved, rebuilding')
+            rebuild = True
+
+    if rebuild:
+        state = init_normal_equations(start_date, box, metadata)
+        add, remove = target, []
+
+    print(f'Normal equations {os.path.basename(state_file)}: adding {len(add)}, removing {len(remove)} acquisitions')
+
+    if add or remove or not np.array_equal(state['fingerprint'], fingerprint):
+        if add or remove:
+            state = update_normal_equations(state, eos_file, date_list, add, remove)
+        state['fingerprint'] = fingerprint
+        save_normal_equations(state, state_file)
+
+    return solve_normal_equations(state)
+
+
+def parse_duration(value):
+    """ Converts a duration such as 6M, 30D, 2W or 1Y into a relativedelta """
+    match = re.fullmatch(r'(\d+)([DWMY])', value.upper())
+
+    if not match:
+        raise ValueError(f'USER ERROR: duration {value} not valid, it must be a number followed by D, W, M or Y (e.g. 6M)')
+
+    number, unit = int(match.group(1)), match.group(2)
+    return {'D': relativedelta(days=number), 'W': relativedelta(weeks=number),
+            'M': relativedelta(months=number), 'Y': relativedelta(years=number)}[unit]
+
+
+def get_sliding_windows(date_list, length, step):
+    """
+    Windows of the given length (relativedelta) stepped by step across the whole date list.
+
+    Returns:
+        list: (first, last) index pairs, last excluded, of the windows with at least two acquisitions.
+    """
+    dates = [datetime.strptime(date, '%Y%m%d') for date in date_list]
+    windows = []
+    start = dates[0]
+
+    while start + length <= dates[-1]:
+        first = bisect.bisect_left(dates, start)
+        last = bisect.bisect_right(dates, start + length)
+
+        if last - first >= 2:
+            windows.append((first, last))
+
+        start += step
+
+    return windows
+
+
+def estimate_sliding_velocities(eos_file, windows, out_file, metadata, box=None, mask_vmin=None):
+    """
+    Velocity of every window from one pass over the time-series, written as one stacked dataset.
+
+    For each block of rows the regression sums (1, t, t^2, d, t*d) are accumulated along time, so the
+    velocity of any window is a difference of two cumulative sums.
+
+    Args:
+        eos_file (str): HDF-EOS5 file.
+        windows (list): (first, last) date index pairs from get_sliding_windows.
+        out_file (str): Output file with 'velocity' (window, length, width), 'start_date' and 'end_date'.
+        metadata (dict): Attributes of the output grid.
+        box (tuple): (x0, y0, x1, y1) box to read (default: full grid).
+        mask_vmin (float): Mask pixels with temporal coherence below this value (default: no mask).
+    """
+    date_list = read_date_list(eos_file)
+    first = min(window[0] for window in windows)
+    last = max(window[1] for window in windows)
+
+    t = date_list2years(date_list)[first:last]
+    zero = np.zeros(1)
+    cum_n = np.concatenate([zero, np.cumsum(np.ones_like(t))])
+    cum_t = np.concatenate([zero, np.cumsum(t)])
+    cum_tt = np.concatenate([zero, np.cumsum(t * t)])
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+
+    with h5py.File(eos_file, 'r') as f, h5py.File(out_file, 'w') as fo:
+        dset = f[HDFEOS_DISPLACEMENT]
+        x0, y0, x1, y1 = box if box else (0, 0, dset.shape[2], dset.shape[1])
+        length, width = y1 - y0, x1 - x0
+
+        out = fo.create_dataset('velocity', shape=(len(windows), length, width), dtype=np.float32,
+                                chunks=(1, min(length, 256), min(width, 256)))
+        fo.create_dataset('start_date', data=np.array([date_list[i] for i, _ in windows], dtype='S8'))
+        fo.create_dataset('end_date', data=np.array([date_list[j - 1] for _, j in windows], dtype='S8'))
+
+        # Three float64 cumulative sums of the block are held at once
+        chunk_rows = max(1, SLIDING_WINDOW_MEMORY // ((last - first + 1) * width * 8 * 3))
+
+        for row0 in range(y0, y1, chunk_rows):
+            row1 = min(row0 + chunk_rows, y1)
+            block = dset[first:last, row0:row1, x0:x1].astype(np.float64)
+            finite = np.isfinite(block)
+            block[~finite] = 0
+
+            cum_d = np.concatenate([np.zeros((1,) + block.shape[1:]), np.cumsum(block, axis=0)])
+            cum_td = np.concatenate([np.zeros((1,) + block.shape[1:]), np.cumsum(block * t[:, None, None], axis=0)])
+            cum_nan = np.concatenate([np.zeros((1,) + block.shape[1:], dtype=np.int32), np.cumsum(~finite, axis=0)])
+            del block, finite
+
+            coherence = f[HDFEOS_COHERENCE][row0:row1, x0:x1] if mask_vmin is not None else None
+
+            for k, (i, j) in enumerate(windows):
+                i, j = i - first, j - first
+                n, sum_t, sum_tt = cum_n[j] - cum_n[i], cum_t[j] - cum_t[i], cum_tt[j] - cum_tt[i]
+
+                velocity = (n * (cum_td[j] - cum_td[i]) - sum_t * (cum_d[j] - cum_d[i])) / (n * sum_tt - sum_t ** 2)
+                velocity[cum_nan[j] - cum_nan[i] > 0] = np.nan
+
+                if coherence is not None:
+                    velocity[~(coherence >= mask_vmin)] = np.nan
+
+                out[k, row0 - y0:row1 - y0] = velocity
+
+        metadata = dict(metadata)
+        metadata.update({'FILE_TYPE': 'velocity', 'DATA_TYPE': 'float32', 'UNIT': 'm/year',
+                         'START_DATE': date_list[first], 'END_DATE': date_list[last - 1]})
+        if box:
+            metadata = subset_metadata(metadata, box)
+
+        for key, value in metadata.items():
+            fo.attrs[key] = str(value)
+
+    return out_file
+
+
+def read_sliding_window(file, index, box=None):
+    """ Returns the velocity, start date and end date of one window of a sliding-window file """
+    with h5py.File(file, 'r') as f:
+        dset = f['velocity']
+        x0, y0, x1, y1 = box if box else (0, 0, dset.shape[2], dset.shape[1])
+
+        return dset[index, y0:y1, x0:x1], f['start_date'][index].decode(), f['end_date'][index].decode()
+
+
+def read_sliding_window_dates(file):
+    """ Returns the (start_date, end_date) of every window of a sliding-window file """
+    with h5py.File(file, 'r') as f:
+        return [(start.decode(), end.decode()) for start, end in zip(f['start_date'][:], f['end_date'][:])]
+
+
+def velocity_metadata(eos_file, start_date, end_date, box=None):
+    """ Returns the attributes of a velocity product derived from the (x0, y0, x1, y1) box of eos_file """
+    metadata = read_metadata(eos_file)
+    metadata['FILE_TYPE'] = 'velocity'
+    metadata['DATA_TYPE'] = 'float32'
+    metadata['UNIT'] = 'm/year'
+    metadata['START_DATE'] = start_date
+    metadata['END_DATE'] = end_date
+    metadata['DATE12'] = f'{start_date[2:]}_{end_date[2:]}'
+    metadata.pop('REF_DATE', None)
+
+    if box:
+        metadata = subset_metadata(metadata, box)
+
+    return metadata
+
+
+def read_temporal_coherence(eos_file, box=None):
+    with h5py.File(eos_file, 'r') as f:
+        if not box:
+            return f[HDFEOS_COHERENCE][:]
+
+        x0, y0, x1, y1 = box
+        return f[HDFEOS_COHERENCE][y0:y1, x0:x1]
+
+
+def mask_velocity(velocity, coherence, mask_vmin):
+    """ Sets pixels with coherence below mask_vmin to NaN, as mask.py --mask-vmin does """
+    velocity = np.array(velocity, dtype=np.float32)
+    velocity[~(coherence >= mask_vmin)] = np.nan
+
+    return velocity
+
+
+def reference_velocity(velocity, metadata, ref_lalo):
+    """ Re-references velocity to the pixel at ref_lalo, as reference_point.py --lat --lon does """
+    y, x = lalo2yx(metadata, ref_lalo[0], ref_lalo[1])
+
+    if not (0 <= y < velocity.shape[0] and 0 <= x < velocity.shape[1]):
+        raise ValueError(f'input reference point is OUT of data coverage: {ref_lalo}')
+
+    if np.isnan(velocity[y, x]):
+        raise ValueError(f'input reference point is masked (NaN): {ref_lalo}')
+
+    velocity = velocity - velocity[y, x]
+    metadata = dict(metadata)
+    metadata.update({'REF_LAT': str(ref_lalo[0]), 'REF_LON': str(ref_lalo[1]), 'REF_Y': str(y), 'REF_X': str(x)})
+
+    return velocity, metadata
+
+
+def get_los_geometry(eos_file, metadata, box=None):
+    """ Returns the mean LOS incidence and azimuth angles (degrees) of a track over the (x0, y0, x1, y1) box """
+    x0, y0, x1, y1 = box if box else (0, 0, int(metadata['WIDTH']), int(metadata['LENGTH']))
+
+    with h5py.File(eos_file, 'r') as f:
+        if HDFEOS_INCIDENCE in f and HDFEOS_AZIMUTH in f:
+            return float(np.nanmean(f[HDFEOS_INCIDENCE][y0:y1, x0:x1])), float(np.nanmean(f[HDFEOS_AZIMUTH][y0:y1, x0:x1]))
+
+    inc_angle = float(ut.incidence_angle(metadata, dimension=0, print_msg=False))
+    az_angle = float(ut.heading2azimuth_angle(float(metadata['HEADING'])))
+
+    return inc_angle, az_angle
+
+
+def get_overlap_boxes(metadata_list):
+    """
+    Common lat/lon area of co-registered geocoded grids.
+
+    Returns:
+        tuple: (x0, y0, x1, y1) pixel box of the overlap in each grid and the metadata of the overlap grid.
+    """
+    x_step = float(metadata_list[0]['X_STEP'])
+    y_step = float(metadata_list[0]['Y_STEP'])
+
+    for metadata in metadata_list[1:]:
+        if not np.isclose(float(metadata['X_STEP']), x_step) or not np.isclose(float(metadata['Y_STEP']), y_step):
+            raise ValueError('Input files must have the same pixel size for the horizontal/vertical decomposition')
+
+    west = max(float(m['X_FIRST']) for m in metadata_list)
+    north = min(float(m['Y_FIRST']) for m in metadata_list)
+    east = min(float(m['X_FIRST']) + int(m['WIDTH']) * x_step for m in metadata_list)
+    south = max(float(m['Y_FIRST']) + int(m['LENGTH']) * y_step for m in metadata_list)
+
+    width = int(round((east - west) / x_step))
+    length = int(round((south - north) / y_step))
+
+    if width <= 0 or length <= 0:
+        raise ValueError('Input files do not overlap')
+
+    boxes = []
+    for metadata in metadata_list:
+        x0 = int(round((west - float(metadata['X_FIRST'])) / x_step))
+        y0 = int(round((north - float(metadata['Y_FIRST'])) / y_step))
+        boxes.append((x0, y0, x0 + width, y0 + length))
+
+    overlap = dict(metadata_list[0])
+    overlap.update({'X_FIRST': str(west), 'Y_FIRST': str(north), 'WIDTH': str(width), 'LENGTH': str(length)})
+
+    return boxes, overlap
+
+
+def asc_desc2horz_vert(velocities, metadata_list, los_geometry, horz_az_angle=-90):
+    """
+    Decompose two or more LOS velocities into horizontal and vertical components.
+
+    Args:
+        velocities (list): 2D LOS velocities, one per track.
+        metadata_list (list): Metadata of each velocity.
+        los_geometry (list): (incidence, azimuth) angles in degrees of each track, MintPy convention.
+        horz_az_angle (float): Azimuth angle of the horizontal component (default -90, i.e. east).
+
+    Returns:
+        tuple: horizontal and vertical velocity on the overlap grid and the metadata of that grid.
+    """
+    if len(velocities) < 2:
+        raise ValueError('Need at least two velocity files for the horizontal/vertical decomposition')
+
+    boxes, metadata = get_overlap_boxes(metadata_list)
+    length, width = int(metadata['LENGTH']), int(metadata['WIDTH'])
+
+    los = np.stack([velocity[y0:y1, x0:x1] for velocity, (x0, y0, x1, y1) in zip(velocities, boxes)]).reshape(len(velocities), -1)
+
+    inc_angle = np.deg2rad([geometry[0] for geometry in los_geometry])
+    az_angle = np.deg2rad([geometry[1] for geometry in los_geometry])
+    A = np.vstack([np.sin(inc_angle) * np.cos(az_angle - np.deg2rad(horz_az_angle)), np.cos(inc_angle)]).T
+
+    # Solve only where every track has data
+    valid = np.all(np.isfinite(los), axis=0)
+    horz_vert = np.full((2, los.shape[1]), np.nan, dtype=np.float32)
+    horz_vert[:, valid] = np.linalg.pinv(A) @ los[:, valid]
+
+    metadata = dict(metadata)
+    metadata.pop('REF_Y', None)
+    metadata.pop('REF_X', None)
+
+    return horz_vert[0].reshape(length, width), horz_vert[1].reshape(length, width), metadata
+
+
+def write_velocity(velocity, metadata, out_file):
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+    writefile.write({'velocity': np.asarray(velocity, dtype=np.float32)}, out_file=out_file, metadata=metadata)
+
+    return out_file
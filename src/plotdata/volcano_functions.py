@@ -86,6 +86,18 @@ def get_volcano_coord_id(jsonfile, volcanoName: str):
             return coordinates, id
 
 
+def get_volcano_id(jsonfile, volcanoName: str):
+    """ Volcano number of volcanoName, matched ignoring case and spaces (e.g. MaunaLoa for Mauna Loa) """
+    data = get_volcano_json(jsonfile, JSON_DOWNLOAD_URL)
+    name = volcanoName.replace(' ', '').lower()
+
+    for j in data['features']:
+        if j['properties']['VolcanoName'].replace(' ', '').lower() == name:
+            return j['properties']['VolcanoNumber']
+
+    raise ValueError(f'USER ERROR: volcano {volcanoName} not found, use --save volcano-name')
+
+
 def get_volcano_event(jsonfile, volcanoName: str, start_date, end_date, strength = 0):
     """
     Extracts information about a specific volcano from a JSON file.
@@ -0,0 +1,51 @@
+import os
+import sys
+import h5py
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+
+# The package is run from the source tree (src/plotdata), without installation
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def write_eos_file(eos_file, n_dates=40, length=30, width=20, seed=0):
+    """
+    Writes a small HDF-EOS5 time-series with one acquisition every 12 days from 20190101.
+
+    Pixel (3, 4) of the sixth acquisition is NaN.
+
+    Returns:
+        tuple: dates (YYYYMMDD) and displacement (n_dates, length, width) written.
+    """
+    rng = np.random.default_rng(seed)
+    dates = [(datetime(2019, 1, 1) + timedelta(days=12 * i)).strftime('%Y%m%d') for i in range(n_dates)]
+    t = np.arange(n_dates) * 12 / 365.25
+    velocity = 0.05 + 0.01 * rng.standard_normal((length, width))
+    displacement = (t[:, None, None] * velocity + 0.002 * rng.standard_normal((n_dates, length, width))).astype(np.float32)
+    displacement[5, 3, 4] = np.nan
+
+    group = 'HDFEOS/GRIDS/timeseries/'
+    with h5py.File(eos_file, 'w') as f:
+        f[group + 'observation/displacement'] = displacement
+        f[group + 'observation/date'] = np.array(dates, dtype='S8')
+        f[group + 'observation/bperp'] = np.zeros(n_dates, dtype=np.float32)
+        f[group + 'quality/temporalCoherence'] = rng.uniform(0.5, 1, (length, width)).astype(np.float32)
+        f[group + 'geometry/incidenceAngle'] = np.full((length, width), 35, dtype=np.float32)
+        f[group + 'geometry/azimuthAngle'] = np.full((length, width), -100, dtype=np.float32)
+
+        attrs = {'FILE_TYPE': 'HDFEOS', 'LENGTH': length, 'WIDTH': width, 'X_FIRST': -155.6, 'Y_FIRST': 19.6,
+                 'X_STEP': 0.001, 'Y_STEP': -0.001, 'REF_DATE': dates[0], 'REF_Y': 0, 'REF_X': 0, 'WAVELENGTH': 0.055}
+        for key, value in attrs.items():
+            f.attrs[key] = str(value)
+
+    return dates, displacement
+
+
+@pytest.fixture
+def eos_file(tmp_path):
+    """ Path of a small HDF-EOS5 time-series, with its dates and displacement """
+    fname = str(tmp_path / 'S1_test.he5')
+    dates, displacement = write_eos_file(fname)
+
+    return fname, dates, displacement
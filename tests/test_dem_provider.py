@@ -0,0 +1,122 @@
+import os
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('pygmt')
+pytest.importorskip('xarray')
+
+from plotdata.objects.geogrid import GeoGrid
+from plotdata.objects.dem_provider import DemTileStore, DemProvider
+
+
+def seed_tiles(store, resolution, region):
+    """ Writes the tiles covering region with elevation 100 * lat + lon, as load_tile stores them """
+    step = int(resolution[:-1]) / 60
+
+    for tile in store.tiles(resolution, region):
+        lat = np.linspace(tile[2], tile[3], int(round((tile[3] - tile[2]) / step)) + 1)
+        lon = np.linspace(tile[0], tile[1], int(round((tile[1] - tile[0]) / step)) + 1)
+        file = store.tile_file(resolution, tile)
+
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        np.savez(file, elevation=np.add.outer(100 * lat, lon).astype(np.float32), lat=lat, lon=lon)
+
+
+def test_tiles():
+    store = DemTileStore('unused')
+
+    assert store.tile_size('01m') == 5 and store.tile_size('03s') == 1 and store.tile_size('01d') == 30
+    assert store.tiles('01m', [-156.2, -154.3, 19.1, 20.3]) == [[-160, -155, 15, 20], [-155, -150, 15, 20],
+                                                                [-160, -155, 20, 25], [-155, -150, 20, 25]]
+    assert store.tile_file('01m', [-160, -155, 15, 20]) == os.path.join('unused', '01m', '+15_-160.npz')
+
+
+def test_mosaic_across_tile_edges(tmp_path):
+    region = [-156.2, -154.3, 19.1, 20.3]
+    store = DemTileStore(str(tmp_path), offline=True)
+    seed_tiles(store, '01m', region)
+
+    grid = store.get('01m', region)
+    lat, lon = np.asarray(grid.coords['lat']), np.asarray(grid.coords['lon'])
+
+    # Pixels within half a pixel of the region, without the edges shared by the tiles twice
+    assert (len(lat), len(lon)) == (73, 115)
+    assert lat[0] == pytest.approx(19.1) and lat[-1] == pytest.approx(20.3)
+    assert lon[0] == pytest.approx(-156.2) and lon[-1] == pytest.approx(-154.3)
+    np.testing.assert_allclose(np.diff(lat), 1 / 60, atol=1e-7)
+    np.testing.assert_allclose(np.diff(lon), 1 / 60, atol=1e-7)
+    np.testing.assert_allclose(np.asarray(grid.values), np.add.outer(100 * lat, lon), rtol=1e-6)
+
+
+def test_offline_missing_tile(tmp_path):
+    store = DemTileStore(str(tmp_path), offline=True)
+    seed_tiles(store, '01m', [-156, -155.5, 19.1, 19.5])
+
+    with pytest.raises(ValueError):
+        store.get('01m', [-156, -154, 19.1, 19.5])
+
+
+def test_evict_least_recently_used(tmp_path):
+    store = DemTileStore(str(tmp_path), offline=True)
+    seed_tiles(store, '01m', [-156.2, -154.3, 19.1, 19.5])
+    files = [store.tile_file('01m', tile) for tile in store.tiles('01m', [-156.2, -154.3, 19.1, 19.5])]
+
+    os.utime(files[0], (1, 1))
+    store.max_size = os.path.getsize(files[1]) / 1024**3
+
+    assert store.evict() == [files[0]]
+    assert os.path.exists(files[1])
+
+
+@pytest.fixture
+def geometry_file(tmp_path):
+    """ 100 x 120 geometry file of 0.01 degree pixels from -155.5, 20.0, with height = 120 * row + column """
+    fname = str(tmp_path / 'geo_geometryRadar.h5')
+    height = np.arange(100 * 120, dtype=np.float32).reshape(100, 120)
+
+    with h5py.File(fname, 'w') as f:
+        f['height'] = height
+        f['incidenceAngle'] = np.zeros_like(height)
+        f.attrs.update({'FILE_TYPE': 'geometry', 'WIDTH': '120', 'LENGTH': '100', 'X_FIRST': '-155.5', 'Y_FIRST': '20.0',
+                        'X_STEP': '0.01', 'Y_STEP': '-0.01'})
+
+    return fname, height
+
+
+def test_get_geometry_region(geometry_file):
+    fname, height = geometry_file
+    provider = DemProvider()
+
+    elevation = provider.get_geometry(fname, [-155.4, -155.2, 19.5, 19.7])
+
+    # South to north, as load_earth_relief
+    lat, lon = np.asarray(elevation.coords['lat']), np.asarray(elevation.coords['lon'])
+    assert lat[0] == pytest.approx(19.505) and lat[-1] == pytest.approx(19.695)
+    assert lon[0] == pytest.approx(-155.395) and lon[-1] == pytest.approx(-155.205)
+    np.testing.assert_array_equal(np.asarray(elevation.values), height[30:50, 10:30][::-1])
+
+    assert provider.get_geometry(fname, [-155.4, -155.2, 19.5, 19.7]) is elevation
+
+
+def test_get_geometry_resampled_to_grid(geometry_file):
+    fname, height = geometry_file
+    provider = DemProvider()
+
+    aligned = GeoGrid(-155.5, 20.0, 0.01, -0.01, 120, 100).subset((10, 20, 40, 50))
+    np.testing.assert_array_equal(np.asarray(provider.get_geometry(fname, None, aligned).values), height[20:50, 10:40][::-1])
+
+    # Pixel centres at 19.995 - 0.02 * row, -155.515 + 0.02 * column: rows 2k and columns 2j - 2 of the file
+    coarse = GeoGrid(-155.525, 20.005, 0.02, -0.02, 62, 50)
+    elevation = np.asarray(provider.get_geometry(fname, None, coarse).values)[::-1]
+
+    assert elevation.shape == (50, 62)
+    assert np.isnan(elevation[:, 0]).all() and np.isnan(elevation[:, 61]).all()
+    np.testing.assert_array_equal(elevation[:, 1:61], height[0:100:2, 0:120:2])
+
+
+def test_get_geometry_outside(geometry_file):
+    fname, _ = geometry_file
+
+    with pytest.raises(ValueError):
+        DemProvider().get_geometry(fname, None, GeoGrid(-150, 20.0, 0.01, -0.01, 10, 10))
@@ -0,0 +1,103 @@
+import pytest
+import numpy as np
+from plotdata.objects.geogrid import GeoGrid
+
+
+# 400 x 400 pixels of 0.001 degrees, north-up, from -155.8, 19.6
+GRID = GeoGrid(-155.8, 19.6, 0.001, -0.001, 400, 400)
+
+
+def test_from_metadata():
+    metadata = {'X_FIRST': '-155.8', 'Y_FIRST': '19.6', 'X_STEP': '0.001', 'Y_STEP': '-0.001', 'WIDTH': '400', 'FILE_LENGTH': '400'}
+
+    assert GeoGrid.from_metadata(metadata) == GRID
+
+
+def test_from_region():
+    upper = GeoGrid.from_region([-155.8, -155.4, 19.2, 19.6], (400, 400))
+    lower = GeoGrid.from_region([-155.8, -155.4, 19.2, 19.6], (400, 400), origin='lower')
+
+    assert (upper.x_first, upper.y_first) == (-155.8, 19.6)
+    assert upper.y_step == pytest.approx(-0.001) and upper.x_step == pytest.approx(0.001)
+    assert (lower.y_first, lower.y_step) == (19.2, pytest.approx(0.001))
+    assert upper.region == pytest.approx([-155.8, -155.4, 19.2, 19.6])
+    assert lower.region == pytest.approx(upper.region)
+
+
+def test_from_region_gridline():
+    # 401 x 401 nodes every 0.001 degrees from -155.8, 19.2 to -155.4, 19.6, as pygmt earth relief
+    grid = GeoGrid.from_region([-155.8, -155.4, 19.2, 19.6], (401, 401), origin='lower', registration='gridline')
+
+    assert grid.x_step == pytest.approx(0.001) and grid.y_step == pytest.approx(0.001)
+    assert grid.lons[[0, -1]] == pytest.approx([-155.8, -155.4])
+    assert grid.lats[[0, -1]] == pytest.approx([19.2, 19.6])
+
+    # Points are in the pixel of the nearest node
+    assert grid.lalo2yx(19.2004, -155.7996) == (0, 0)
+    assert grid.lalo2yx(19.2006, -155.7994) == (1, 1)
+
+
+def test_pixel_centres():
+    assert GRID.lats[[0, -1]] == pytest.approx([19.5995, 19.2005])
+    assert GRID.lons[[0, -1]] == pytest.approx([-155.7995, -155.4005])
+
+
+def test_lalo2yx_and_yx2lalo():
+    assert GRID.lalo2yx(19.5, -155.6005) == (100, 199)
+    assert GRID.yx2lalo(100, 199) == pytest.approx((19.4995, -155.6005))
+
+    y, x = GRID.lalo2yx(GRID.lats[[3, 250]], GRID.lons[[7, 399]])
+    assert y.tolist() == [3, 250] and x.tolist() == [7, 399]
+    assert np.array(GRID.yx2lalo(y, x)) == pytest.approx(np.array([GRID.lats[[3, 250]], GRID.lons[[7, 399]]]))
+
+    assert not GRID.contains(*GRID.lalo2yx(19.6001, -155.7))
+    assert GRID.contains(*GRID.lalo2yx(19.2001, -155.4001))
+
+
+def test_window_box():
+    assert GRID.window_box(19.5, -155.6005, window_size=3) == (196, 97, 203, 104)
+
+    # Clipped at the first and last pixels
+    assert GRID.window_box(19.5995, -155.7995) == (0, 0, 4, 4)
+    assert GRID.window_box(19.2005, -155.4005) == (396, 396, 400, 400)
+
+    with pytest.raises(ValueError):
+        GRID.window_box(20, -155.7)
+
+
+def test_subset_and_offset():
+    sub = GRID.subset((53, 50, 100, 100))
+
+    assert sub.shape == (50, 47)
+    assert (sub.x_first, sub.y_first) == pytest.approx((-155.747, 19.55))
+    assert sub.lats[0] == pytest.approx(GRID.lats[50]) and sub.lons[0] == pytest.approx(GRID.lons[53])
+    assert GRID.is_aligned(sub)
+    assert GRID.offset(sub) == (50, 53)
+
+
+def test_not_aligned():
+    shifted = GeoGrid(-155.7995, 19.6, 0.001, -0.001, 10, 10)
+    coarser = GeoGrid(-155.8, 19.6, 0.002, -0.002, 10, 10)
+
+    assert not GRID.is_aligned(shifted)
+    assert not GRID.is_aligned(coarser)
+
+    with pytest.raises(ValueError):
+        GRID.offset(shifted)
+
+
+def test_region_box_edges_on_pixel_boundaries():
+    # (-155.747 + 155.8) / 0.001 = 52.99999999999727 and (-155.799 + 155.8) / 0.001 = 1.0000000000047748
+    assert GRID.region_box([-155.747, -155.7, 19.5, 19.55]) == (53, 50, 100, 100)
+    assert GRID.region_box([-155.8, -155.799, 19.599, 19.6]) == (0, 0, 1, 1)
+
+
+def test_region_box_partial_pixels():
+    assert GRID.region_box([-155.7475, -155.6995, 19.5005, 19.5505]) == (52, 49, 101, 100)
+
+
+def test_region_box_clipped_and_outside():
+    assert GRID.region_box([-156, -155.79, 19.59, 20]) == (0, 0, 10, 10)
+
+    with pytest.raises(ValueError):
+        GRID.region_box([-150, -149, 19.5, 19.55])
@@ -0,0 +1,55 @@
+import numpy as np
+from plotdata.helper_functions import bin_raster, draw_vectors
+
+
+DATA = np.array([[1, 2, 3, 4, 5],
+                 [5, 6, np.nan, 8, 9],
+                 [9, 10, 11, 12, np.nan],
+                 [np.nan, np.nan, 15, 16, 17],
+                 [17, 18, 19, 20, 21]], dtype=np.float32)
+
+
+def test_bin_raster_mean():
+    binned = bin_raster(DATA, 2, 2)
+
+    # Blocks on the last row and column are padded with NaNs, which are ignored
+    expected = [[3.5, 5, 7],
+                [9.5, 13.5, 17],
+                [17.5, 19.5, 21]]
+
+    assert binned.dtype == np.float32
+    np.testing.assert_allclose(binned, expected)
+
+
+def test_bin_raster_median():
+    binned = bin_raster(DATA, 3, 2, method='median')
+
+    expected = [[5.5, 8, 7],
+                [17.5, 17.5, 19]]
+
+    np.testing.assert_allclose(binned, expected)
+
+
+def test_bin_raster_all_nan_block():
+    data = DATA.copy()
+    data[3:, :2] = np.nan
+
+    binned = bin_raster(data, 2, 2)
+
+    assert np.isnan(binned[2, 0])
+    assert np.isfinite(binned).sum() == 8
+
+
+def test_bin_raster_factor_one():
+    np.testing.assert_array_equal(bin_raster(DATA, 1, 1), DATA)
+
+
+def test_draw_vectors_without_motion():
+    elevation = np.zeros((2, 5))
+    vertical = np.array([[0, 0, 0, 0, 0], [0, 1, 2, -4, 0]], dtype=float)
+    horizontal = np.array([[0, 0, 0, 0, 0], [2, 0, 0, 0, 1]], dtype=float)
+
+    x, v, h = draw_vectors(elevation, vertical, horizontal, [(-155.9, -155.1), (19.5, 19.5)])
+
+    np.testing.assert_array_equal(v, [[0, 0, 0, 0, 0], [0, 0.25, 0.5, -1, 0]])
+    np.testing.assert_array_equal(h, [[0, 0, 0, 0, 0], [0.5, 0, 0, 0, 0.25]])
@@ -0,0 +1,71 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+pytest.importorskip('pygmt')
+pytest.importorskip('xarray')
+
+import matplotlib
+matplotlib.use('Agg')
+
+from plotdata.plot import configure_dem, plot_section_sweep
+from plotdata.objects.geogrid import GeoGrid
+from plotdata.objects.dem_provider import DEM_PROVIDER
+
+
+def dem_inps(**kwargs):
+    inps = {'dem_cache_dir': None, 'offline': False, 'dem_cache_max_size': 5, 'dem_max_pixels': 4000000}
+    inps.update(kwargs)
+
+    return SimpleNamespace(**inps)
+
+
+def test_dem_store_only_on_request(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCRATCHDIR', str(tmp_path))
+    monkeypatch.setattr(DEM_PROVIDER, 'store', None)
+
+    configure_dem(dem_inps())
+    assert DEM_PROVIDER.store is None
+
+    configure_dem(dem_inps(dem_cache_dir=str(tmp_path / 'dem')))
+    assert DEM_PROVIDER.store.directory == str(tmp_path / 'dem')
+
+    configure_dem(dem_inps(offline=True))
+    assert DEM_PROVIDER.store.directory == str(tmp_path / 'dem_cache') and DEM_PROVIDER.store.offline
+
+    # A later run of the process without the options does not keep the store
+    configure_dem(dem_inps())
+    assert DEM_PROVIDER.store is None
+
+
+def test_dem_store_evicts_only_a_given_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCRATCHDIR', str(tmp_path))
+    monkeypatch.setattr(DEM_PROVIDER, 'store', None)
+
+    configure_dem(dem_inps(offline=True, dem_cache_max_size=0))
+    assert DEM_PROVIDER.store.max_size is None
+
+    configure_dem(dem_inps(dem_cache_dir=str(tmp_path / 'dem'), dem_cache_max_size=2))
+    assert DEM_PROVIDER.store.max_size == 2
+
+
+def test_section_sweep_at_sea_level():
+    # Relief and motion only north of 19.35, the section at 19.2 is over the (masked) sea
+    grid = GeoGrid(-156, 20, 0.01, -0.01, 100, 100)
+    north = grid.lats[:, None] > 19.35
+    horizontal = SimpleNamespace(velocity=np.where(north, 0.01, 0) * np.ones(grid.shape), grid=grid)
+    vertical = SimpleNamespace(velocity=np.where(north, -0.02, 0) * np.ones(grid.shape), grid=grid)
+
+    lats = np.linspace(19, 20, 101)
+    relief = np.where(lats[:, None] > 19.35, 1000 * (lats[:, None] - 19.35), 0) * np.ones((101, 101))
+    elevation = SimpleNamespace(map=SimpleNamespace(region=[-156, -155, 19, 20]), elevation=relief)
+    inps = SimpleNamespace(section_sweep=(3, 0.3), line=[(-155.9, -155.1), (19.5, 19.5)], resample_vector=1)
+
+    fig = plot_section_sweep(horizontal, vertical, elevation, inps)
+
+    sea, land = fig.axes[0], fig.axes[2]
+    assert sea.get_ylim() == pytest.approx(land.get_ylim()) and land.get_ylim()[1] == pytest.approx(900)
+    assert len(sea.collections[0].U) == 0
+    for ax in fig.axes[1:]:
+        assert len(ax.collections[0].U) > 0
+        assert np.isfinite(ax.collections[0].U).all() and np.isfinite(ax.collections[0].V).all()
@@ -0,0 +1,62 @@
+import os
+import pytest
+import numpy as np
+from types import SimpleNamespace
+from mintpy.utils import readfile, writefile
+from plotdata.objects.product_cache import ProductCache
+from plotdata.objects.scheduler import Task, Scheduler
+from plotdata.process_data import run_reference_point, get_normal_equations_file, add_track_tasks
+from conftest import write_eos_file
+from test_velocity_functions import lstsq_velocity
+
+
+def test_reference_point_with_the_same_reference(tmp_path):
+    velocity = np.arange(20 * 30, dtype=np.float32).reshape(20, 30) / 1000
+    metadata = {'FILE_TYPE': 'velocity', 'LENGTH': '20', 'WIDTH': '30', 'X_FIRST': '-155.6', 'Y_FIRST': '19.6',
+                'X_STEP': '0.001', 'Y_STEP': '-0.001', 'REF_Y': '5', 'REF_X': '7', 'UNIT': 'm/year', 'DATA_TYPE': 'float32'}
+    mskd_file = str(tmp_path / 'velocity_msk.h5')
+    ref_file = str(tmp_path / 'velocity_msk_ref.h5')
+    writefile.write({'velocity': velocity}, mskd_file, metadata=metadata)
+
+    cache = ProductCache(str(tmp_path))
+
+    # Pixel (5, 7), already the reference of the masked file
+    for key in ['r1', 'r2']:
+        task = Task('reference_point', run_reference_point, args=(mskd_file, (19.5945, -155.5925), ref_file),
+                    outputs={ref_file: key}, cache=cache)
+        task.func(*task.args)
+        task.finish()
+
+        assert cache.is_valid(ref_file, key)
+        data, attrs = readfile.read(ref_file)
+        np.testing.assert_allclose(data, velocity - velocity[5, 7], atol=1e-7)
+        assert (attrs['REF_Y'], attrs['REF_X']) == ('5', '7')
+
+
+def test_normal_equations_file_per_period():
+    files = {get_normal_equations_file('/p/velocity_20190101_20201231.h5', '20190101', end_date) for end_date in ['20201231', '20211231']}
+
+    assert files == {'/p/normal_equations_20190101_20201231.npz', '/p/normal_equations_20190101_20211231.npz'}
+
+
+def test_track_tasks_subset(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCRATCHDIR', str(tmp_path))
+    os.makedirs(tmp_path / 'MaunaLoaSenDT87' / 'mintpy')
+    dates, displacement = write_eos_file(str(tmp_path / 'MaunaLoaSenDT87' / 'mintpy' / 'S1_test.he5'))
+    inps = SimpleNamespace(ref_lalo=None, mask_vmin=0.7, region=[-155.595, -155.588, 19.58, 19.59], incremental=False,
+                           lat_step=None, flag_save_gbis=False)
+
+    scheduler = Scheduler()
+    track = add_track_tasks(scheduler, 'MaunaLoaSenDT87', [('20190101', '20191231')], inps)
+    scheduler.run()
+
+    # Pixels 5 to 12 of rows 10 to 20 only
+    assert [task.name.split()[0] for task in scheduler.tasks] == ['timeseries2velocity', 'coherence', 'mask']
+    velocity, metadata = readfile.read(track[('20190101', '20191231')])
+    coherence = readfile.read(str(tmp_path / 'MaunaLoa' / 'SenDT87' / 'geo_temporalCoherence_subset.h5'))[0]
+    expected = lstsq_velocity(dates, displacement, '20190101', '20191231')[10:20, 5:12]
+    expected[coherence < 0.7] = np.nan
+
+    assert (metadata['LENGTH'], metadata['WIDTH']) == ('10', '7')
+    assert float(metadata['X_FIRST']) == pytest.approx(-155.595) and float(metadata['Y_FIRST']) == pytest.approx(19.59)
+    np.testing.assert_allclose(velocity, expected, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,119 @@
+import os
+import time
+import pytest
+from plotdata.objects.product_cache import ProductCache
+
+
+def write(file, size):
+    with open(file, 'wb') as f:
+        f.write(b'0' * size)
+
+    return file
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ProductCache(str(tmp_path))
+
+
+def test_key_depends_on_params_upstream_and_inputs(cache, tmp_path):
+    source = write(str(tmp_path / 'source.he5'), 10)
+    key = cache.key('mask', inputs=[source], params={'mask_vmin': 0.7}, upstream=['a'])
+
+    assert key == cache.key('mask', inputs=[source], params={'mask_vmin': 0.7}, upstream=['a'])
+    assert key != cache.key('mask', inputs=[source], params={'mask_vmin': 0.8}, upstream=['a'])
+    assert key != cache.key('mask', inputs=[source], params={'mask_vmin': 0.7}, upstream=['b'])
+    assert key != cache.key('reference_point', inputs=[source], params={'mask_vmin': 0.7}, upstream=['a'])
+
+    # A rewritten input has another size and modification time
+    write(source, 20)
+    assert key != cache.key('mask', inputs=[source], params={'mask_vmin': 0.7}, upstream=['a'])
+
+
+def test_is_valid(cache, tmp_path):
+    product = str(tmp_path / 'velocity_msk.h5')
+
+    assert not cache.is_valid(product, 'k1')
+
+    write(product, 10)
+    assert not cache.is_valid(product, 'k1')
+
+    cache.record(product, 'k1', stage='mask')
+    assert cache.is_valid(product, 'k1')
+    assert not cache.is_valid(product, 'k2')
+
+    # Modified outside of the cache
+    write(product, 11)
+    assert not cache.is_valid(product, 'k1')
+
+
+def test_is_valid_does_not_write(cache, tmp_path):
+    product = write(str(tmp_path / 'hz.h5'), 10)
+    cache.record(product, 'k1')
+
+    with open(cache.manifest_file, 'rb') as f:
+        manifest = f.read()
+    modified = os.stat(cache.manifest_file).st_mtime_ns
+
+    assert cache.is_valid(product, 'k1', verbose=False)
+    assert not cache.is_valid(product, 'k2', verbose=False)
+
+    with open(cache.manifest_file, 'rb') as f:
+        assert f.read() == manifest
+    assert os.stat(cache.manifest_file).st_mtime_ns == modified
+
+
+def test_is_valid_does_not_create_the_directory(tmp_path):
+    directory = str(tmp_path / 'project')
+
+    assert not ProductCache(directory).is_valid(os.path.join(directory, 'hz.h5'), 'k1')
+    assert not os.path.exists(directory)
+
+
+def test_evict_least_recently_used(cache, tmp_path):
+    products = [write(str(tmp_path / f'p{i}.h5'), 10) for i in range(3)]
+
+    for product in products:
+        cache.record(product, 'k')
+
+    # 0.4 GB each, as recorded
+    manifest = cache.read_manifest()
+    for entry in manifest.values():
+        entry['size'] = 0.4 * 1024**3
+    cache._write_manifest(manifest)
+
+    # p0 is used after p1, so p1 is the least recently used
+    time.sleep(0.01)
+    cache.touch([products[0]])
+
+    removed = cache.evict(max_size=1)
+
+    assert removed == [os.path.abspath(products[1])]
+    assert not os.path.exists(products[1])
+    assert os.path.exists(products[0]) and os.path.exists(products[2])
+    assert sorted(cache.read_manifest()) == sorted(os.path.abspath(product) for product in [products[0], products[2]])
+
+
+def test_evict_keeps_products_in_use(cache, tmp_path):
+    products = [write(str(tmp_path / f'p{i}.h5'), 10) for i in range(3)]
+
+    for product in products:
+        cache.record(product, 'k')
+
+    removed = cache.evict(max_size=0, keep=[products[1]])
+
+    assert sorted(removed) == sorted(os.path.abspath(product) for product in [products[0], products[2]])
+    assert os.path.exists(products[1])
+
+
+def test_evict_by_age(cache, tmp_path):
+    old, new = write(str(tmp_path / 'old.h5'), 10), write(str(tmp_path / 'new.h5'), 10)
+    cache.record(old, 'k')
+    cache.record(new, 'k')
+
+    manifest = cache.read_manifest()
+    manifest[os.path.abspath(old)]['accessed'] -= 3 * 86400
+    cache._write_manifest(manifest)
+
+    assert cache.evict(max_age=2) == [os.path.abspath(old)]
+    assert os.path.exists(new)
@@ -0,0 +1,117 @@
+import os
+import pytest
+from plotdata.objects.product_cache import ProductCache
+from plotdata.objects.scheduler import Task, Scheduler
+
+
+def write(file, text):
+    with open(file, 'w') as f:
+        f.write(text)
+
+    return len(text)
+
+
+def make_tasks(tmp_path):
+    cache = ProductCache(str(tmp_path))
+    mask = Task('mask track', write, args=(str(tmp_path / 'msk.h5'), 'mask'),
+                outputs={str(tmp_path / 'msk.h5'): 'm1'}, cache=cache)
+    geocode = Task('geocode track', write, args=(str(tmp_path / 'geo.h5'), 'geo'),
+                   outputs={str(tmp_path / 'geo.h5'): 'g1'}, cache=cache)
+    reference = Task('reference_point', write, args=(str(tmp_path / 'ref.h5'), 'ref'), deps=[mask],
+                     outputs={str(tmp_path / 'ref.h5'): 'r1'}, cache=cache)
+    save = Task('save_gbis', write, args=(str(tmp_path / 'gbis.txt'), 'gbis'), deps=[reference])
+    return cache, mask, geocode, reference, save
+
+
+def schedule(tasks):
+    scheduler = Scheduler()
+    for task in tasks:
+        scheduler.add(task)
+
+    return scheduler
+
+
+def test_first_run_runs_everything_and_records_outputs(tmp_path):
+    cache, *tasks = make_tasks(tmp_path)
+    scheduler = schedule(tasks)
+
+    assert all(scheduler.plan().values())
+
+    scheduler.run()
+
+    assert [task.result for task in tasks] == [4, 3, 3, 4]
+    assert cache.is_valid(str(tmp_path / 'ref.h5'), 'r1')
+    assert not any(schedule(make_tasks(tmp_path)[1:4]).plan().values())
+
+
+def test_stale_output_propagates_to_dependents(tmp_path):
+    schedule(make_tasks(tmp_path)[1:]).run()
+
+    _, mask, geocode, reference, save = make_tasks(tmp_path)
+    mask.outputs = {str(tmp_path / 'msk.h5'): 'm2'}
+    run = schedule([mask, geocode, reference, save]).plan()
+
+    # geocode is up to date while its sibling mask and everything after it is stale
+    assert run == {mask: True, geocode: False, reference: True, save: True}
+
+
+def test_task_without_outputs_runs_only_for_a_dependent(tmp_path):
+    cache = ProductCache(str(tmp_path))
+    product = str(tmp_path / 'hz.h5')
+    download = Task('download', write, args=(str(tmp_path / 'dem.txt'), 'dem'))
+    horzvert = Task('horzvert', write, args=(product, 'hz'), deps=[download], outputs={product: 'h1'}, cache=cache)
+
+    assert schedule([download, horzvert]).plan() == {download: True, horzvert: True}
+
+    schedule([download, horzvert]).run()
+
+    download = Task('download', write, args=(str(tmp_path / 'dem.txt'), 'dem'))
+    horzvert = Task('horzvert', write, args=(product, 'hz'), deps=[download], outputs={product: 'h1'}, cache=cache)
+    assert schedule([download, horzvert]).plan() == {download: False, horzvert: False}
+
+
+def test_skipped_tasks_are_touched(tmp_path):
+    cache, *tasks = make_tasks(tmp_path)
+    schedule(tasks).run()
+
+    manifest = cache.read_manifest()
+    for entry in manifest.values():
+        entry['accessed'] -= 100
+    cache._write_manifest(manifest)
+
+    _, mask, geocode, reference, save = make_tasks(tmp_path)
+    schedule([mask, geocode, reference, save]).run()
+
+    assert mask.result is None and reference.result is None
+    assert save.result == 4
+    accessed = cache.read_manifest()[os.path.abspath(tmp_path / 'msk.h5')]['accessed']
+    assert accessed > manifest[os.path.abspath(tmp_path / 'msk.h5')]['accessed']
+
+
+def test_print_plan_does_not_write(tmp_path, capsys):
+    cache, *tasks = make_tasks(tmp_path)
+    schedule(tasks).run()
+
+    with open(cache.manifest_file, 'rb') as f:
+        manifest = f.read()
+
+    _, mask, geocode, reference, save = make_tasks(tmp_path)
+    mask.outputs = {str(tmp_path / 'msk.h5'): 'm2'}
+    schedule([mask, geocode, reference, save]).print_plan()
+
+    assert 'Plan: 4 tasks, 3 to run, 1 up to date' in capsys.readouterr().out
+    with open(cache.manifest_file, 'rb') as f:
+        assert f.read() == manifest
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_missing_dependency(tmp_path, jobs):
+    _, mask, geocode, reference, save = make_tasks(tmp_path)
+    scheduler = Scheduler(jobs=jobs)
+    scheduler.add(reference)
+    scheduler.add(save)
+
+    with pytest.raises(ValueError, match='mask track'):
+        scheduler.run()
+
+    assert reference.result is None
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pygmt')
+pytest.importorskip('pandas')
+
+from plotdata.objects.section import Section
+
+
+def baseline_section(data, region, latitude, longitude):
+    """ Sampling of the nearest nodes of a gridline-registered grid, as Section did before it took a GeoGrid """
+    lat_res = (region[3] - region[2]) / (data.shape[0] - 1)
+    lon_res = (region[1] - region[0]) / (data.shape[1] - 1)
+    num_points = int(np.sqrt((latitude[1] - latitude[0])**2 + (longitude[1] - longitude[0])**2) / min(lat_res, lon_res))
+
+    lon_indices = np.round((np.linspace(longitude[0], longitude[1], num_points) - region[0]) / lon_res).astype(int)
+    lat_indices = np.round((np.linspace(latitude[0], latitude[1], num_points) - region[2]) / lat_res).astype(int)
+
+    return data[np.clip(lat_indices, 0, data.shape[0] - 1), np.clip(lon_indices, 0, data.shape[1] - 1)]
+
+
+def test_section_samples_the_nearest_relief_nodes():
+    # 1 arc minute relief of 121 x 91 nodes, south-up as pygmt grids
+    region = [-156.0, -154.5, 19.0, 21.0]
+    data = np.random.default_rng(0).uniform(0, 4000, (121, 91)).astype(np.float32)
+
+    for latitude, longitude in [((19.1234, 20.8765), (-155.9012, -154.6123)),
+                                ((20.5, 19.2), (-154.7, -155.95)),
+                                ((19.01, 19.01), (-155.99, -154.51))]:
+        section = Section(data, region, latitude, longitude)
+
+        np.testing.assert_array_equal(np.asarray(section.values), baseline_section(data, region, latitude, longitude))
@@ -0,0 +1,189 @@
+import os
+import shutil
+import h5py
+import numpy as np
+import pytest
+from conftest import write_eos_file
+from plotdata import velocity_functions
+from plotdata.helper_functions import read_metadata
+from plotdata.velocity_functions import (design_matrix, get_period_indices, estimate_velocity, estimate_velocities,
+                                         estimate_velocity_incremental, load_normal_equations, save_normal_equations,
+                                         parse_duration, get_sliding_windows, estimate_sliding_velocities,
+                                         read_sliding_window, read_sliding_window_dates)
+
+
+def lstsq_velocity(dates, displacement, start_date, end_date):
+    """ Reference velocity of each pixel, solved with numpy.linalg.lstsq; pixels with a NaN acquisition are NaN """
+    index = get_period_indices(dates, start_date, end_date)
+    data = displacement[index].reshape(len(index), -1).astype(np.float64)
+    nan = np.isnan(data).any(axis=0)
+    data[:, nan] = 0
+
+    velocity = np.linalg.lstsq(design_matrix([dates[i] for i in index]), data, rcond=None)[0][0]
+    velocity[nan] = np.nan
+
+    return velocity.reshape(displacement.shape[1:])
+
+
+def test_estimate_velocities_matches_lstsq(eos_file):
+    fname, dates, displacement = eos_file
+    periods = [('20190101', '20191231'), ('20190301', '20200420'), ('20190601', '20190801')]
+
+    velocities = estimate_velocities(fname, periods, chunk_rows=7)
+
+    for velocity, (start_date, end_date) in zip(velocities, periods):
+        expected = lstsq_velocity(dates, displacement, start_date, end_date)
+        assert velocity.dtype == np.float32
+        np.testing.assert_allclose(velocity, expected, rtol=1e-4, atol=1e-6)
+
+    # The NaN acquisition is in the first two periods only
+    assert np.isnan(velocities[0][3, 4]) and np.isnan(velocities[1][3, 4])
+    assert np.isfinite(velocities[2][3, 4])
+    assert np.isnan(velocities[0]).sum() == 1
+
+
+def test_estimate_velocity_box(eos_file):
+    fname, dates, displacement = eos_file
+    box = (2, 5, 17, 26)
+
+    velocity = estimate_velocity(fname, '20190301', '20200420', box=box, chunk_rows=4)
+
+    expected = lstsq_velocity(dates, displacement, '20190301', '20200420')[5:26, 2:17]
+    assert velocity.shape == (21, 15)
+    np.testing.assert_allclose(velocity, expected, rtol=1e-4, atol=1e-6)
+
+
+def test_period_with_one_acquisition(eos_file):
+    fname = eos_file[0]
+
+    with pytest.raises(ValueError):
+        estimate_velocities(fname, [('20190102', '20190112')])
+
+
+def test_incremental_velocity_matches_lstsq(eos_file, tmp_path, capsys):
+    fname, dates, displacement = eos_file
+    state_file = str(tmp_path / 'state' / 'velocity_20190101.npz')
+
+    for end_date, message in [('20191231', 'adding 31, removing 0'),
+                              ('20200131', 'adding 2, removing 0'),
+                              ('20191130', 'adding 0, removing 5')]:
+        velocity = estimate_velocity_incremental(fname, '20190101', end_date, state_file)
+
+        assert message in capsys.readouterr().out
+        np.testing.assert_allclose(velocity, lstsq_velocity(dates, displacement, '20190101', end_date), rtol=1e-4, atol=1e-6)
+        assert load_normal_equations(state_file)['dates'].tolist() == [date for date in dates if date <= end_date]
+
+
+def test_incremental_velocity_rebuilds_for_another_box(eos_file, tmp_path, capsys):
+    fname, dates, displacement = eos_file
+    state_file = str(tmp_path / 'velocity.npz')
+
+    estimate_velocity_incremental(fname, '20190101', '20191231', state_file)
+    velocity = estimate_velocity_incremental(fname, '20190101', '20200131', state_file, box=(2, 5, 17, 26))
+
+    assert 'adding 33, removing 0' in capsys.readouterr().out.splitlines()[-1]
+    expected = lstsq_velocity(dates, displacement, '20190101', '20200131')[5:26, 2:17]
+    np.testing.assert_allclose(velocity, expected, rtol=1e-4, atol=1e-6)
+
+
+def keep_dates(eos_file, n_dates):
+    """ Drops the acquisitions after the first n_dates, as if they were not yet appended """
+    with h5py.File(eos_file, 'r+') as f:
+        for name in ['displacement', 'date', 'bperp']:
+            dset = f'HDFEOS/GRIDS/timeseries/observation/{name}'
+            data = f[dset][:n_dates]
+            del f[dset]
+            f[dset] = data
+
+
+def test_incremental_velocity_appended_acquisitions(tmp_path, capsys):
+    fname = str(tmp_path / 'S1_test.he5')
+    state_file = str(tmp_path / 'normal_equations_20190101_20201231.npz')
+    dates, displacement = write_eos_file(str(tmp_path / 'S1_full.he5'), n_dates=45)
+    shutil.copy(tmp_path / 'S1_full.he5', fname)
+    keep_dates(fname, 40)
+
+    estimate_velocity_incremental(fname, '20190101', '20201231', state_file)
+    shutil.copy(tmp_path / 'S1_full.he5', fname)
+    velocity = estimate_velocity_incremental(fname, '20190101', '20201231', state_file)
+
+    assert 'adding 5, removing 0' in capsys.readouterr().out.splitlines()[-1]
+    np.testing.assert_allclose(velocity, lstsq_velocity(dates, displacement, '20190101', '20201231'), rtol=1e-4, atol=1e-6)
+
+
+def test_incremental_velocity_reprocessed_file(eos_file, tmp_path, capsys):
+    fname = eos_file[0]
+    state_file = str(tmp_path / 'normal_equations_20190101_20201231.npz')
+    estimate_velocity_incremental(fname, '20190101', '20201231', state_file)
+
+    # Same acquisitions, other displacement
+    dates, displacement = write_eos_file(fname, seed=1)
+    velocity = estimate_velocity_incremental(fname, '20190101', '20201231', state_file)
+
+    out = capsys.readouterr().out
+    assert 'WARNING: acquisitions of S1_test.he5 changed' in out
+    assert 'adding 40, removing 0' in out.splitlines()[-1]
+    np.testing.assert_allclose(velocity, lstsq_velocity(dates, displacement, '20190101', '20201231'), rtol=1e-4, atol=1e-6)
+
+    # The rebuilt equations are not checked again while the file is unchanged
+    estimate_velocity_incremental(fname, '20190101', '20201231', state_file)
+    assert capsys.readouterr().out.splitlines()[-1].endswith('adding 0, removing 0 acquisitions')
+
+
+def test_save_normal_equations_relative_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    save_normal_equations({'start_date': '20190101', 'n': 3.0, 'sum_t': 1.5, 'sum_tt': 1.25}, 'velocity.npz')
+
+    assert os.listdir(tmp_path) == ['velocity.npz']
+    state = load_normal_equations('velocity.npz')
+    assert (state['start_date'], state['n'], state['sum_t'], state['sum_tt']) == ('20190101', 3.0, 1.5, 1.25)
+
+
+def test_get_sliding_windows():
+    dates = ['20200101', '20200115', '20200201', '20200301', '20200302', '20200601']
+
+    # Windows from 20200401 and 20200501 have fewer than two acquisitions, none starts after 20200501
+    assert get_sliding_windows(dates, parse_duration('1M'), parse_duration('1M')) == [(0, 3), (2, 4), (3, 5)]
+
+    # Windows end within the dates
+    assert get_sliding_windows(dates, parse_duration('5M'), parse_duration('1Y')) == [(0, 6)]
+    assert get_sliding_windows(dates, parse_duration('6M'), parse_duration('1M')) == []
+
+    with pytest.raises(ValueError):
+        parse_duration('6 months')
+
+
+def test_sliding_velocities_match_lstsq(eos_file, tmp_path, monkeypatch):
+    fname, dates, displacement = eos_file
+    box = (2, 5, 17, 26)
+    out_file = str(tmp_path / 'sliding' / 'velocity_sliding.h5')
+
+    # Small enough for several blocks of rows
+    monkeypatch.setattr(velocity_functions, 'SLIDING_WINDOW_MEMORY', 8 * 3 * 41 * 15 * 4)
+
+    windows = get_sliding_windows(dates, parse_duration('4M'), parse_duration('2M'))
+    assert windows[:2] == [(0, 11), (5, 16)]
+
+    estimate_sliding_velocities(fname, windows, out_file, read_metadata(fname), box=box)
+
+    assert read_sliding_window_dates(out_file) == [(dates[i], dates[j - 1]) for i, j in windows]
+
+    for k, (i, j) in enumerate(windows):
+        velocity, start_date, end_date = read_sliding_window(out_file, k)
+        expected = lstsq_velocity(dates, displacement, dates[i], dates[j - 1])[5:26, 2:17]
+        np.testing.assert_allclose(velocity, expected, rtol=1e-4, atol=1e-6)
+
+
+def test_sliding_velocities_masked(eos_file, tmp_path):
+    fname, dates, displacement = eos_file
+    out_file = str(tmp_path / 'velocity_sliding.h5')
+    windows = get_sliding_windows(dates, parse_duration('4M'), parse_duration('2M'))
+
+    estimate_sliding_velocities(fname, windows, out_file, read_metadata(fname), mask_vmin=0.7)
+
+    with h5py.File(fname, 'r') as f:
+        coherence = f['HDFEOS/GRIDS/timeseries/quality/temporalCoherence'][:]
+
+    velocity = read_sliding_window(out_file, 2)[0]
+    assert np.array_equal(np.isnan(velocity), coherence < 0.7)